@@ -0,0 +1,294 @@
+# 批量运行: 从 JSONL 读取 {topic, user_params} 任务, 在同一个事件循环上用 worker 池并发执行工作流
+#
+#   python batch.py jobs.jsonl --workers 4 --results data/batch/results.jsonl
+#
+# - 每个任务有独立的 run_id (thread_id / 产物目录), 单个任务失败不影响其他任务
+# - 所有任务共享进程内的 Provider 配额 (rate_limiter, RATE_LIMIT_*) 和视觉流水线, 并发 worker 再多也不会超过全局上限
+# - 结果逐行追加到 results JSONL; 再次运行同一个任务文件时跳过已成功的任务, 未完成的任务从各自的检查点继续,
+#   流程已跑完却没有成片的任务 (以及 --rerun 时的所有任务) 换一个新的 thread (batch-<id>-<attempt>) 从头执行
+# - Ctrl+C / SIGTERM: 第一次停止领取新任务, 等待进行中的任务结束; 第二次取消进行中的任务 (已完成的 superstep 保留在检查点中)
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from main import build_app, MAX_CONCURRENCY, CHECKPOINT_DB
+from src.services.artifact_store import run_scope, get_artifact_store, MANIFEST_NAME
+from src.services.rate_limiter import get_governor
+from src.services.tracing import export_run
+from src.services.export_profiles import resolve_export_profile
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+BATCH_RESULTS = os.getenv("BATCH_RESULTS", str(Path("data") / "batch" / "results.jsonl"))
+
+# 任务结果状态; INTERRUPTED / TIMEOUT / FAILED 的任务下次运行会从检查点继续 (检查点已跑完的换新 thread 重跑)
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TIMEOUT = "timeout"
+INTERRUPTED = "interrupted"
+INVALID = "invalid"
+
+
+def job_id_of(job: Dict[str, Any]) -> str:
+    """任务 ID: 优先使用任务里的 id 字段, 否则由 topic + user_params 决定 (同样的输入重复提交视为同一个任务)"""
+    if job.get("id"):
+        return str(job["id"])
+    payload = json.dumps({"topic": job.get("topic"), "user_params": job.get("user_params") or {}},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def validate_user_params(user_params: Any) -> Optional[str]:
+    """提交前检查 user_params, 返回错误信息; 无效的导出档位在这里报出, 不用等到整条流水线跑到合成阶段"""
+    if user_params is None:
+        return None
+    if not isinstance(user_params, dict):
+        return "user_params must be a JSON object"
+    try:
+        resolve_export_profile(user_params)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def load_jobs(path: str) -> List[Dict[str, Any]]:
+    jobs, seen = [], set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                job = {"id": f"line-{line_no}", "error": f"invalid JSON: {e}"}
+            if not isinstance(job, dict):
+                job = {"id": f"line-{line_no}", "error": "job must be a JSON object"}
+            elif "error" not in job:
+                job["error"] = validate_user_params(job.get("user_params"))
+            job["id"] = job_id_of(job)
+            if job["id"] in seen:
+                print(f"[Batch] Duplicate job {job['id']} at line {line_no}, skipped")
+                continue
+            seen.add(job["id"])
+            jobs.append(job)
+    return jobs
+
+
+def load_results(path: str) -> Dict[str, Dict[str, Any]]:
+    """每个任务最后一条结果 (结果文件只追加, 后写的覆盖先写的)"""
+    results = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue    # 上次被强制结束时可能留下半行
+                results[record.get("job_id")] = record
+    return results
+
+
+class ResultWriter:
+    """逐行追加写结果; 每条都 fsync, 进程被杀掉也不会丢失已完成任务的结果"""
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = asyncio.Lock()
+
+    async def write(self, record: Dict[str, Any]):
+        async with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BatchRunner:
+    def __init__(self, app, writer: ResultWriter, workers: int = BATCH_WORKERS,
+                 job_timeout: Optional[float] = None, max_concurrency: int = MAX_CONCURRENCY):
+        self.app = app
+        self.writer = writer
+        self.workers = max(1, workers)
+        self.job_timeout = job_timeout
+        self.max_concurrency = max_concurrency
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.stopping = False
+        self.running: Dict[str, asyncio.Task] = {}
+        self.counts: Dict[str, int] = {}
+
+    def request_stop(self):
+        if not self.stopping:
+            self.stopping = True
+            print(f"\n[Batch] Shutdown requested: no new jobs, waiting for {len(self.running)} running job(s); "
+                  f"press Ctrl+C again to interrupt them (progress is kept in checkpoints)")
+            return
+        print(f"\n[Batch] Interrupting {len(self.running)} running job(s)...")
+        for task in self.running.values():
+            task.cancel()
+
+    async def run(self, jobs: List[Dict[str, Any]]):
+        for job in jobs:
+            self.queue.put_nowait(job)
+        workers = [asyncio.create_task(self._worker(index), name=f"batch-worker-{index}")
+                   for index in range(min(self.workers, len(jobs)))]
+        await asyncio.gather(*workers)
+
+    async def _worker(self, index: int):
+        while not self.stopping:
+            try:
+                job = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            # 每个任务在独立的 task 里执行: 取消只影响这个任务 (_run_job 捕获取消并返回 INTERRUPTED 记录),
+            # 且 run_scope 设置的 run_id 不会泄漏到下一个任务
+            task = asyncio.create_task(self._run_job(job), name=f"job-{job['id']}")
+            self.running[job["id"]] = task
+            try:
+                record = await task
+            finally:
+                self.running.pop(job["id"], None)
+            self.counts[record["status"]] = self.counts.get(record["status"], 0) + 1
+            await self.writer.write(record)
+            print(f"[Batch] worker-{index} {record['job_id']} -> {record['status']} ({record['elapsed']}s)"
+                  + (f": {record['error']}" if record.get("error") else ""))
+
+    async def _run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        run_id = job.get("run_id") or f"batch-{job['id']}"
+        started_at, clock = time.time(), time.perf_counter()
+        record = {"job_id": job["id"], "run_id": run_id, "attempt": job.get("attempt", 1), "topic": job.get("topic"),
+                  "status": None, "final_video_path": None, "manifest_path": None, "trace_path": None, "error": None,
+                  "resumed": False, "started_at": round(started_at, 3)}
+        try:
+            if job.get("error") or not job.get("topic"):
+                record.update(status=INVALID, error=job.get("error") or "missing topic")
+                return record
+            run_id, record["attempt"] = await self._resolve_thread(job, run_id, record["attempt"])
+            record["run_id"] = run_id
+            with run_scope(run_id):
+                coro = self._invoke(job, run_id, record)
+                result = await (asyncio.wait_for(coro, self.job_timeout) if self.job_timeout else coro)
+            record["final_video_path"] = result.get("final_video_path") or None
+            if record["final_video_path"]:
+                record["status"] = SUCCEEDED
+            else:
+                logs = result.get("logs") or []
+                record.update(status=FAILED, error=next((log for log in logs if "Error" in log), "no final video"))
+        except asyncio.TimeoutError:
+            record.update(status=TIMEOUT, error=f"job exceeded {self.job_timeout}s")
+        except asyncio.CancelledError:
+            record.update(status=INTERRUPTED, error="interrupted by shutdown")
+        except Exception as e:
+            record.update(status=FAILED, error=f"{type(e).__name__}: {e}")
+        finally:
+            record["finished_at"] = round(time.time(), 3)
+            record["elapsed"] = round(time.perf_counter() - clock, 2)
+            # 每个任务结束就导出并释放它的 span, 长时间批量运行时内存里只有进行中任务的 span
+            try:
+                record["trace_path"] = export_run(run_id)
+            except Exception as e:
+                print(f"[Batch] Trace export failed for {job['id']}: {e}")
+            manifest_path = get_artifact_store().run_dir(run_id) / MANIFEST_NAME
+            record["manifest_path"] = str(manifest_path) if manifest_path.exists() else None
+        return record
+
+    async def _resolve_thread(self, job: Dict[str, Any], run_id: str, attempt: int):
+        """
+        选择本次执行使用的 thread (run_id): 未完成的检查点沿用原 thread 继续;
+        已经跑完的检查点在 --rerun 或上次没有产出成片 (例如渲染失败) 时换一个新 thread 从头执行,
+        否则同一个 thread 每次都会直接返回上次的结果
+        """
+        while True:
+            snapshot = await self.app.aget_state({"configurable": {"thread_id": run_id}})
+            finished = bool(snapshot.values) and not snapshot.next
+            if not finished or not (job.get("rerun") or not snapshot.values.get("final_video_path")):
+                return run_id, attempt
+            previous_run_id, attempt = run_id, attempt + 1
+            run_id = f"batch-{job['id']}-{attempt}"
+            print(f"[Batch] {job['id']}: checkpoint {previous_run_id} already finished, starting fresh attempt {attempt} ({run_id})")
+
+    async def _invoke(self, job: Dict[str, Any], run_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        config = {
+            "configurable": {"thread_id": run_id},
+            "max_concurrency": self.max_concurrency,
+        }
+        # 上次中断/失败的任务从最后一个检查点继续, 已经生成的镜头不会重跑
+        snapshot = await self.app.aget_state(config)
+        if snapshot.values:
+            if not snapshot.next:
+                return snapshot.values
+            record["resumed"] = True
+            print(f"[Batch] Resuming {job['id']} at {list(snapshot.next)}")
+            return await self.app.ainvoke(None, config)
+
+        initial_input = {"topic": job["topic"], "user_params": job.get("user_params") or {}}
+        print(f"[Batch] Starting {job['id']}: {job['topic']}")
+        return await self.app.ainvoke(initial_input, config)
+
+
+def install_signal_handlers(runner: BatchRunner):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, runner.request_stop)
+        except (NotImplementedError, RuntimeError):
+            # Windows 没有 add_signal_handler, 退回到 signal.signal 再转发到事件循环
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(runner.request_stop))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TtV Agent: 批量文生视频")
+    parser.add_argument("jobs", help="任务文件 (JSONL, 每行 {\"topic\": ..., \"user_params\": {...}}, 可选 id)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="同时运行的任务数")
+    parser.add_argument("--results", default=BATCH_RESULTS, help="结果文件 (JSONL, 追加写)")
+    parser.add_argument("--checkpoint-db", default=CHECKPOINT_DB, help="Checkpoint SQLite 文件路径")
+    parser.add_argument("--job-timeout", type=float, default=None, help="单个任务的超时(秒), 超时的任务下次从检查点继续")
+    parser.add_argument("--rerun", action="store_true", help="已成功的任务也重新执行 (使用新的 thread / 产物目录)")
+    return parser.parse_args()
+
+
+async def run_batch(args) -> Dict[str, int]:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    jobs = load_jobs(args.jobs)
+    previous = load_results(args.results)
+    pending = [job for job in jobs if args.rerun or previous.get(job["id"], {}).get("status") != SUCCEEDED]
+    for job in pending:
+        # 沿用上一次执行的 thread (中断/超时的任务从检查点继续), 是否需要换新 thread 由 _resolve_thread 决定
+        last = previous.get(job["id"], {})
+        job.update(run_id=last.get("run_id"), attempt=last.get("attempt", 1), rerun=args.rerun)
+    print(f"--- Batch: {len(jobs)} jobs, {len(jobs) - len(pending)} already succeeded, "
+          f"{len(pending)} to run with {args.workers} workers ---")
+    if not pending:
+        return {}
+
+    Path(args.checkpoint_db).parent.mkdir(parents=True, exist_ok=True)
+    writer = ResultWriter(args.results)
+    runner = BatchRunner(None, writer, workers=args.workers, job_timeout=args.job_timeout)
+    started_at = time.perf_counter()
+    try:
+        async with AsyncSqliteSaver.from_conn_string(args.checkpoint_db) as checkpointer:
+            runner.app = build_app(checkpointer=checkpointer)
+            install_signal_handlers(runner)
+            await runner.run(pending)
+    finally:
+        writer.close()
+
+    remaining = runner.queue.qsize()
+    print(f"--- Batch finished in {time.perf_counter() - started_at:.1f}s: {runner.counts}"
+          + (f", {remaining} not started (re-run to continue)" if remaining else "") + " ---")
+    print(get_governor().report())
+    return runner.counts
+
+
+if __name__ == "__main__":
+    counts = asyncio.run(run_batch(parse_args()))
+    sys.exit(0 if set(counts) <= {SUCCEEDED} else 1)
@@ -1,48 +1,136 @@
 # Graph组装
+import os
+import uuid
+import asyncio
+import argparse
+from pathlib import Path
 from langgraph.graph import StateGraph, END
+from langgraph.types import Send
 from src.core.state import GraphState
+from src.services.artifact_store import run_scope
+from src.services.tracing import trace_node, get_tracer, export_run
 from src.nodes import n0_init, n1_script, n2_audio, n2_visual, n3_merge
 
-def build_app():
+# 单镜头子任务的最大并发数 (同一时刻最多有多少个 audio_gen/visual_gen 在跑)
+# Provider 请求的并发由 visual_pipeline 各阶段的 worker 池控制, 这里放宽, 让镜头能在各阶段队列里排队形成流水线
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "32"))
+
+# 本地 Checkpoint 数据库 (SQLite), 每次运行以 run_id 作为 thread_id 记录每个 superstep 的状态
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", str(Path("data") / "checkpoints.sqlite"))
+
+def dispatch_shots(state: GraphState):
+    """Map 步骤: 为每个 StoryboardItem 分发一个音频子任务和一个视觉子任务"""
+    storyboard = state.get("storyboard", [])
+    if not storyboard:
+        # 没有分镜时直接进入合成节点, 由 merge_node 记录错误
+        return "merge"
+
+    sends = []
+    for item in storyboard:
+        shot_input = {
+            "shot": item,
+            "anchor_character_img": state["anchor_character_img"],
+            "user_params": state["user_params"],
+        }
+        sends.append(Send("audio_gen", shot_input))
+        sends.append(Send("visual_gen", shot_input))
+    return sends
+
+def build_app(checkpointer=None):
     # 1. 初始化 Graph
     workflow = StateGraph(GraphState)
 
     # 2. 添加节点
-    workflow.add_node("init", n0_init.init_node)            # 初始化与锚点生成
-    workflow.add_node("script", n1_script.script_node)      # 脚本与分镜规划
-    workflow.add_node("audio_gen", n2_audio.audio_node)     # 音频并行流
-    workflow.add_node("visual_gen", n2_visual.visual_node)  # 视觉并行流 (含生成-校验循环)
-    workflow.add_node("merge", n3_merge.merge_node)         # 后期合成
+    # 每个节点 (单镜头节点按镜头) 记录一个 span, 其中的 Provider 调用/下载/渲染阶段作为子 span
+    workflow.add_node("init", trace_node("init", n0_init.init_node))                # 初始化与锚点生成
+    workflow.add_node("script", trace_node("script", n1_script.script_node))        # 脚本与分镜规划
+    workflow.add_node("audio_gen", trace_node("audio_gen", n2_audio.audio_node))    # 音频并行流 (单镜头)
+    workflow.add_node("visual_gen", trace_node("visual_gen", n2_visual.visual_node))  # 视觉并行流 (单镜头, 含生成-校验循环)
+    workflow.add_node("merge", trace_node("merge", n3_merge.merge_node))            # 后期合成
 
     # 3. 定义边 (流程走向)
     # Start -> Init -> Script
     workflow.set_entry_point("init")
     workflow.add_edge("init", "script")
 
-    # Script -> (并行) Audio & Visual
-    # 在 LangGraph 中，从一个节点指向多个节点即代表分支
-    workflow.add_edge("script", "audio_gen")
-    workflow.add_edge("script", "visual_gen")
+    # Script -> (按分镜 Fan-out) Audio & Visual
+    # 每个分镜各发一个 Send, 所有镜头在同一个 superstep 内并发执行,
+    # 总耗时取决于最慢的镜头而不是所有镜头之和。并发上限由 invoke 时的 max_concurrency 控制。
+    workflow.add_conditional_edges("script", dispatch_shots, ["audio_gen", "visual_gen", "merge"])
 
     # (并行) -> Merge
-    # Merge 节点需要等待 Audio 和 Visual 都完成。
-    # 注意：LangGraph 默认等待所有前置分支完成才会进入汇聚节点。
+    # Merge 节点需要等待所有镜头的 Audio 和 Visual 都完成,
+    # 各镜头的结果由 GraphState.storyboard 的 Reducer 按 id 合并。
     workflow.add_edge(["audio_gen", "visual_gen"], "merge")
 
     # Merge -> End
     workflow.add_edge("merge", END)
 
-    return workflow.compile()
+    # 带 checkpointer 编译后, 每个 superstep 结束都会落盘;
+    # 同一 superstep 内已成功的 Send 子任务(单镜头)的结果也会被保存, 恢复时不会重跑。
+    return workflow.compile(checkpointer=checkpointer)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TtV Agent: 文生视频工作流")
+    parser.add_argument("--run-id", default=None, help="本次运行的 ID (默认随机生成); 恢复时必填")
+    parser.add_argument("--resume", action="store_true", help="从 run-id 对应运行的最后一个检查点继续执行")
+    parser.add_argument("--checkpoint-db", default=CHECKPOINT_DB, help="Checkpoint SQLite 文件路径")
+    parser.add_argument("--profile", default=None, choices=["draft", "preview", "production"],
+                        help="导出档位 (默认使用环境变量 EXPORT_PROFILE)")
+    return parser.parse_args()
+
+async def run(args):
+    if args.resume and not args.run_id:
+        raise SystemExit("--resume 需要同时指定 --run-id")
+    run_id = args.run_id or uuid.uuid4().hex[:12]
+    Path(args.checkpoint_db).parent.mkdir(parents=True, exist_ok=True)
+
+    # 所有产物写入 <ARTIFACT_ROOT>/<run_id>/, 并发的多次运行互不覆盖; 恢复时沿用同一个目录和 manifest
+    with run_scope(run_id):
+        try:
+            return await execute(args, run_id)
+        finally:
+            # 失败/中断的运行也输出耗时, 便于定位卡在哪个阶段
+            report_trace(run_id)
+
+async def execute(args, run_id: str):
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    async with AsyncSqliteSaver.from_conn_string(args.checkpoint_db) as checkpointer:
+        app = build_app(checkpointer=checkpointer)
+        config = {
+            "configurable": {"thread_id": run_id},
+            "max_concurrency": MAX_CONCURRENCY,
+        }
+
+        if args.resume:
+            snapshot = await app.aget_state(config)
+            if not snapshot.values:
+                raise SystemExit(f"找不到运行记录: {run_id}")
+            if not snapshot.next:
+                print(f"--- Run {run_id} already finished ---")
+                return snapshot.values
+            print(f"--- Resuming Run {run_id} at {list(snapshot.next)} ---")
+            # 输入为 None 表示从最后一个检查点继续
+            return await app.ainvoke(None, config)
+
+        # 启动输入
+        initial_input = {
+            "topic": "赛博朋克风格的侦探故事",
+            "user_params": {"ratio": "16:9", "duration": "short", "export_profile": args.profile}
+        }
+
+        print(f"--- Workflow Started (run_id={run_id}, 失败后可用 --resume --run-id {run_id} 继续) ---")
+        # 节点均为 async, 所有镜头的 Provider 请求在同一个事件循环上并发
+        return await app.ainvoke(initial_input, config)
+
+def report_trace(run_id: str):
+    """打印本次运行的耗时汇总表, 并把 trace 导出到产物目录 (chrome://tracing 或 ui.perfetto.dev 打开)"""
+    print(get_tracer().summary_table(run_id))
+    trace_path = export_run(run_id)
+    if trace_path:
+        print(f"--- Trace saved at: {trace_path} ---")
 
 if __name__ == "__main__":
-    app = build_app()
-    
-    # 启动输入
-    initial_input = {
-        "topic": "赛博朋克风格的侦探故事",
-        "user_params": {"ratio": "16:9", "duration": "short"}
-    }
-    
-    print("--- Workflow Started ---")
-    result = app.invoke(initial_input)
-    print(f"--- Finished! Video saved at: {result['final_video_path']} ---")
\ No newline at end of file
+    result = asyncio.run(run(parse_args()))
+    print(f"--- Finished! Video saved at: {result['final_video_path']} ---")
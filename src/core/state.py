@@ -1,5 +1,7 @@
 # 定义 LangGraph 的全局状态结构
-from typing import TypedDict, List, Optional, Dict, Any
+import os
+import operator
+from typing import TypedDict, List, Optional, Dict, Any, Annotated
 
 class StoryboardItem(TypedDict):
     """单个分镜的数据结构"""
@@ -18,6 +20,36 @@ class StoryboardItem(TypedDict):
     video_path: Optional[str]   # 最终生成的视频片段路径
     visual_extend_prompt: Optional[str] = None  # 阿里云的视频生成接口会自动优化传入的prompt
 
+
+def merge_storyboard(left: Optional[List[StoryboardItem]], right: Optional[List[StoryboardItem]]) -> List[StoryboardItem]:
+    """storyboard 的 Reducer: 按 id 合并分镜
+    并行的单镜头任务(音频/视觉)各自只返回自己负责的那一条分镜, 这里把同 id 的字段合并到一起,
+    新出现的 id 追加在后面, 最终按 id 排序保证镜头顺序稳定。
+    """
+    merged: Dict[int, StoryboardItem] = {}
+    for item in (left or []):
+        merged[item["id"]] = dict(item)
+    for item in (right or []):
+        if item["id"] in merged:
+            merged[item["id"]].update(item)
+        else:
+            merged[item["id"]] = dict(item)
+    return [merged[k] for k in sorted(merged)]
+
+
+# 状态中最多保留的日志条数 (只保留最新的); 完整耗时数据见 trace (src/services/tracing.py)
+MAX_LOG_ENTRIES = int(os.getenv("MAX_LOG_ENTRIES", "200"))
+
+
+def append_logs(left: Optional[List[str]], right: Optional[List[str]]) -> List[str]:
+    """logs 的 Reducer: 追加新日志, 超过 MAX_LOG_ENTRIES 时丢弃最旧的;
+    节点返回单个字符串时按一条日志处理, 不会把已有日志覆盖掉"""
+    if isinstance(right, str):
+        right = [right]
+    merged = list(left or []) + list(right or [])
+    return merged[-MAX_LOG_ENTRIES:]
+
+
 class GraphState(TypedDict):
     """LangGraph 的全局状态"""
     # 输入
@@ -29,13 +61,21 @@ class GraphState(TypedDict):
     anchor_character_img: str   # 主角/基准参考图路径
 
     # 阶段 1: 脚本
-    storyboard: List[StoryboardItem] # 分镜列表
+    storyboard: Annotated[List[StoryboardItem], merge_storyboard] # 分镜列表(按 id 合并各镜头的并行结果)
     bgm_style: str              # BGM 搜索关键词
 
     # 阶段 2: 生产状态 (用于并行控制)
     audio_ready: bool
     visual_ready: bool
+    vlm_calls_saved: Annotated[int, operator.add]   # 本地预筛拦下的 VLM 调用次数 (各镜头累加)
 
     # 阶段 3: 产出
     final_video_path: str
-    logs: List[str]
\ No newline at end of file
+    logs: Annotated[List[str], append_logs]     # 并行节点各自追加日志 (有上限)
+
+
+class ShotState(TypedDict):
+    """单镜头子任务的输入 (由 Send 分发, 每个 StoryboardItem 一份)"""
+    shot: StoryboardItem
+    anchor_character_img: str
+    user_params: Dict[str, Any]
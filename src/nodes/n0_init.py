@@ -1,13 +1,8 @@
 # 初始化与锚点生成
 from src.core.state import GraphState
-from src.services.llm_service import LLMService
-from src.services.media_service import MediaGenService
+from src.services.registry import get_llm_service, get_media_service
 
-# 初始化服务实例
-llm_service = LLMService()
-media_service = MediaGenService()
-
-def init_node(state: GraphState) -> GraphState:
+async def init_node(state: GraphState) -> GraphState:
     """
     Node 0: 初始化
     功能:
@@ -20,11 +15,11 @@ def init_node(state: GraphState) -> GraphState:
     user_style = state["user_params"].get("style", "cinematic")     # 风格(Default: 电影级的)
 
     # 1. 使用 LLM 优化风格描述
-    anchor_style_prompt = llm_service.refine_style(topic, user_style)
+    anchor_style_prompt = await get_llm_service().arefine_style(topic, user_style)
 
     # 2. 生成锚点参考图 (Character/Scene Anchor)
     # 这张图将作为后续所有 IP-Adapter 的输入
-    anchor_img_path = media_service.generate_reference_image(anchor_style_prompt)
+    anchor_img_path = await get_media_service().agenerate_reference_image(anchor_style_prompt)
 
     # 3. 更新状态
     # 注意：LangGraph 中返回的 dict 会被合并 update 到全局 state 中
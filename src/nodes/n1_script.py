@@ -1,26 +1,68 @@
 # 脚本与分镜规划
+import os
+import time
+import asyncio
 from src.core.state import GraphState
-from src.services.llm_service import LLMService
+from src.services.registry import get_llm_service, get_media_service
+from src.services.visual_pipeline import get_visual_pipeline
 
-llm = LLMService()
+# 流式拿到每个镜头后立即预取它的 TTS 和第一张分镜图 (STORYBOARD_PREFETCH=0 关闭);
+# 预取与之后 audio_gen / visual_gen 的正式调用按缓存 key 去重, 不会重复生成
+STORYBOARD_PREFETCH = os.getenv("STORYBOARD_PREFETCH", "1") != "0"
 
-def script_node(state: GraphState) -> GraphState:
+# 事件循环只弱引用 task, 预取任务在这里保持引用直到结束
+_prefetch_tasks = set()
+
+def _prefetch_done(task: asyncio.Task):
+    _prefetch_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[Script] Prefetch {task.get_name()} failed, will retry in shot node: {task.exception()}")
+
+def _prefetch_shot(item: dict, anchor_img: str):
+    """后台启动单个镜头的素材生成, 不等待结果 (失败时由镜头节点正式调用时重新执行)"""
+    loop = asyncio.get_running_loop()
+    media_service = get_media_service()
+    coros = {"tts": media_service.atext_to_speech(item['id'], item['text_content'], item['emotion'])}
+    if anchor_img:
+        # 生图同样经过视觉流水线的 image 阶段, 预取不会绕过 PIPELINE_IMAGE_WORKERS 的并发上限
+        coros["image"] = get_visual_pipeline().image.submit(
+            media_service.agenerate_image_with_control, item['id'], item['visual_prompt'], anchor_img)
+    for kind, coro in coros.items():
+        task = loop.create_task(coro, name=f"{kind}-{item['id']}")
+        _prefetch_tasks.add(task)
+        task.add_done_callback(_prefetch_done)
+
+async def script_node(state: GraphState) -> dict:
     """
     节点：脚本生成
-    功能：基于主题生成分镜脚本
+    功能：基于主题流式生成分镜脚本, 每个镜头写完即开始预取素材
     """
     print(f"--- Generating Script for: {state['topic']} ---")
-    
-    # 1. 调用 LLM
-    storyboard_json = llm.generate_storyboard(
+    started_at = time.perf_counter()
+    first_shot_at = None
+
+    # 1. 调用 LLM (流式, 逐条返回已校验的镜头)
+    storyboard_json = []
+    async for item in get_llm_service().astream_storyboard(
         topic=state['topic'],
-        style=state['user_params'].get('style', 'cinematic')    # 取style字段, 没有则默认返回'cinematic'(电影级的)
-    )
-    
-    # 2. 简单的后处理（例如为每个镜头分配唯一ID）
-    for i, item in enumerate(storyboard_json):
-        item['id'] = i
-        
+        style_prompt=state['user_params'].get('style', 'cinematic')    # 取style字段, 没有则默认返回'cinematic'(电影级的)
+    ):
+        # 2. 简单的后处理（例如为每个镜头分配唯一ID）
+        item['id'] = len(storyboard_json)
+        storyboard_json.append(item)
+        if first_shot_at is None:
+            first_shot_at = time.perf_counter() - started_at
+            print(f"[Script] First shot ready after {first_shot_at:.2f}s")
+        if STORYBOARD_PREFETCH:
+            _prefetch_shot(item, state.get('anchor_character_img'))
+
+    total = time.perf_counter() - started_at
+    print(f"[Script] {len(storyboard_json)} shots in {total:.2f}s")
+
     # 3. 更新状态
-    state['storyboard'] = storyboard_json
-    return state
\ No newline at end of file
+    # storyboard 带有按 id 合并的 Reducer, 这里只返回增量即可
+    return {
+        "storyboard": storyboard_json,
+        "logs": [f"Storyboard generated with {len(storyboard_json)} shots "
+                 f"(first shot after {first_shot_at or 0:.2f}s, total {total:.2f}s)."]
+    }
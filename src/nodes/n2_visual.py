@@ -1,63 +1,95 @@
 # 视觉并行流(含生成-校验循环)
 import os
-from src.core.state import GraphState
-from src.services.media_service import MediaGenService
-from src.services.llm_service import LLMService
+import asyncio
+from src.core.state import ShotState
+from src.services.registry import get_media_service, get_llm_service, get_vlm_batcher, get_prefilter
+from src.services.visual_pipeline import get_visual_pipeline
+from src.services.rate_limiter import request_priority, PRIORITY_NORMAL, PRIORITY_LOW
 
-media_service = MediaGenService()
-vlm_service = LLMService()
+# 生图 / VLM 校验 / 图生视频 三个阶段各自的 worker 池
+pipeline = get_visual_pipeline()
 
 FORCE_EXECUTE = os.getenv("FORCE_EXECUTE")
 
-def visual_node(state: GraphState) -> GraphState:
-    """节点：视觉生成流
-    功能：生图 -> 校验 -> (重试) -> 生视频
-    注意：这是一个耗时操作
+async def visual_node(state: ShotState) -> dict:
+    """节点：视觉生成流 (单镜头子任务, 由 main.py 中的 Send 按分镜分发)
+    功能：生图 -> 本地预筛 -> VLM 校验 -> (重试) -> 生视频
+    注意：这是一个耗时操作, 各镜头之间在同一个事件循环上并发执行;
+         每一步都提交到 visual_pipeline 对应阶段的 worker 池, 镜头 N 做图生视频时镜头 N+1 可以同时生图
     """
-    print("--- Starting Visual Pipeline ---")       # 开始视觉流
+    from src.services.media_service import MediaGenerationError     # 延迟导入: 节点模块 import 时不加载 dashscope
+
+    media_service = get_media_service()
+    vlm_service = get_llm_service()
+    vlm_batcher = get_vlm_batcher()     # 各镜头第一次生图的校验请求合并成批量请求
+    prefilter = get_prefilter()         # VLM 校验前的本地预筛
+    shot = state['shot']
     anchor_img = state['anchor_character_img']      # 主角/基准参考图路径
-    
-    updated_storyboard = []
-    
-    for shot in state['storyboard']:        # 分镜列表
-        id = shot["id"]
-        prompt = shot['visual_prompt']      # 画面提示词
-        video_path = None                   # 视频路径
+    id = shot["id"]
+    prompt = shot['visual_prompt']      # 画面提示词
+    video_path = None                   # 视频路径
+    previous_hashes = []                # 之前各次尝试的感知哈希, 用于判重
+    vlm_calls_saved = 0                 # 被本地预筛拦下的次数
+    print(f"--- Starting Visual Pipeline for Shot {id} ---")       # 开始视觉流
+
+    # === 内部循环：生图 + 校验 (最多重试3次) ===
+    for attempt in range(3):
+        # 1. 生图 (重试请求在 Provider 配额上让位给其他镜头的首次请求)
+        with request_priority(PRIORITY_NORMAL if attempt == 0 else PRIORITY_LOW):
+            try:
+                img_path = await pipeline.image.submit(media_service.agenerate_image_with_control, id, prompt, anchor_img)
+            except MediaGenerationError as e:
+                # 生图本身失败 (没有产出文件): 不是画面问题, 原 prompt 重试, 也不算预筛节省的 VLM 调用
+                print(f"第{attempt+1}次生图失败: Shot {id}: {e}")
+                img_path = None
+                continue
         
-        # === 内部循环：生图 + 校验 (最多重试3次) ===
-        for attempt in range(3):
-            # 1. 生图
-            img_path = media_service.generate_image_with_control(id, prompt, anchor_img)
-            
-            # 2. VLM 校验
-            check_result = vlm_service.validate_image_quality(img_path, prompt)
-            
-            if check_result['passed']:
-                # 3. 校验通过，生成视频
-                video_path, visual_extend_prompt = media_service.image_to_video(id, img_path, motion_strength=0.5)
-                shot['image_path'] = img_path
-                shot['video_path'] = video_path
-                shot['visual_extend_prompt'] = visual_extend_prompt
-                break # 跳出重试循环
-            else:
-                # 4. 失败，优化 Prompt 进行下一次尝试
-                print(f"第{attempt+1}次失败: Shot {shot['id']} failed: {check_result['reason']}")
-                prompt = vlm_service.optimize_prompt(prompt, check_result['reason'])
+        # 2. 本地预筛: 空白/损坏/模糊/重复/偏离锚点的图片直接打回, 不走 VLM
+        check_result = await asyncio.to_thread(prefilter.check, img_path, anchor_img, previous_hashes)
+        if check_result["hash"] is not None:
+            previous_hashes.append(check_result["hash"])
+        if check_result["unreadable"]:
+            # 文件不存在/无法解码同样是生图失败, 处理方式同上
+            print(f"第{attempt+1}次生图失败: Shot {id}: {check_result['reason']}")
+            img_path = None
+            continue
+        if not check_result['passed']:
+            vlm_calls_saved += 1
+
+        # 3. VLM 校验 (第一次尝试走批量校验, 重试时单独校验)
+        elif attempt == 0:
+            check_result = await pipeline.vlm.submit(vlm_batcher.validate, img_path, prompt)
+        else:
+            with request_priority(PRIORITY_LOW):
+                check_result = await pipeline.vlm.submit(vlm_service.avalidate_image_quality, img_path, prompt)
         
-        # 如果3次都没过，强制使用最后一次的图生成视频，或者标记错误
-        if not video_path:
-             # fallback logic...
-            #  logger.error(f"Shot {shot['id']} failed after 3 attempts. Reason: {check_result['reason']}")
-            if FORCE_EXECUTE:
-                video_path = media_service.image_to_video(img_path, motion_strength=0.5)
-                shot['image_path'] = img_path
-                shot['video_path'] = video_path
-                shot['visual_extend_prompt'] = None
-            else:
-                raise RuntimeError(f"视觉生成失败: Shot {shot['id']} 连续3次失败")
-             
-        updated_storyboard.append(shot)
+        if check_result['passed']:
+            # 4. 校验通过，生成视频
+            video_path, visual_extend_prompt = await pipeline.i2v.submit(media_service.aimage_to_video, id, img_path, motion_strength=0.5)
+            break # 跳出重试循环
+        else:
+            # 5. 失败，优化 Prompt 进行下一次尝试
+            print(f"第{attempt+1}次失败: Shot {id} failed: {check_result['reason']}")
+            prompt = vlm_service.optimize_prompt(prompt, check_result['reason'])
+    
+    # 如果3次都没过，强制使用最后一次的图生成视频，或者标记错误
+    if not video_path:
+        # fallback logic...
+        #  logger.error(f"Shot {id} failed after 3 attempts. Reason: {check_result['reason']}")
+        if FORCE_EXECUTE and img_path:
+            video_path, _ = await pipeline.i2v.submit(media_service.aimage_to_video, id, img_path, motion_strength=0.5)
+            visual_extend_prompt = None
+        else:
+            raise RuntimeError(f"视觉生成失败: Shot {id} 连续3次失败")
 
-    state['storyboard'] = updated_storyboard
-    state['visual_ready'] = True
-    return state
\ No newline at end of file
+    # 只返回本镜头的增量字段, 由 GraphState.storyboard 的 Reducer 按 id 合并
+    return {
+        "storyboard": [{
+            "id": id,
+            "image_path": img_path,
+            "video_path": video_path,
+            "visual_extend_prompt": visual_extend_prompt,
+        }],
+        "vlm_calls_saved": vlm_calls_saved,
+        "logs": [f"Visual clip for shot {id} generated."]
+    }
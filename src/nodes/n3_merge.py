@@ -1,13 +1,15 @@
 # 后期合成
 import os
-from typing import List, Dict, Any
-from src.core.state import GraphState, StoryboardItem
-from src.services.editor_service import VideoEditorService
+import asyncio
+from src.core.state import GraphState
+from src.services.registry import get_editor_service
+from src.services.export_profiles import resolve_export_profile
+from src.utils.media_probe import audio_duration
+from src.services.visual_pipeline import get_visual_pipeline
+from src.services.rate_limiter import get_governor
+from src.services.artifact_store import get_artifact_store
 
-# 初始化剪辑服务
-editor_service = VideoEditorService()
-
-def merge_node(state: GraphState) -> GraphState:
+async def merge_node(state: GraphState) -> GraphState:
     """
     Node 3: 后期合成与渲染
     功能:
@@ -16,6 +18,7 @@ def merge_node(state: GraphState) -> GraphState:
     3. 调用 Service: 执行物理渲染 (转场、字幕、BGM)。
     """
     print("--- [N3_Merge] Final Editing & Rendering ---")
+    editor_service = get_editor_service()
     
     # 1. 获取所有素材数据
     # 注意: 在并行流结束后，假设 state['storyboard'] 已包含了 audio_path 和 video_path
@@ -23,7 +26,7 @@ def merge_node(state: GraphState) -> GraphState:
     bgm_style = state.get("bgm_style", "cinematic")
     
     if not full_storyboard:
-        return {"logs": state.get("logs", []) + ["Error: Storyboard is empty."]}
+        return {"logs": ["Error: Storyboard is empty."]}
 
     # 2. 数据清洗与对齐 (Data Validation & Alignment)
     # 我们需要构建一个用于剪辑的干净列表
@@ -33,9 +36,19 @@ def merge_node(state: GraphState) -> GraphState:
     current_timestamp = 0.0
     subtitle_data = [] # 格式:List[{text, start, end}]
 
+    # 相邻镜头之间有 transition 秒的交叉淡化重叠; 非最后一个镜头的画面多留出 transition 秒,
+    # 这样每句旁白都能完整播完, 下一镜头的内容恰好从上一句结束处开始, 字幕时间轴 = 旁白时长的累加
+    try:
+        profile = resolve_export_profile(state["user_params"])
+    except ValueError as e:
+        # 未知的导出档位: 不进入渲染, 和渲染失败一样记录错误并结束本节点
+        print(f"   [Error] {e}")
+        return {"final_video_path": "", "logs": [f"Error during rendering: {e}"]}
+    transition = profile["transition"] if len(full_storyboard) > 1 else 0.0
+
     print(f"-> Analyzing timeline for {len(full_storyboard)} clips...")
 
-    for item in full_storyboard:
+    for index, item in enumerate(full_storyboard):
         clip_id = item.get("id")
         audio_path = item.get("audio_path")
         video_path = item.get("video_path")
@@ -43,10 +56,15 @@ def merge_node(state: GraphState) -> GraphState:
         text = item.get("text_content", "")
         
         # 2.1 确定本片段的基准时长 (Duration Strategy)
-        # 优先级: 真实音频时长 > 预估时长
-        duration = item.get("audio_duration")
+        # 优先级: 音频文件实测时长 > 音频节点回写的时长 > 预估时长
+        duration = None
+        if audio_path and os.path.exists(audio_path):
+            duration = await asyncio.to_thread(audio_duration, audio_path)
+        if not duration:
+            duration = item.get("audio_duration")
         if not duration:
             duration = item.get("estimated_duration", 3.0)
+        is_last = index == len(full_storyboard) - 1
         
         # 2.2 检查素材完整性
         # 如果没有视频，回退到图片；如果图片也没有，标记为黑屏(由Editor处理)
@@ -71,35 +89,68 @@ def merge_node(state: GraphState) -> GraphState:
             "video_path": video_path,
             "image_path": image_path,
             "audio_path": audio_path,
-            "target_duration": duration, # 告诉编辑器：无论视频多长，必须强行缩放至这个时长
+            "target_duration": duration if is_last else duration + transition, # 告诉编辑器：无论视频多长，必须强行缩放至这个时长
             "visual_prompt": item.get("visual_prompt", "") # 用于可能的元数据记录
         })
         
         # 更新时间轴指针
         current_timestamp += duration
 
-    print(f"-> Total duration estimate: {current_timestamp:.2f} seconds")
+    print(f"-> Total duration (measured): {current_timestamp:.2f} seconds")
     print(f"-> Generated {len(subtitle_data)} subtitle lines.")
 
     # 3. 调用 Editor Service 进行物理渲染
     # 我们将“片段列表”和“字幕列表”分开传，逻辑更清晰
+    # 导出档位 (draft/preview/production) 与画面比例都来自 user_params; 非正式档位的成片加后缀, 不覆盖正式版本
+    artifact_store = get_artifact_store()
     try:
-        final_video_path = editor_service.render_final_video(
+        suffix = "" if profile["name"] == "production" else f"_{profile['name']}"
+        # 渲染是 CPU 密集型的阻塞操作, 放到线程里执行, 不阻塞事件循环
+        # 成片写入本次运行的产物目录 (<ARTIFACT_ROOT>/<run_id>/output/), 不同运行的同名主题不会互相覆盖
+        final_video_path, render_stats = await asyncio.to_thread(
+            editor_service.render_final_video,
             clips=clips_to_process,
             subtitles=subtitle_data,
             bgm_style=bgm_style,
-            output_filename=f"final_{state['topic'].replace(' ', '_')}.mp4"
+            output_filename=f"final_{state['topic'].replace(' ', '_')}{suffix}.mp4",
+            backend=state["user_params"].get("render_backend"),   # "moviepy" | "ffmpeg" | "segments", 不传则用 RENDER_BACKEND
+            profile=profile,
+            output_dir=artifact_store.category_dir("output"),
         )
         
-        status_log = f"Success. Video saved at {final_video_path}"
+        status_log = (f"Success. Video saved at {final_video_path} "
+                      f"(process peak RSS {render_stats.get('process_peak_rss_mb')} MB)")
     except Exception as e:
         import traceback
         traceback.print_exc()
         final_video_path = ""
         status_log = f"Error during rendering: {str(e)}"
 
+    # 登记成片, 并把 manifest 推送到后端 (S3 兼容存储); 失败不影响本地成片
+    try:
+        if final_video_path:
+            await asyncio.to_thread(artifact_store.record, final_video_path, "output",
+                                    {"topic": state["topic"], "profile": profile["name"],
+                                     "duration": round(current_timestamp, 2), "shots": len(clips_to_process)})
+        await asyncio.to_thread(artifact_store.flush)
+        manifest = artifact_store.manifest()
+        print(f"-> Artifacts: {len(manifest['artifacts'])} files recorded in run {manifest['run_id']}")
+    except Exception as e:
+        print(f"   [Warning] Artifact manifest flush failed: {e}")
+
     # 4. 更新 State
+    vlm_calls_saved = state.get("vlm_calls_saved", 0)
+    print(f"-> Pre-filter saved {vlm_calls_saved} VLM calls in this run.")
+    # 视觉流水线各阶段的吞吐/排队/利用率, 用于调整 PIPELINE_*_WORKERS
+    # 统计按 run_id 记录, 报告只包含本次运行; 报告后丢弃, 批量任务中进程长期运行也不会累积
+    pipeline_report = get_visual_pipeline().report()
+    get_visual_pipeline().forget()
+    print(pipeline_report)
+    # 各 Provider 配额的排队与限流情况, 用于调整 RATE_LIMIT_*
+    rate_limit_report = get_governor().report()
+    print(rate_limit_report)
     return {
         "final_video_path": final_video_path,
-        "logs": state.get("logs", []) + [status_log]
+        "logs": [status_log, f"Pre-filter saved {vlm_calls_saved} VLM calls."]
+                + pipeline_report.splitlines() + rate_limit_report.splitlines()
     }
\ No newline at end of file
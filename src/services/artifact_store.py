@@ -0,0 +1,214 @@
+# 运行产物存储: 每次运行 (run_id) 一个独立的命名空间, 原子写入, manifest 记录所有产物, 后端可插拔 (本地文件系统 / S3 兼容对象存储)
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from src.utils.tools import file_sha256
+
+ARTIFACT_ROOT = Path(os.getenv("ARTIFACT_ROOT", str(Path("data") / "runs")))
+# local: 只保留本地目录; s3: 本地目录作为工作副本, 产物记录后同步上传到 S3 兼容存储 (MinIO 等本地替身设置 ARTIFACT_S3_ENDPOINT)
+ARTIFACT_BACKEND = os.getenv("ARTIFACT_BACKEND", "local")
+ARTIFACT_S3_BUCKET = os.getenv("ARTIFACT_S3_BUCKET")
+ARTIFACT_S3_ENDPOINT = os.getenv("ARTIFACT_S3_ENDPOINT")
+ARTIFACT_S3_PREFIX = os.getenv("ARTIFACT_S3_PREFIX", "runs/")
+
+MANIFEST_NAME = "manifest.json"
+
+_current_run_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("run_id", default=None)
+_default_run_id: Optional[str] = None
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def current_run_id() -> str:
+    """当前上下文的 run_id; 没有进入 run_scope 时 (例如单独调用服务) 使用进程级的默认 run_id"""
+    global _default_run_id
+    run_id = _current_run_id.get()
+    if run_id:
+        return run_id
+    if _default_run_id is None:
+        _default_run_id = f"local-{datetime.now().strftime('%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    return _default_run_id
+
+
+@contextmanager
+def run_scope(run_id: str):
+    """在此上下文 (及其派生的 task / to_thread) 中生成的产物都写入 run_id 的命名空间"""
+    token = _current_run_id.set(run_id)
+    try:
+        yield run_id
+    finally:
+        _current_run_id.reset(token)
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "wb"):
+    """先写同目录下的临时文件, 成功后 rename 为 path; 中途失败不会留下半截文件"""
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class LocalBackend:
+    """本地文件系统: 工作目录本身就是存储, 不需要额外同步"""
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def uri(self, key: str) -> str:
+        return str((self.root / key).resolve())
+
+    def publish(self, local_path: str, key: str):
+        target = self.root / key
+        if os.path.abspath(local_path) == str(target.resolve()):
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(str(target)) as f, open(local_path, "rb") as src:
+            shutil.copyfileobj(src, f)
+
+
+class S3Backend:
+    """S3 兼容对象存储; boto3 只在使用该后端时才需要安装"""
+    name = "s3"
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, prefix: str = ""):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("ARTIFACT_BACKEND=s3 需要安装 boto3") from e
+        if not bucket:
+            raise RuntimeError("ARTIFACT_BACKEND=s3 需要设置 ARTIFACT_S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def uri(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self.prefix}{key}"
+
+    def publish(self, local_path: str, key: str):
+        # 对象存储的 PUT 本身是原子的: 上传完成前读不到新对象
+        self.client.upload_file(local_path, self.bucket, f"{self.prefix}{key}")
+
+
+class ArtifactStore:
+    """
+    产物目录结构: <root>/<run_id>/<category>/<name>, manifest 位于 <root>/<run_id>/manifest.json
+    - path():   返回本次运行某个产物的本地路径 (ffmpeg / moviepy / 下载器都需要本地路径)
+    - record(): 产物写完后登记到 manifest (大小、sha256、来源元数据), 并推送到后端
+    同一 run_id 再次运行 (--resume) 会沿用同一个目录和 manifest。
+    """
+    def __init__(self, root: Path = ARTIFACT_ROOT, backend=None):
+        self.root = Path(root)
+        self.backend = backend or LocalBackend(self.root)
+        self._manifests: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def run_dir(self, run_id: Optional[str] = None) -> Path:
+        return self.root / (run_id or current_run_id())
+
+    def category_dir(self, category: str, run_id: Optional[str] = None) -> str:
+        directory = self.run_dir(run_id) / category
+        directory.mkdir(parents=True, exist_ok=True)
+        return str(directory)
+
+    def path(self, category: str, name: str, run_id: Optional[str] = None) -> str:
+        return os.path.join(self.category_dir(category, run_id), name)
+
+    def record(self, path: str, category: str, meta: Optional[Dict[str, Any]] = None,
+               run_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """登记一个已经写好的产物; 文件不存在时返回 None"""
+        if not path or not os.path.exists(path):
+            return None
+        run_id = run_id or current_run_id()
+        run_dir = self.run_dir(run_id)
+        try:
+            relative = Path(os.path.abspath(path)).relative_to(run_dir.resolve()).as_posix()
+        except ValueError:  # 不在本次运行目录下的文件 (例如调用方自己指定的路径), 按文件名归入 category
+            relative = f"{category}/{os.path.basename(path)}"
+        key = f"{run_id}/{relative}"
+        self.backend.publish(path, key)
+
+        entry = {
+            "category": category,
+            "path": relative,
+            "uri": self.backend.uri(key),
+            "size": os.path.getsize(path),
+            "sha256": file_sha256(path),
+            "created_at": time.time(),
+            "meta": meta or {},
+        }
+        with self._lock:
+            manifest = self._manifest(run_id)
+            manifest["artifacts"][relative] = entry
+            manifest["updated_at"] = entry["created_at"]
+            self._save_manifest(run_id, manifest)
+        return entry
+
+    def manifest(self, run_id: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            return json.loads(json.dumps(self._manifest(run_id or current_run_id())))
+
+    def flush(self, run_id: Optional[str] = None):
+        """把 manifest 推送到后端 (本地后端无操作); 在一次运行结束时调用"""
+        run_id = run_id or current_run_id()
+        manifest_path = self.run_dir(run_id) / MANIFEST_NAME
+        if manifest_path.exists():
+            self.backend.publish(str(manifest_path), f"{run_id}/{MANIFEST_NAME}")
+
+    def _manifest(self, run_id: str) -> Dict[str, Any]:
+        if run_id not in self._manifests:
+            manifest_path = self.run_dir(run_id) / MANIFEST_NAME
+            manifest = None
+            if manifest_path.exists():
+                try:
+                    with open(manifest_path, "r", encoding="utf-8") as f:
+                        manifest = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    print(f"[Artifacts] manifest 读取失败, 重新建立: {e}")
+            self._manifests[run_id] = manifest or {
+                "run_id": run_id,
+                "backend": self.backend.name,
+                "created_at": time.time(),
+                "artifacts": {},
+            }
+        return self._manifests[run_id]
+
+    def _save_manifest(self, run_id: str, manifest: Dict[str, Any]):
+        manifest_path = self.run_dir(run_id) / MANIFEST_NAME
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(str(manifest_path), "w") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+_artifact_store: Optional[ArtifactStore] = None
+_artifact_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    global _artifact_store
+    with _artifact_store_lock:
+        if _artifact_store is None:
+            backend = None
+            if ARTIFACT_BACKEND == "s3":
+                backend = S3Backend(ARTIFACT_S3_BUCKET, ARTIFACT_S3_ENDPOINT, ARTIFACT_S3_PREFIX)
+            elif ARTIFACT_BACKEND != "local":
+                raise ValueError(f"未知的 ARTIFACT_BACKEND: {ARTIFACT_BACKEND}")
+            _artifact_store = ArtifactStore(backend=backend)
+        return _artifact_store
@@ -0,0 +1,113 @@
+# MoviePy 素材 reader 的生命周期管理: 按需打开、限制同时打开的数量、渲染结束后统一关闭
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from moviepy import VideoClip, AudioClip, VideoFileClip, AudioFileClip, ImageClip
+
+# 同时打开的 reader 上限 (每个 VideoFileClip/AudioFileClip 对应一个 ffmpeg 子进程和一块帧缓冲)
+# 转场处需要前后两个镜头的画面和音频同时可读, 上限不宜小于 4
+RENDER_MAX_OPEN_READERS = int(os.getenv("RENDER_MAX_OPEN_READERS", "8"))
+
+AUDIO_FPS = 44100
+
+
+class ClipReaderPool:
+    """
+    LRU 的 reader 池。镜头只在合成到它的时间范围时才会调用 get(), 第一次调用时打开 reader,
+    超过上限时关闭最久未使用的 reader (之后再用到会重新打开并 seek)。
+    用法:
+        with ClipReaderPool() as pool:
+            clip = pool.video_clip(path, duration, size)
+            ...  # write_videofile
+        # 退出时关闭所有仍打开的 reader
+    """
+    def __init__(self, max_open: int = RENDER_MAX_OPEN_READERS):
+        self.max_open = max(1, max_open)
+        self._open: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.opened = 0        # 累计打开次数
+        self.peak_open = 0     # 同时打开数量的峰值
+
+    def get(self, key: Hashable, opener: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._open:
+                self._open.move_to_end(key)
+                return self._open[key]
+            while len(self._open) >= self.max_open:
+                _, stale = self._open.popitem(last=False)
+                self._close(stale)
+            source = opener()
+            self._open[key] = source
+            self.opened += 1
+            self.peak_open = max(self.peak_open, len(self._open))
+            return source
+
+    def close_all(self):
+        with self._lock:
+            while self._open:
+                _, source = self._open.popitem(last=False)
+                self._close(source)
+
+    @staticmethod
+    def _close(source: Any):
+        close = getattr(source, "close", None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                print(f"[ClipPool] close failed: {e}")
+
+    def __enter__(self) -> "ClipReaderPool":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close_all()
+        return False
+
+    # ---------- 惰性片段 ----------
+    # MoviePy 的 VideoClip/AudioClip 在构造时传入 make_frame 会立即取第 0 帧,
+    # 这里先构造空片段, 再设置 make_frame/size, 保证构建时间轴时不打开任何文件。
+
+    def video_clip(self, path: str, duration: float, size: Tuple[int, int],
+                   speed: float = 1.0, source_duration: Optional[float] = None) -> VideoClip:
+        """视频素材: 解码时由 ffmpeg 直接缩放到 size, 按 speed 变速"""
+        # 超出素材时长的时间点取最后一帧附近, 避免 reader 告警
+        last_t = max((source_duration or 0.0) - 0.05, 0.0)
+        key = ("video", path, size)
+
+        def make_frame(t):
+            reader = self.get(key, lambda: VideoFileClip(path, audio=False, target_resolution=(size[1], size[0])))
+            source_t = t * speed
+            return reader.get_frame(min(source_t, last_t) if source_duration else source_t)
+
+        clip = VideoClip(duration=duration)
+        clip.make_frame = make_frame
+        clip.size = size
+        return clip
+
+    def image_clip(self, path: str, duration: float, size: Tuple[int, int]) -> VideoClip:
+        """图片素材: 缩放后的像素数组同样受上限约束, 不会同时驻留全部镜头的图片"""
+        key = ("image", path, size)
+
+        def make_frame(t):
+            return self.get(key, lambda: ImageClip(path).resize(newsize=size)).img
+
+        clip = VideoClip(duration=duration)
+        clip.make_frame = make_frame
+        clip.size = size
+        return clip
+
+    def audio_clip(self, path: str, duration: float, speed: float = 1.0) -> AudioClip:
+        """音频素材 (TTS 或视频自带音轨), 超出素材时长的部分为静音"""
+        key = ("audio", path)
+
+        def make_frame(t):
+            return self.get(key, lambda: AudioFileClip(path, fps=AUDIO_FPS)).get_frame(t * speed)
+
+        clip = AudioClip(duration=duration, fps=AUDIO_FPS)
+        clip.make_frame = make_frame
+        clip.nchannels = 2  # FFMPEG_AudioReader 统一输出双声道
+        return clip
+
@@ -0,0 +1,138 @@
+# 生成素材的下载管理: 连接池复用 + 流式落盘 + 断点续传 + 校验 + 并行下载
+import os
+import base64
+import asyncio
+import hashlib
+import requests
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional
+from requests.adapters import HTTPAdapter
+
+from src.services.tracing import span
+
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1 << 20)))     # 1MB
+DOWNLOAD_MAX_WORKERS = int(os.getenv("DOWNLOAD_MAX_WORKERS", "8"))
+DOWNLOAD_MAX_RETRIES = int(os.getenv("DOWNLOAD_MAX_RETRIES", "3"))
+DOWNLOAD_TIMEOUT = (10, 60)     # (连接超时, 读超时) 秒
+
+# 这些异常说明连接中途断开, 可以用 Range 请求从已写入的位置继续
+RESUMABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+
+
+class DownloadError(RuntimeError):
+    """下载失败或校验不通过"""
+
+
+class DownloadManager:
+    """
+    所有 Provider 返回的素材 URL 都通过这里下载:
+    - 共享一个 requests.Session, 同一个 OSS 域名的 TCP/TLS 连接会被复用
+    - iter_content 分块写入 <dest>.part, 视频不会整个读进内存
+    - 连接断开后用 Range 请求续传
+    - 完成后按 expected_sha256 或响应头 Content-MD5 校验, 通过后 rename 为最终文件
+    """
+    def __init__(self, max_workers: int = DOWNLOAD_MAX_WORKERS, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 max_retries: int = DOWNLOAD_MAX_RETRIES):
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download")
+
+    def download(self, url: str, dest_path: str, expected_sha256: Optional[str] = None) -> str:
+        """流式下载 url 到 dest_path, 返回 dest_path"""
+        with span("download", "io", file=os.path.basename(dest_path)) as trace:
+            self._download(url, dest_path, expected_sha256)
+            trace.set(bytes_out=os.path.getsize(dest_path))
+        return dest_path
+
+    def _download(self, url: str, dest_path: str, expected_sha256: Optional[str] = None):
+        part_path = f"{dest_path}.part"
+        # 只在本次调用内续传; 之前遗留的 .part 可能来自另一个 URL, 不能拼接
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        content_md5 = None
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with self.session.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as rsp:
+                    if rsp.status_code == 416:
+                        # .part 已经是完整文件 (或服务端不认这个区间): 丢弃后从头下载
+                        os.remove(part_path)
+                        continue
+                    rsp.raise_for_status()
+                    content_md5 = rsp.headers.get("Content-MD5") or content_md5
+                    # 服务端不支持 Range 时会返回 200 + 全量内容, 这时需要覆盖写
+                    mode = "ab" if offset and rsp.status_code == 206 else "wb"
+                    with open(part_path, mode) as f:
+                        for chunk in rsp.iter_content(chunk_size=self.chunk_size):
+                            f.write(chunk)
+                    expected_size = self._expected_size(rsp, offset if mode == "ab" else 0)
+                if expected_size is not None and os.path.getsize(part_path) != expected_size:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"incomplete download: {os.path.getsize(part_path)}/{expected_size} bytes")
+                break
+            except RESUMABLE_ERRORS as e:
+                last_error = e
+                print(f"[Download] {os.path.basename(dest_path)} interrupted (attempt {attempt + 1}): {e}")
+        else:
+            raise DownloadError(f"下载失败: {url} -> {dest_path}: {last_error}")
+
+        self._verify(part_path, expected_sha256, content_md5)
+        os.replace(part_path, dest_path)
+
+    def download_many(self, items: List[Tuple[str, str]]) -> List[str]:
+        """并行下载 [(url, dest_path), ...], 结果顺序与输入一致"""
+        # 在调用方的上下文中执行, 下载 span 挂在发起下载的 span 下面
+        futures = [self._executor.submit(contextvars.copy_context().run, self.download, url, dest) for url, dest in items]
+        return [f.result() for f in futures]
+
+    async def adownload(self, url: str, dest_path: str, expected_sha256: Optional[str] = None) -> str:
+        """download 的异步版本 (在下载线程池中执行)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, contextvars.copy_context().run,
+                                          self.download, url, dest_path, expected_sha256)
+
+    @staticmethod
+    def _expected_size(rsp: requests.Response, offset: int) -> Optional[int]:
+        content_range = rsp.headers.get("Content-Range")     # bytes 100-199/200
+        if content_range and "/" in content_range:
+            total = content_range.rsplit("/", 1)[-1]
+            return int(total) if total.isdigit() else None
+        content_length = rsp.headers.get("Content-Length")
+        return offset + int(content_length) if content_length and content_length.isdigit() else None
+
+    def _verify(self, path: str, expected_sha256: Optional[str], content_md5: Optional[str]):
+        if not expected_sha256 and not content_md5:
+            return
+        sha256, md5 = hashlib.sha256(), hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                sha256.update(chunk)
+                md5.update(chunk)
+        if expected_sha256 and sha256.hexdigest() != expected_sha256:
+            os.remove(path)
+            raise DownloadError(f"sha256 校验失败: {path}")
+        if content_md5 and base64.b64encode(md5.digest()).decode() != content_md5:
+            os.remove(path)
+            raise DownloadError(f"Content-MD5 校验失败: {path}")
+
+
+_download_manager: Optional[DownloadManager] = None
+
+def get_download_manager() -> DownloadManager:
+    """进程内共享一个 DownloadManager (共享连接池)"""
+    global _download_manager
+    if _download_manager is None:
+        _download_manager = DownloadManager()
+    return _download_manager
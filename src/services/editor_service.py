@@ -1,158 +1,213 @@
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from moviepy import (
-    VideoFileClip,
-    AudioFileClip,
-    ImageClip,
+    VideoClip,
     ColorClip,
-    TextClip,
-    CompositeVideoClip,
     concatenate_videoclips,
-    fadein, fadeout, speedx, resize
+    resize
 )
 
+from src.services.ffmpeg_renderer import FFmpegRenderer
+from src.services.segment_renderer import SegmentRenderer
+from src.services.subtitle_service import get_subtitle_engine
+from src.services.export_profiles import resolve_export_profile
+from src.services.clip_pool import ClipReaderPool
+from src.utils.media_probe import probe
+from src.utils.resource_monitor import PeakRSSMonitor
+from src.services.tracing import span
+from src.services.artifact_store import get_artifact_store, current_run_id
+
+# 默认渲染后端:
+#   "moviepy"  逐帧 Python 合成
+#   "ffmpeg"   单个 ffmpeg 进程完成整条 filter graph
+#   "segments" 每个片段在进程池中并行编码, 转场单独渲染, 最后 stream copy 拼接
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "moviepy")
+
+# 分段渲染的片段缓存: 片段按输入内容 hash 命名, 按导出档位与分辨率分目录, 各次运行共享,
+# 新的运行 (例如只改了个别镜头的 prompt) 也能复用之前渲染过的片段; 运行目录里只保留成片
+SEGMENT_CACHE_DIR = os.getenv("SEGMENT_CACHE_DIR", os.path.join("data", "cache", "segments"))
+
 
 class VideoEditorService:
     def __init__(self):
-        self.output_dir = "output"
-        os.makedirs(self.output_dir, exist_ok=True)
-        # 配置 ImageMagick 路径 (Windows用户通常需要手动指定，Linux/Mac通常不需要)
-        # from moviepy.config import change_settings
-        # change_settings({"IMAGEMAGICK_BINARY": r"C:\Program Files\ImageMagick-7.1.0-Q16-HDRI\magick.exe"})
-
-    def _create_visual_clip(self, clip_data: Dict[str, Any]) -> VideoFileClip:
-        """根据素材创建基础视频片段，并强制对齐时长"""
+        # 构造时不创建任何目录: 成片目录在渲染时才确定 (默认为本次运行的产物目录)
+        # 字幕由 SubtitleEngine (Pillow/libass) 渲染, 不再依赖 ImageMagick
+        pass
+
+    def _create_visual_clip(self, clip_data: Dict[str, Any], size: Tuple[int, int], pool: ClipReaderPool) -> VideoClip:
+        """根据素材创建基础视频片段，并强制对齐时长; size 为导出档位的画面尺寸 (宽, 高)
+        素材通过 pool 惰性读取: 这里只用 ffprobe 取时长, 合成到该镜头的时间范围时才打开 reader。
+        """
         video_path = clip_data.get("video_path")
         image_path = clip_data.get("image_path")
         target_duration = clip_data.get("target_duration")
         
         clip = None
+        video_audio = None
         
-        # 1. 加载素材
+        # 1. 加载素材 (同时完成强制时长与统一分辨率)
         if video_path and os.path.exists(video_path):
-            clip = VideoFileClip(video_path)
+            info = probe(video_path)
+            speed_factor = 1.0
             # 视频变速处理 (Time Stretch)
-            if clip.duration and clip.duration > 0:
-                speed_factor = clip.duration / target_duration
+            if info["duration"] and info["duration"] > 0:
+                factor = info["duration"] / target_duration
                 # 限制变速倍率，防止过于鬼畜 (0.5x - 3.0x)
-                if 0.5 <= speed_factor <= 3.0:
-                    clip = clip.fx(speedx, speed_factor)
-                else:
-                    # 差异太大时，截取或循环，这里简化为截取
-                    pass 
+                if 0.5 <= factor <= 3.0:
+                    speed_factor = factor
+                # 差异太大时，截取或循环，这里简化为截取
+            clip = pool.video_clip(video_path, target_duration, size, speed=speed_factor, source_duration=info["duration"])
+            if info["has_audio"]:
+                # 视频自带音轨随画面一起变速
+                video_audio = pool.audio_clip(video_path, target_duration, speed=speed_factor)
         elif image_path and os.path.exists(image_path):
-            clip = ImageClip(image_path)
+            clip = pool.image_clip(image_path, target_duration, size)
             # 图片加一点缓慢缩放效果 (Ken Burns)
             # clip = clip.fx(resize, lambda t: 1 + 0.04 * t) 
         else:
             # 缺失素材，使用黑屏
-            clip = ColorClip(size=(1280, 720), color=(0,0,0))
+            clip = ColorClip(size=size, color=(0,0,0)).set_duration(target_duration)
 
-        # 2. 强制设置时长
-        clip = clip.set_duration(target_duration)
-        
-        # 3. 统一分辨率 (防止合成报错)
-        clip = clip.resize(newsize=(1280, 720)) 
-        
-        # 4. 绑定音频
+        # 2. 绑定音频
         audio_path = clip_data.get("audio_path")
         if audio_path and os.path.exists(audio_path):
-            audio = AudioFileClip(audio_path)
             # 确保音频时长不超过视频 (裁掉尾部静音)
-            audio = audio.set_duration(min(audio.duration, target_duration))
-            clip = clip.set_audio(audio)
+            audio_duration = probe(audio_path)["duration"] or target_duration
+            clip = clip.set_audio(pool.audio_clip(audio_path, min(audio_duration, target_duration)))
+        elif video_audio is not None:
+            clip = clip.set_audio(video_audio)
             
         return clip
 
-    def _create_subtitle_clips(self, subtitles: List[Dict], video_w: int, video_h: int) -> List[TextClip]:
-        """生成字幕层列表"""
-        subs = []
-        # 字体配置 (注意: 需要系统中有该字体，否则会报错，建议用 Arial 或 SimHei)
-        font_name = "Arial-Bold" if os.name == 'nt' else "Helvetica-Bold"
-        fontsize = 40
-        
-        for item in subtitles:
-            txt = item['text']
-            start = item['start']
-            duration = item['end'] - item['start']
-            
-            # 创建 TextClip
-            try:
-                txt_clip = TextClip(
-                    txt, 
-                    fontsize=fontsize, 
-                    color='white', 
-                    font=font_name, 
-                    stroke_color='black', 
-                    stroke_width=2,
-                    size=(video_w - 100, None), # 限制宽度自动换行
-                    method='caption'
-                )
-                
-                txt_clip = (txt_clip
-                            .set_position(('center', 'bottom')) # 底部居中
-                            .set_start(start)
-                            .set_duration(duration))
-                
-                subs.append(txt_clip)
-            except Exception as e:
-                print(f"[Subtitle Error] Failed to create text clip for: {txt}. Error: {e}")
-                # 即使字幕失败，也不要阻断流程
-                continue
-                
-        return subs
-
-    def render_final_video(self, clips: List[Dict], subtitles: List[Dict], bgm_style: str, output_filename: str) -> str:
+    def render_final_video(self, clips: List[Dict], subtitles: List[Dict], bgm_style: str, output_filename: str,
+                           backend: str = None, profile: Dict[str, Any] = None,
+                           output_dir: str = None) -> Tuple[str, Dict[str, Any]]:
         """
         主渲染流程
+        backend: "moviepy" | "ffmpeg" | "segments", 为空时使用环境变量 RENDER_BACKEND
+        profile: resolve_export_profile() 的结果 (分辨率/帧率/CRF/preset/线程数/音频码率), 为空时使用默认档位
+        output_dir: 成片目录, 为空时使用本次运行的产物目录 (<ARTIFACT_ROOT>/<run_id>/output/)
+        返回 (成片路径, 渲染统计); 统计随返回值交给调用方, 服务单例上不保存任何单次渲染的状态, 并发渲染互不覆盖
+        渲染期间采样的是整个进程 (含子进程) 的 RSS, 同一进程里并发的其他工作也会计入,
+        因此记为 process_peak_rss_mb, 不能当作这一次渲染独占的内存
+        成片先写到同目录的 .<成片名>.partial.mp4, 渲染成功后 rename, 中断的渲染不会留下看起来完整的成片
         """
-        print("[Editor] Starting render pipeline...")
-        
-        video_clips_objects = []
-        
-        # 1. 处理每一个片段 (转场逻辑在这里)
-        for i, clip_data in enumerate(clips):
-            v_clip = self._create_visual_clip(clip_data)
-            
-            # 添加转场 (Transitions)
-            # 逻辑: 除了第一个片段，每个片段都淡入 0.5秒
-            # 注意: MoviePy 的 concatenate 默认是硬切，compose 模式支持重叠
-            if i > 0:
-                v_clip = v_clip.crossfadein(0.5)
-            
-            video_clips_objects.append(v_clip)
+        backend = backend or RENDER_BACKEND
+        profile = profile or resolve_export_profile()
+        if backend not in ("moviepy", "ffmpeg", "segments"):
+            raise ValueError(f"未知的渲染后端: {backend}")
 
-        # 2. 视频拼接 (Concatenate)
-        # padding=-0.5 意味着每个片段和上一个片段重叠 0.5秒 (用于 Crossfade)
-        final_video = concatenate_videoclips(video_clips_objects, method="compose", padding=-0.5)
+        if output_dir is None:
+            output_dir = get_artifact_store().category_dir("output")
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, output_filename)
+        stem, ext = os.path.splitext(output_filename)
+        partial_path = os.path.join(output_dir, f".{stem}.partial{ext}")
 
-        # 3. 叠加字幕 (Composite)
-        if subtitles:
-            print(f"[Editor] Overlaying {len(subtitles)} subtitles...")
-            subtitle_clips = self._create_subtitle_clips(subtitles, final_video.w, final_video.h)
-            # 将视频底与字幕层合并
-            final_video = CompositeVideoClip([final_video] + subtitle_clips)
+        stats: Dict[str, Any] = {"backend": backend, "profile": profile["name"]}
+        try:
+            with span("render", "render", backend=backend, profile=profile["name"], clips=len(clips)) as trace, \
+                    PeakRSSMonitor() as monitor:
+                if backend == "ffmpeg":
+                    self._render_with_ffmpeg(clips, subtitles, partial_path, profile)
+                elif backend == "segments":
+                    self._render_with_segments(clips, subtitles, partial_path, profile, output_filename)
+                else:
+                    self._render_with_moviepy(clips, subtitles, partial_path, profile, stats)
+                trace.set(bytes_out=os.path.getsize(partial_path))
+            os.replace(partial_path, output_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        stats["process_peak_rss_mb"] = round(monitor.peak_mb, 1)
+        print(f"[Editor] Peak process RSS during render: {monitor.peak_mb:.1f} MB "
+              f"(process-wide, {backend}, {len(clips)} clips)")
+        return output_path, stats
 
-        # 4. 处理 BGM (可选)
-        # if bgm_path:
-        #    ... (参考之前的 BGM 逻辑)
+    def _render_with_moviepy(self, clips: List[Dict], subtitles: List[Dict], output_path: str,
+                             profile: Dict[str, Any], stats: Dict[str, Any] = None) -> str:
+        """MoviePy 后端: 逐帧合成; 素材 reader 由 ClipReaderPool 管理, 同时打开的数量不超过 RENDER_MAX_OPEN_READERS
+        stats 不为空时写入 reader 的打开次数与峰值
+        """
+        print(f"[Editor] Starting render pipeline ({profile['name']}, {profile['width']}x{profile['height']}@{profile['fps']})...")
+        size = (profile["width"], profile["height"])
+        transition = profile["transition"]
 
-        # 5. 导出文件
-        output_path = os.path.join(self.output_dir, output_filename)
-        
-        print(f"[Editor] Writing video file to {output_path}...")
-        final_video.write_videofile(
-            output_path, 
-            fps=24, 
-            codec="libx264", 
-            audio_codec="aac",
-            preset="medium", # ultrafast 测试用, medium 生产用
-            threads=4,
-            logger='bar'
-        )
-        
-        # 6. 清理内存 (重要! MoviePy 容易内存泄漏)
-        # final_video.close()
-        # for c in video_clips_objects: c.close()
-        
-        return output_path
\ No newline at end of file
+        with ClipReaderPool() as pool:
+            # 各阶段分别记录耗时: compose 只搭建合成树, 解码/合成/编码都发生在 encode 阶段
+            with span("render.compose", "render", clips=len(clips), subtitles=len(subtitles)):
+                video_clips_objects = []
+
+                # 1. 处理每一个片段 (转场逻辑在这里)
+                for i, clip_data in enumerate(clips):
+                    v_clip = self._create_visual_clip(clip_data, size, pool)
+                
+                    # 添加转场 (Transitions)
+                    # 逻辑: 除了第一个片段，每个片段都淡入 transition 秒
+                    # 注意: MoviePy 的 concatenate 默认是硬切，compose 模式支持重叠
+                    if i > 0:
+                        v_clip = v_clip.crossfadein(transition)
+                
+                    video_clips_objects.append(v_clip)
+
+                # 2. 视频拼接 (Concatenate)
+                # padding=-transition 意味着每个片段和上一个片段重叠 transition 秒 (用于 Crossfade)
+                # compose 模式下每一帧只会读取正在播放的片段, 其余镜头的 reader 不会被打开
+                final_video = concatenate_videoclips(video_clips_objects, method="compose", padding=-transition)
+
+                # 3. 叠加字幕: 每行字幕用 Pillow 预先光栅化一次, 只在该行的时间范围内混合到字幕所在区域
+                if subtitles:
+                    print(f"[Editor] Overlaying {len(subtitles)} subtitles...")
+                    final_video = get_subtitle_engine(final_video.w, final_video.h).overlay(final_video, subtitles)
+
+            # 4. 处理 BGM (可选)
+            # if bgm_path:
+            #    ... (参考之前的 BGM 逻辑)
+
+            # 5. 导出文件
+            print(f"[Editor] Writing video file to {output_path}...")
+            try:
+                with span("render.encode", "render", fps=profile["fps"], codec=profile["codec"]):
+                    final_video.write_videofile(
+                        output_path, 
+                        fps=profile["fps"], 
+                        codec=profile["codec"], 
+                        audio_codec="aac",
+                        audio_bitrate=profile["audio_bitrate"],
+                        preset=profile["preset"], # 由导出档位决定: draft 用 ultrafast, production 用 medium
+                        threads=profile["threads"],
+                        ffmpeg_params=["-crf", str(profile["crf"])],
+                        logger='bar'
+                    )
+            finally:
+                # 6. 清理: 合成片段本身不持有文件, 真正的 reader 在退出 with 时由 pool 统一关闭
+                final_video.close()
+
+        if stats is not None:
+            stats.update({"readers_opened": pool.opened, "peak_open_readers": pool.peak_open})
+        print(f"[Editor] Readers opened {pool.opened} times, at most {pool.peak_open} at once (limit {pool.max_open})")
+        return output_path
+
+    def _render_with_ffmpeg(self, clips: List[Dict], subtitles: List[Dict], output_path: str,
+                            profile: Dict[str, Any]) -> str:
+        """FFmpeg 后端: 同样的 clips/subtitles 输入, 编译为一个 filter graph 单进程渲染"""
+        renderer = FFmpegRenderer(width=profile["width"], height=profile["height"], fps=profile["fps"],
+                                  transition=profile["transition"])
+        with span("render.encode", "render", fps=profile["fps"], codec=profile["codec"]):
+            return renderer.render(clips, subtitles, output_path, codec=profile["codec"], preset=profile["preset"],
+                                   crf=profile["crf"], threads=profile["threads"], audio_bitrate=profile["audio_bitrate"])
+
+    def _render_with_segments(self, clips: List[Dict], subtitles: List[Dict], output_path: str,
+                              profile: Dict[str, Any], output_filename: str) -> str:
+        """分段并行后端: 片段级并行编码, 能用满渲染机的所有核
+        片段按导出档位与分辨率保留在 SEGMENT_CACHE_DIR/<档位>_<宽>x<高>/ 下 (文件名是输入内容 hash),
+        任何运行只改动了个别镜头时再次渲染只会重编码受影响的片段; 不同画面比例的缓存互不影响。
+        manifest 按 <run_id>/<成片名> 记录, 同一次运行重新渲染时只清理它自己不再使用的片段。
+        """
+        segment_dir = os.path.join(SEGMENT_CACHE_DIR, f"{profile['name']}_{profile['width']}x{profile['height']}")
+        # 每个进程单线程编码, 进程数按 profile["threads"] 用满所有核
+        renderer = SegmentRenderer(width=profile["width"], height=profile["height"], fps=profile["fps"],
+                                   transition=profile["transition"], workers=profile["threads"])
+        return renderer.render(clips, subtitles, output_path, codec=profile["codec"], preset=profile["preset"],
+                               crf=profile["crf"], audio_bitrate=profile["audio_bitrate"], segment_dir=segment_dir,
+                               manifest_key=f"{current_run_id()}/{output_filename}")
@@ -0,0 +1,77 @@
+# 成片导出档位: draft(快速预览) / preview(审片) / production(正式交付)
+import os
+from typing import Dict, Any, Optional, Tuple
+
+# 未在 user_params 中指定 export_profile 时使用的档位
+EXPORT_PROFILE = os.getenv("EXPORT_PROFILE", "production")
+EXPORT_CODEC = os.getenv("EXPORT_CODEC", "libx264")
+
+# short_edge: 画面短边像素, 长边由 user_params['ratio'] 推算
+# threads: 0 表示使用全部 CPU 核
+EXPORT_PROFILES: Dict[str, Dict[str, Any]] = {
+    # 低分辨率、低帧率、最快的 preset, 渲染耗时约为 production 的几分之一, 用于尽快给审片人看节奏
+    "draft": {"short_edge": 360, "fps": 12, "crf": 32, "preset": "ultrafast", "audio_bitrate": "64k", "threads": 0},
+    "preview": {"short_edge": 540, "fps": 24, "crf": 26, "preset": "veryfast", "audio_bitrate": "128k", "threads": 0},
+    "production": {"short_edge": 720, "fps": 24, "crf": 20, "preset": "medium", "audio_bitrate": "192k", "threads": 0},
+}
+
+# x264 preset 由快到慢
+_X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+
+
+def parse_ratio(ratio: Optional[str]) -> Tuple[int, int]:
+    """'16:9' / '9:16' / '1:1' -> (宽, 高) 比例; 无法解析时按 16:9 处理"""
+    try:
+        w, h = (int(part) for part in str(ratio).split(":"))
+        if w > 0 and h > 0:
+            return w, h
+    except (TypeError, ValueError):
+        pass
+    if ratio:
+        print(f"[Export] 无法解析画面比例 {ratio!r}, 使用 16:9")
+    return 16, 9
+
+
+def frame_size(ratio: Optional[str], short_edge: int) -> Tuple[int, int]:
+    """按比例和短边算出画面尺寸, 宽高取偶数 (yuv420p 要求)"""
+    w, h = parse_ratio(ratio)
+    long_edge = short_edge * max(w, h) / min(w, h)
+    long_edge = int(round(long_edge / 2)) * 2
+    return (long_edge, short_edge) if w >= h else (short_edge, long_edge)
+
+
+def _adaptive_preset(preset: str, cores: int) -> str:
+    """核数较少的机器上把较慢的 preset 降一档, 避免正式导出耗时成倍增加"""
+    if cores >= 4 or preset not in _X264_PRESETS:
+        return preset
+    index = _X264_PRESETS.index(preset)
+    return _X264_PRESETS[max(index - 1, 0)] if index > _X264_PRESETS.index("fast") else preset
+
+
+def resolve_export_profile(user_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    根据 user_params 生成具体的导出参数:
+      export_profile: "draft" | "preview" | "production", 不传则使用 EXPORT_PROFILE
+      ratio: 画面比例, 例如 "16:9"
+    返回 {name, width, height, fps, codec, crf, preset, threads, audio_bitrate, transition}
+    """
+    user_params = user_params or {}
+    name = user_params.get("export_profile") or EXPORT_PROFILE
+    if name not in EXPORT_PROFILES:
+        raise ValueError(f"未知的导出档位: {name} (可选: {', '.join(EXPORT_PROFILES)})")
+
+    profile = EXPORT_PROFILES[name]
+    cores = os.cpu_count() or 1
+    width, height = frame_size(user_params.get("ratio"), profile["short_edge"])
+    return {
+        "name": name,
+        "width": width,
+        "height": height,
+        "fps": profile["fps"],
+        "codec": EXPORT_CODEC,
+        "crf": profile["crf"],
+        "preset": _adaptive_preset(profile["preset"], cores) if EXPORT_CODEC == "libx264" else profile["preset"],
+        "threads": profile["threads"] or cores,
+        "audio_bitrate": profile["audio_bitrate"],
+        "transition": 0.5,
+    }
@@ -0,0 +1,136 @@
+# FFmpeg 单进程渲染后端: 把 clips/subtitles 编译成一个 filter graph, 一次 ffmpeg 调用完成全部剪辑
+import os
+import subprocess
+import tempfile
+from typing import List, Dict, Any, Tuple
+
+from src.utils.media_probe import probe, FFMPEG_BINARY
+from src.services.subtitle_service import get_subtitle_engine
+
+AUDIO_SAMPLE_RATE = 44100
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.3f}"
+
+
+class FFmpegRenderer:
+    """
+    与 VideoEditorService 的 MoviePy 流程等价的 FFmpeg 实现:
+    - 视频素材: setpts 变速 (0.5x-3.0x 以内) -> 缩放 -> tpad/trim 对齐 target_duration
+    - 图片素材: -loop 1 输入; 缺失素材: color 黑屏
+    - 音频: TTS 音轨 (没有 TTS 时沿用视频自带音轨并同步变速), apad/atrim 对齐时长
+    - 转场: 相邻片段之间 xfade + acrossfade
+    - 字幕: 写成 ASS 字幕轨 (中文字体由 SubtitleEngine 解析) 后用 subtitles 滤镜烧录
+    所有帧都在 ffmpeg 内部处理, 不经过 Python/NumPy。
+    """
+    def __init__(self, width: int = 1280, height: int = 720, fps: int = 24, transition: float = 0.5):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.transition = transition
+        self.subtitle_engine = get_subtitle_engine(width, height)
+
+    def render(self, clips: List[Dict[str, Any]], subtitles: List[Dict], output_path: str,
+               codec: str = "libx264", preset: str = "medium", crf: int = 20, threads: int = 0,
+               audio_bitrate: str = "192k") -> str:
+        output_path = os.path.abspath(output_path)
+        with tempfile.TemporaryDirectory(prefix="ttv_render_") as work_dir:
+            inputs, graph = self.build_graph(clips, subtitles, work_dir)
+            script_path = os.path.join(work_dir, "graph.txt")
+            with open(script_path, "w", encoding="utf-8") as f:
+                f.write(graph)
+
+            cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", *inputs,
+                   "-filter_complex_script", script_path,
+                   "-map", "[vout]", "-map", "[aout]",
+                   "-c:v", codec, "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p",
+                   "-r", str(self.fps), "-threads", str(threads),
+                   "-c:a", "aac", "-b:a", audio_bitrate, "-ar", str(AUDIO_SAMPLE_RATE),
+                   "-movflags", "+faststart", output_path]
+            print(f"[FFmpeg] Rendering {len(clips)} clips in one pass -> {output_path}")
+            # cwd 设为工作目录: subtitles 滤镜直接引用相对文件名, 避免 filter 语法中的路径转义
+            result = subprocess.run(cmd, cwd=work_dir, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"ffmpeg 渲染失败: {result.stderr.strip()[-2000:]}")
+        return output_path
+
+    def build_graph(self, clips: List[Dict[str, Any]], subtitles: List[Dict], work_dir: str) -> Tuple[List[str], str]:
+        """返回 (ffmpeg 输入参数, filter_complex 文本)"""
+        inputs: List[List[str]] = []
+        filters: List[str] = []
+        durations = [float(c["target_duration"]) for c in clips]
+        # 转场时长不能超过最短片段的一半, 否则 xfade 的 offset 会变成负数
+        transition = min(self.transition, min(durations) / 2) if len(clips) > 1 else 0.0
+
+        for i, clip_data in enumerate(clips):
+            v_chain, a_chain = self._clip_chains(clip_data, durations[i], inputs)
+            filters.append(f"{v_chain}[v{i}]")
+            filters.append(f"{a_chain}[a{i}]")
+
+        # 转场拼接: 第 i 段在累计时长减去转场时长处开始淡入
+        v_last, a_last, timeline = "v0", "a0", durations[0]
+        for i in range(1, len(clips)):
+            offset = timeline - transition
+            filters.append(f"[{v_last}][v{i}]xfade=transition=fade:duration={_fmt(transition)}:offset={_fmt(offset)}[vx{i}]")
+            filters.append(f"[{a_last}][a{i}]acrossfade=d={_fmt(transition)}[ax{i}]")
+            v_last, a_last = f"vx{i}", f"ax{i}"
+            timeline += durations[i] - transition
+
+        if subtitles:
+            self.subtitle_engine.write_ass(subtitles, os.path.join(work_dir, "subs.ass"))
+            filters.append(f"[{v_last}]{self._subtitle_filter('subs.ass', self.subtitle_engine.prepare_fonts_dir(work_dir))}[vout]")
+        else:
+            filters.append(f"[{v_last}]null[vout]")
+        filters.append(f"[{a_last}]anull[aout]")
+        return [arg for group in inputs for arg in group], ";\n".join(filters)
+
+    def _clip_chains(self, clip_data: Dict[str, Any], duration: float, inputs: List[List[str]]) -> Tuple[str, str]:
+        """构建单个片段的视频/音频滤镜链; 需要的输入追加到 inputs, ffmpeg 的输入编号即其下标"""
+        video_path = clip_data.get("video_path")
+        image_path = clip_data.get("image_path")
+        audio_path = clip_data.get("audio_path")
+        speed_factor = 1.0
+        video_index = None
+
+        if video_path and os.path.exists(video_path):
+            info = probe(video_path)
+            if info["duration"]:
+                factor = info["duration"] / duration
+                # 限制变速倍率，防止过于鬼畜 (0.5x - 3.0x)
+                if 0.5 <= factor <= 3.0:
+                    speed_factor = factor
+            video_index = len(inputs)
+            inputs.append(["-i", os.path.abspath(video_path)])
+            v_src = f"[{video_index}:v]setpts=(PTS-STARTPTS)/{speed_factor:.6f}"
+            video_has_audio = info["has_audio"]
+        elif image_path and os.path.exists(image_path):
+            inputs.append(["-loop", "1", "-framerate", str(self.fps), "-t", _fmt(duration), "-i", os.path.abspath(image_path)])
+            v_src = f"[{len(inputs) - 1}:v]setpts=PTS-STARTPTS"
+            video_has_audio = False
+        else:
+            v_src = f"color=c=black:s={self.width}x{self.height}:r={self.fps}:d={_fmt(duration)}"
+            video_has_audio = False
+
+        # xfade 要求两路输入的分辨率、像素格式、时间基和恒定帧率完全一致, fps 必须放在最后
+        v_chain = (f"{v_src},scale={self.width}:{self.height},setsar=1,"
+                   f"tpad=stop_mode=clone:stop_duration={_fmt(duration)},trim=duration={_fmt(duration)},"
+                   f"setpts=PTS-STARTPTS,format=yuv420p,settb=AVTB,fps={self.fps}")
+
+        if audio_path and os.path.exists(audio_path):
+            inputs.append(["-i", os.path.abspath(audio_path)])
+            a_src = f"[{len(inputs) - 1}:a]asetpts=PTS-STARTPTS"
+        elif video_has_audio:
+            # 与 MoviePy 的 speedx 一致: 视频自带音轨随画面一起变速
+            a_src = f"[{video_index}:a]atempo={speed_factor:.6f}"
+        else:
+            a_src = f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl=stereo"
+
+        a_chain = (f"{a_src},aresample={AUDIO_SAMPLE_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo,"
+                   f"apad,atrim=duration={_fmt(duration)},asetpts=PTS-STARTPTS")
+        return v_chain, a_chain
+
+    @staticmethod
+    def _subtitle_filter(ass_name: str, fonts_dir: str = None) -> str:
+        # 文件名/目录都是相对 cwd(work_dir) 的简单名字, 不需要 filter 语法转义
+        return f"subtitles={ass_name}:fontsdir={fonts_dir}" if fonts_dir else f"subtitles={ass_name}"
@@ -1,18 +1,23 @@
 import json
 import os
+import re
+import asyncio
 import base64
 import mimetypes
 
-from typing import List, Dict, Any
-from pydantic import BaseModel, Field
+from typing import AsyncIterator, List, Dict, Any, Tuple, Optional
+from pydantic import BaseModel, Field, ValidationError
 from langchain_openai import ChatOpenAI
 from langchain.chat_models import init_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, SystemMessage, human
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.exceptions import OutputParserException
 
-from utils.tools import encode_image
-from utils.universal_prompt import vlm_system_message
+from src.utils.tools import prepare_image_for_upload
+from src.services.rate_limiter import get_governor, PRIORITY_HIGH
+from src.services.retry_policy import call_provider, acall_provider, ProviderError
+from src.utils.universal_prompt import vlm_system_message, vlm_batch_system_message
 
 # 定义分镜的输出结构，强制 LLM 遵守
 class StoryboardItemSchema(BaseModel):
@@ -25,6 +30,18 @@ class StoryboardItemSchema(BaseModel):
 class StoryboardList(BaseModel):
     items: List[StoryboardItemSchema]
 
+# 修复分镜时长缺失时的估算语速 (字/秒)
+SPEECH_CHARS_PER_SECOND = 4.0
+
+
+class StoryboardError(RuntimeError):
+    """LLM 没有给出可用的分镜脚本"""
+
+
+def _json_schema_format(model: type) -> Dict[str, Any]:
+    """OpenAI 兼容接口的 response_format, 约束模型按 pydantic schema 输出 JSON"""
+    return {"type": "json_schema", "json_schema": {"name": model.__name__, "schema": model.model_json_schema()}}
+
 class LLMService:
     def __init__(self):
         # 这里的 API Key通常从环境变量读取
@@ -32,11 +49,15 @@ class LLMService:
         api_key = os.getenv("GEMINI_API_KEY")
         api_base = os.getenv("GEMINI_API_BASE")
         model = os.getenv("MODEL_NAME")
+        # 配额按调用类型区分: 文本生成走 "chat", 视觉校验走 "vlm"
+        self.model_name = model
 
         self.llm = init_chat_model(
             model = model,
             openai_api_base=api_base,
             openai_api_key=api_key,
+            # 重试统一由 retry_policy 负责, 避免 SDK 内部重试和外层重试叠加
+            max_retries=0,
         )
 
     def refine_style(self, topic: str, user_style: str) -> str:
@@ -44,100 +65,338 @@ class LLMService:
         if not self.llm:
             return f"Cinematic shot, {user_style}, high detailed, consistent lighting, related to {topic}, 8k resolution."
         
-        prompt = ChatPromptTemplate.from_messages([
+        chain = self._style_prompt() | self.llm
+        return call_provider("chat", self.model_name, chain.invoke, {"topic": topic, "style": user_style}).content
+
+    async def arefine_style(self, topic: str, user_style: str) -> str:
+        """refine_style 的异步版本"""
+        if not self.llm:
+            return self.refine_style(topic, user_style)
+
+        chain = self._style_prompt() | self.llm
+        return (await acall_provider("chat", self.model_name, chain.ainvoke, {"topic": topic, "style": user_style})).content
+
+    @staticmethod
+    def _style_prompt() -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages([
             ("system", "你是艺术总监。基于Topic，将用户输入的Style展开为详细的图像生成提示"),
             ("user", "Topic: {topic}\nStyle: {style}")
         ])
-        chain = prompt | self.llm
-        return chain.invoke({"topic": topic, "style": user_style}).content
 
 
     def generate_storyboard(self, topic: str, style_prompt: str) -> List[Dict]:
-        """生成结构化分镜脚本"""
+        """生成结构化分镜脚本; 不符合 schema 的条目逐条修复或重新生成"""
         if not self.llm:
             # MOCK DATA: 如果没有配置 LLM，返回假数据
             print("[LLMService] Using Mock Storyboard Data")
-            return [
-                {
-                    "text_content": f"Welcome to the world of {topic}.",
-                    "emotion": "mysterious",
-                    "visual_prompt": f"Wide shot of {topic}, {style_prompt}, cinematic lighting",
-                    "visual_tags": ["wide-shot", "intro"],
-                    "estimated_duration": 3.0
-                },
-                {
-                    "text_content": "Everything changes here.",
-                    "emotion": "intense",
-                    "visual_prompt": f"Close up details of {topic}, dramatic shadows",
-                    "visual_tags": ["close-up", "drama"],
-                    "estimated_duration": 2.5
-                }
-            ]
+            return self._mock_storyboard(topic, style_prompt)
 
-        # 使用 Pydantic parser 保证 JSON 格式正确
-        parser = JsonOutputParser(pydantic_object=StoryboardList)
-        
-        prompt = ChatPromptTemplate.from_messages([
+        # 分镜脚本阻塞后续所有节点, 排在其他 LLM 请求前面
+        result = call_provider("chat", self.model_name, self._storyboard_chain().invoke,
+                               self._storyboard_inputs(topic, style_prompt), priority=PRIORITY_HIGH)
+        items = []
+        for raw in self._raw_items(result):
+            item = self._repair_item(raw)
+            if item is None:
+                print(f"[LLMService] 第 {len(items)} 条分镜不符合 schema, 单独重新生成")
+                item = self._regenerate_item(topic, style_prompt, len(items), items)
+            items.append(item)
+        if not items:
+            raise StoryboardError(f"LLM 未返回任何分镜: {str(result)[:200]}")
+        return items
+
+    async def agenerate_storyboard(self, topic: str, style_prompt: str) -> List[Dict]:
+        """generate_storyboard 的异步版本"""
+        return [item async for item in self.astream_storyboard(topic, style_prompt)]
+
+    async def astream_storyboard(self, topic: str, style_prompt: str) -> AsyncIterator[Dict]:
+        """
+        流式生成分镜: LLM 还在输出后面的镜头时, 已经写完的镜头就逐条 yield 出去, 调用方可以立即开始生成素材。
+        第 k 条在第 k+1 条开始输出 (或整个输出结束) 时才视为完整; 每条都经过 schema 校验, 不合格的修复或单独重新生成。
+        没有输出任何镜头之前失败, 回退为带重试的非流式生成; 输出中途失败抛 StoryboardError。
+        """
+        if not self.llm:
+            for item in self._mock_storyboard(topic, style_prompt):
+                yield item
+            return
+
+        inputs = self._storyboard_inputs(topic, style_prompt)
+        chain = self._storyboard_chain()
+        items: List[Dict] = []
+        # 流式输出期间一直占用 chat 配额的一个槽位, 单条重新生成也要申请 chat 槽位;
+        # 在槽位内重新生成会和自己抢配额 (槽位用满时死锁), 所以遇到不合格的条目后, 它和之后的条目 (保持镜头顺序)
+        # 都先暂存, 流式输出结束、释放槽位之后再处理
+        deferred: List[Any] = []
+        consumed = 0
+        pending: List[Any] = []
+
+        async def finalize(raw: Any) -> Dict:
+            item = self._repair_item(raw)
+            if item is None:
+                print(f"[LLMService] 第 {len(items)} 条分镜不符合 schema, 单独重新生成")
+                item = await self._aregenerate_item(topic, style_prompt, len(items), items)
+            items.append(item)
+            return item
+
+        try:
+            async with get_governor().aslot("chat", self.model_name, PRIORITY_HIGH):
+                async for partial in chain.astream(inputs):
+                    raw_items = self._raw_items(partial)
+                    # 最后一条可能还没写完, 只处理它之前的条目
+                    pending = raw_items[consumed:]
+                    for raw in pending[:-1]:
+                        consumed += 1
+                        item = None if deferred else self._repair_item(raw)
+                        if item is None:
+                            deferred.append(raw)
+                            continue
+                        items.append(item)
+                        yield item
+                    pending = pending[-1:]
+        except Exception as e:
+            if items or deferred:
+                raise StoryboardError(f"分镜流式输出在第 {consumed} 条之后中断: {e}") from e
+            print(f"[LLMService] 分镜流式输出失败, 回退为非流式生成: {e}")
+            result = await acall_provider("chat", self.model_name, chain.ainvoke, inputs, priority=PRIORITY_HIGH)
+            pending = self._raw_items(result)
+
+        for raw in deferred + pending:
+            yield await finalize(raw)
+        if not items:
+            raise StoryboardError("LLM 未返回任何分镜")
+
+    def _storyboard_chain(self):
+        # 使用模型原生的结构化输出 (json_schema), JsonOutputParser 在流式输出时给出逐步完整的部分结果
+        llm = self.llm.bind(response_format=_json_schema_format(StoryboardList))
+        return self._storyboard_prompt() | llm | JsonOutputParser()
+
+    @staticmethod
+    def _storyboard_inputs(topic: str, style_prompt: str) -> Dict[str, str]:
+        return {
+            "topic": topic,
+            "style": style_prompt,
+            "format_instructions": JsonOutputParser(pydantic_object=StoryboardList).get_format_instructions(),
+        }
+
+    @staticmethod
+    def _raw_items(result: Any) -> List[Any]:
+        """兼容 {"items": [...]} 和直接返回列表两种输出"""
+        if isinstance(result, dict):
+            result = result.get("items")
+        return list(result) if isinstance(result, list) else []
+
+    @staticmethod
+    def _repair_item(raw: Any) -> Optional[Dict]:
+        """校验单条分镜, 可修复的字段 (标签写成字符串、时长带单位、缺情感等) 就地修复; 文案或画面提示词缺失返回 None"""
+        try:
+            return StoryboardItemSchema.model_validate(raw).model_dump()
+        except ValidationError:
+            pass
+        if not isinstance(raw, dict):
+            return None
+        item = dict(raw)
+        text = str(item.get("text_content") or "").strip()
+        visual_prompt = str(item.get("visual_prompt") or "").strip()
+        if not text or not visual_prompt:
+            return None
+        item["text_content"], item["visual_prompt"] = text, visual_prompt
+        item["emotion"] = str(item.get("emotion") or "neutral")
+
+        tags = item.get("visual_tags")
+        if isinstance(tags, str):
+            tags = [tag.strip() for tag in re.split(r"[,，、;]", tags) if tag.strip()]
+        item["visual_tags"] = [str(tag) for tag in tags] if isinstance(tags, list) else []
+
+        duration = re.search(r"\d+(\.\d+)?", str(item.get("estimated_duration", "")))
+        item["estimated_duration"] = float(duration.group()) if duration else round(len(text) / SPEECH_CHARS_PER_SECOND, 1)
+        try:
+            return StoryboardItemSchema.model_validate(item).model_dump()
+        except ValidationError:
+            return None
+
+    def _regenerate_item(self, topic: str, style_prompt: str, index: int, previous: List[Dict]) -> Dict:
+        shot = call_provider("chat", self.model_name, self._shot_chain().invoke,
+                             self._shot_inputs(topic, style_prompt, index, previous), priority=PRIORITY_HIGH)
+        return shot.model_dump()
+
+    async def _aregenerate_item(self, topic: str, style_prompt: str, index: int, previous: List[Dict]) -> Dict:
+        shot = await acall_provider("chat", self.model_name, self._shot_chain().ainvoke,
+                                    self._shot_inputs(topic, style_prompt, index, previous), priority=PRIORITY_HIGH)
+        return shot.model_dump()
+
+    def _shot_chain(self):
+        return ChatPromptTemplate.from_messages([
+            ("system", "你是一个视频导演。为故事板补写指定编号的一个镜头, 与前面的镜头保持连贯。"),
+            ("user", "Topic: {topic}\nVisual Style: {style}\n前面的镜头:\n{previous}\n\n请生成第 {index} 个镜头。")
+        ]) | self.llm.with_structured_output(StoryboardItemSchema)
+
+    @staticmethod
+    def _shot_inputs(topic: str, style_prompt: str, index: int, previous: List[Dict]) -> Dict[str, Any]:
+        # 只带最近几条作为上下文, 控制 prompt 长度
+        context = "\n".join(f"[{i}] {item['text_content']}" for i, item in enumerate(previous)
+                            if i >= len(previous) - 3) or "(无)"
+        return {"topic": topic, "style": style_prompt, "index": index, "previous": context}
+
+    @staticmethod
+    def _mock_storyboard(topic: str, style_prompt: str) -> List[Dict]:
+        return [
+            {
+                "text_content": f"Welcome to the world of {topic}.",
+                "emotion": "mysterious",
+                "visual_prompt": f"Wide shot of {topic}, {style_prompt}, cinematic lighting",
+                "visual_tags": ["wide-shot", "intro"],
+                "estimated_duration": 3.0
+            },
+            {
+                "text_content": "Everything changes here.",
+                "emotion": "intense",
+                "visual_prompt": f"Close up details of {topic}, dramatic shadows",
+                "visual_tags": ["close-up", "drama"],
+                "estimated_duration": 2.5
+            }
+        ]
+
+    @staticmethod
+    def _storyboard_prompt() -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages([
             ("system", "你是一个视频导演。根据Topic生成一个故事板。严格返回JSON."),
             ("user", "Topic: {topic}\nVisual Style: {style}\n\n{format_instructions}")
         ])
 
-        chain = prompt | self.llm | parser
-        
+
+    def validate_image_quality(self, image_path: str, prompt: str) -> Dict[str, Any]:
+        """VLM 视觉校验
+        调用失败 (重试耗尽或不可重试) 时抛 ProviderError; 输出无法解析时按未通过处理, 总是返回校验结果
+        """
+        resposne = call_provider("vlm", self.model_name, self.llm.invoke,
+                                 self._build_validation_messages(image_path, prompt))
+        return self._parse_validation(resposne.content)
+
+    async def avalidate_image_quality(self, image_path: str, prompt: str) -> Dict[str, Any]:
+        """VLM 视觉校验 - 异步版本"""
+        # Base64 编码是纯 CPU/磁盘操作, 放到线程里避免阻塞事件循环
+        messages = await asyncio.to_thread(self._build_validation_messages, image_path, prompt)
+        resposne = await acall_provider("vlm", self.model_name, self.llm.ainvoke, messages)
+        return self._parse_validation(resposne.content)
+
+    def validate_images_batch(self, items: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """批量 VLM 校验: items 为 [(image_path, prompt), ...], 返回与输入一一对应的校验结果
+        N 张图打包成一个多模态请求; 解析失败或缺失的条目回退为单图校验。
+        """
+        verdicts = []
         try:
-            result = chain.invoke({
-                "topic": topic, 
-                "style": style_prompt,
-                "format_instructions": parser.get_format_instructions()
-            })
-            return result['items'] # 返回列表
+            resposne = call_provider("vlm", self.model_name, self.llm.invoke,
+                                     self._build_batch_validation_messages(items))
+            verdicts = self._parse_batch_validation(resposne.content, len(items))
         except Exception as e:
-            print(f"[LLM Error] {e}")
-            return []
+            print(f"[VLM Batch] 批量校验失败, 全部回退为单图校验: {e}")
+            verdicts = [None] * len(items)
 
+        return [v if v is not None else self.validate_image_quality(path, prompt)
+                for v, (path, prompt) in zip(verdicts, items)]
 
-    def validate_image_quality(self, image_path: str, prompt: str) -> Dict[str, Any]:
-        """VLM 视觉校验"""
-        # 获取Base64编码
+    async def avalidate_images_batch(self, items: List[Tuple[str, str]]) -> List[Any]:
+        """validate_images_batch 的异步版本, 回退的单图校验并发执行;
+        某张图的单图校验失败时, 对应位置是该异常对象 (不影响其他图片已经拿到的结果)"""
         try:
-            image_data_url = encode_image(image_path)
-
-            # 构建多模态Messages
-            sys_msg = SystemMessage(content=vlm_system_message)
-            human_msg = HumanMessage(
-                content=[
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": image_data_url}
-                    }
-                ]
-            )
-            resposne = self.llm.invoke([sys_msg, human_msg])
-            alignment_score = resposne.prompt_image_alignment_score
-            quality_score = resposne.visual_quality_score
-            satisfy_judge = resposne.is_prompt_satisfied
-            problems = resposne.problems
-            positive_aspects = resposne.positive_aspects
-            overall_comment = resposne.overall_comment
-
-            if satisfy_judge and (alignment_score + quality_score > 12):
-                return {
-                    "passed": True,
-                    "reason": positive_aspects,
-                }
-            else:
-                return {
-                    "passed": False,
-                    "reason": problems,
-                    "suggestion": overall_comment,
+            messages = await asyncio.to_thread(self._build_batch_validation_messages, items)
+            resposne = await acall_provider("vlm", self.model_name, self.llm.ainvoke, messages)
+            verdicts = self._parse_batch_validation(resposne.content, len(items))
+        except Exception as e:
+            print(f"[VLM Batch] 批量校验失败, 全部回退为单图校验: {e}")
+            verdicts = [None] * len(items)
+
+        fallback = [i for i, v in enumerate(verdicts) if v is None]
+        if fallback:
+            print(f"[VLM Batch] {len(fallback)}/{len(items)} 条结果无法解析, 回退为单图校验")
+            results = await asyncio.gather(*(self.avalidate_image_quality(*items[i]) for i in fallback),
+                                           return_exceptions=True)
+            for i, result in zip(fallback, results):
+                verdicts[i] = result
+        return verdicts
+
+    @staticmethod
+    def _build_validation_messages(image_path: str, prompt: str) -> list:
+        """构建多模态Messages"""
+        # 缩放 + 重编码后的 Base64 (按文件 hash 缓存, 重试时不会重复编码)
+        image_data_url = prepare_image_for_upload(image_path)
+
+        sys_msg = SystemMessage(content=vlm_system_message)
+        human_msg = HumanMessage(
+            content=[
+                {
+                    "type": "text",
+                    "text": prompt
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {"url": image_data_url}
                 }
+            ]
+        )
+        return [sys_msg, human_msg]
 
-        except Exception as e:
-            print(f"发现错误: {e}")
+    @staticmethod
+    def _build_batch_validation_messages(items: List[Tuple[str, str]]) -> list:
+        """构建批量校验的多模态Messages: 每组 "[编号] Prompt" 文本后紧跟对应图像"""
+        content = []
+        for index, (image_path, prompt) in enumerate(items):
+            content.append({"type": "text", "text": f"[{index}] Prompt: {prompt}"})
+            content.append({"type": "image_url", "image_url": {"url": prepare_image_for_upload(image_path)}})
+        return [SystemMessage(content=vlm_batch_system_message), HumanMessage(content=content)]
+
+    @classmethod
+    def _parse_batch_validation(cls, content: str, size: int) -> List[Optional[Dict[str, Any]]]:
+        """解析批量校验输出; 无法解析的条目返回 None, 由调用方回退为单图校验"""
+        verdicts: List[Optional[Dict[str, Any]]] = [None] * size
+        parsed = JsonOutputParser().parse(content)
+        if not isinstance(parsed, list):
+            return verdicts
+        for position, verdict in enumerate(parsed):
+            if not isinstance(verdict, dict):
+                continue
+            index = verdict.get("index", position)
+            if not isinstance(index, int) or not 0 <= index < size:
+                continue
+            try:
+                verdicts[index] = cls._verdict_to_result(verdict)
+            except (KeyError, TypeError) as e:
+                print(f"[VLM Batch] 第 {index} 条结果格式错误: {e}")
+        return verdicts
+
+    @classmethod
+    def _parse_validation(cls, content: str) -> Dict[str, Any]:
+        """解析 vlm_system_message 约定的 JSON 输出; 格式不符时返回未通过的结果"""
+        try:
+            return cls._verdict_to_result(JsonOutputParser().parse(content))
+        except (OutputParserException, KeyError, TypeError) as e:
+            print(f"[VLM] 校验结果无法解析, 按未通过处理: {e}")
+            return {
+                "passed": False,
+                "reason": [f"VLM 输出无法解析: {e}"],
+                "suggestion": "",
+            }
+
+    @staticmethod
+    def _verdict_to_result(verdict: Dict[str, Any]) -> Dict[str, Any]:
+        alignment_score = verdict["prompt_image_alignment_score"]
+        quality_score = verdict["visual_quality_score"]
+        satisfy_judge = verdict["is_prompt_satisfied"]
+        problems = verdict.get("problems", [])
+        positive_aspects = verdict.get("positive_aspects", [])
+        overall_comment = verdict.get("overall_comment", "")
+
+        if satisfy_judge and (alignment_score + quality_score > 12):
+            return {
+                "passed": True,
+                "reason": positive_aspects,
+            }
+        else:
+            return {
+                "passed": False,
+                "reason": problems,
+                "suggestion": overall_comment,
+            }
 
 
     def optimize_prompt(self, original_prompt: str, reason: str) -> str:
@@ -0,0 +1,133 @@
+# 生成素材的内容寻址缓存 (跨运行复用, 磁盘容量受限的 LRU 淘汰)
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, Iterable
+
+from src.utils.tools import file_sha256
+
+CACHE_DIR = Path(os.getenv("MEDIA_CACHE_DIR", str(Path("data") / "cache")))
+# 缓存总大小上限(字节), 默认 20GB; 超出后按最近访问时间淘汰
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))
+# MEDIA_CACHE=0 时关闭缓存 (例如需要强制重新生成)
+MEDIA_CACHE_ENABLED = os.getenv("MEDIA_CACHE", "1") != "0"
+
+
+class MediaCache:
+    """
+    以 hash(kind, 模型, prompt, 参考图内容, 音色, 参数...) 为 key 的素材缓存
+    - 文件本体存放在 cache_dir/objects/<key[:2]>/<key><suffix>
+    - 索引(大小、最近访问时间、附加元数据)存放在 sqlite 中, 多个进程可以安全共享
+    - 命中时把文件硬链接(跨盘则复制)到调用方期望的输出路径
+    """
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_bytes: int = MEDIA_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.cache_dir / "index.sqlite", check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, "
+            "last_access REAL NOT NULL, meta TEXT)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def make_key(kind: str, ref_files: Iterable[str] = (), **params) -> str:
+        """计算缓存 key; ref_files 中的文件按内容 hash 参与计算 (路径本身不参与)"""
+        payload = {
+            "kind": kind,
+            "params": params,
+            "refs": [file_sha256(p) if p and os.path.exists(p) else None for p in ref_files],
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, dest_path: str) -> Optional[Dict[str, Any]]:
+        """命中则把缓存文件放到 dest_path 并返回元数据, 未命中返回 None"""
+        with self._lock:
+            row = self._db.execute("SELECT path, meta FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            cached_path, meta = row
+            if not os.path.exists(cached_path):
+                # 文件被外部删除: 清理索引, 视为未命中
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+
+        self._materialize(cached_path, dest_path)
+        print(f"[MediaCache] Hit {key[:12]} -> {dest_path}")
+        return json.loads(meta) if meta else {}
+
+    def put(self, key: str, src_path: str, meta: Optional[Dict[str, Any]] = None):
+        """把新生成的文件写入缓存, 并在超出容量时淘汰最久未访问的条目"""
+        if not src_path or not os.path.exists(src_path):
+            return
+        suffix = Path(src_path).suffix
+        cached_path = self.objects_dir / key[:2] / f"{key}{suffix}"
+        cached_path.parent.mkdir(parents=True, exist_ok=True)
+        # 先复制到临时文件再 rename, 避免并发读到半截文件
+        tmp_path = cached_path.with_suffix(suffix + ".tmp")
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, cached_path)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, path, size, last_access, meta) VALUES (?, ?, ?, ?, ?)",
+                (key, str(cached_path), cached_path.stat().st_size, time.time(), json.dumps(meta or {}, ensure_ascii=False)),
+            )
+            self._db.commit()
+            self._evict()
+
+    def _evict(self):
+        """LRU 淘汰: 调用方需持有 self._lock"""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT key, path, size FROM entries ORDER BY last_access ASC").fetchall()
+        for key, path, size in rows:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            print(f"[MediaCache] Evicted {key[:12]} ({size} bytes)")
+        self._db.commit()
+
+    @staticmethod
+    def _materialize(cached_path: str, dest_path: str):
+        """硬链接到输出路径(淘汰缓存不会影响已链接出去的文件), 跨文件系统时退化为复制"""
+        Path(dest_path).parent.mkdir(parents=True, exist_ok=True)
+        if os.path.exists(dest_path):
+            if os.path.samefile(cached_path, dest_path):
+                return
+            os.remove(dest_path)
+        try:
+            os.link(cached_path, dest_path)
+        except OSError:
+            shutil.copyfile(cached_path, dest_path)
+
+
+_media_cache: Optional[MediaCache] = None
+
+def get_media_cache() -> Optional[MediaCache]:
+    """进程内共享的缓存实例; MEDIA_CACHE=0 时返回 None"""
+    global _media_cache
+    if not MEDIA_CACHE_ENABLED:
+        return None
+    if _media_cache is None:
+        _media_cache = MediaCache()
+    return _media_cache
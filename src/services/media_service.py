@@ -1,41 +1,65 @@
 # 负责生图、生视频、TTS (ComfyUI, Runway, EdgeTTS)
 import os
 import time
-import requests
+import asyncio
 import random
 import dashscope
-from http import HTTPStatus
-import dashscope
 
-from datetime import datetime
-from pathlib import Path, PurePosixPath
+from pathlib import PurePosixPath
 from http import HTTPStatus
+from functools import partial
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 from urllib.parse import urlparse, unquote
 from dashscope import ImageSynthesis, VideoSynthesis
 from dashscope.audio.tts_v2 import *
 
-from utils.tools import encode_image
-from utils.universal_prompt import video_gen_prompt, video_gen_bad_prompt
+from src.utils.tools import encode_image, file_sha256
+from src.utils.media_probe import audio_duration
+from src.utils.audio_tools import trim_silence
+from src.services.video_job_service import get_i2v_job_manager
+from src.services.media_cache import MediaCache, get_media_cache
+from src.services.download_service import get_download_manager
+from src.services.tts_service import TTS_STREAMING, synthesize_to_file
+from src.services.rate_limiter import get_governor, PRIORITY_HIGH
+from src.services.retry_policy import call_provider, acall_provider
+from src.services.tts_service import TTSError
+from src.services.artifact_store import atomic_write, get_artifact_store
+from src.utils.universal_prompt import video_gen_prompt, video_gen_bad_prompt
 
-# 获取当前时间并格式化
-time_str = datetime.now().strftime("%m-%d-%H-%M")
+# 产物分类: 文件保存在 ArtifactStore 中本次运行 (run_id) 的命名空间下, 例如 data/runs/<run_id>/image/,
+# 并发的多次运行不会互相覆盖; 目录在第一次使用时创建, import 本模块不产生副作用
+IMAGE = "image"
+AUDIO = "audio"
+STORYBOARD = "storyboard"
+VIDEO = "video"
 
-# 创建文件保存路径
-IMG_DIR = Path("data") / "image" / time_str
-IMG_DIR.mkdir(parents=True, exist_ok=True)
+VIDEO_MODEL = os.getenv("VIDEO_MODEL_NAME")
+VIDEO_API_KEY = os.getenv("VIDEO_API_KEY")
+VIDEO_API_BASE = os.getenv("VIDEO_API_BASE")
 
-AUI_DIR = Path("data") / "audio" / time_str
-AUI_DIR.mkdir(parents=True, exist_ok=True)
+# 分镜图尺寸 (宽*高), 参与缓存 key: 换了尺寸不会命中旧尺寸的缓存
+STORYBOARD_IMAGE_SIZE = os.getenv("STORYBOARD_IMAGE_SIZE", "1280*720")
 
-BOARD_IMG_DIR = Path("data") / "StoryBoard" / time_str
-BOARD_IMG_DIR.mkdir(parents=True, exist_ok=True)
+# 异步任务轮询间隔(秒)
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "3"))
 
-VID_DIR = Path("data") / "video" / time_str
-VID_DIR.mkdir(parents=True, exist_ok=True)
+# TTS 音频首尾静音裁剪 (可选): 时间轴按裁剪后的实际时长计算, 镜头之间不会出现多余的停顿
+TTS_TRIM_SILENCE = os.getenv("TTS_TRIM_SILENCE", "0") == "1"
+TTS_SILENCE_DB = float(os.getenv("TTS_SILENCE_DB", "-45"))
 
-VIDEO_MODEL = os.getenv("VIDEO_MODEL_NAME")
-VIDEO_API_KEY = os.getenv("VIDEO_API_KEY")
-VIDEO_API_BASE = os.getenv("VIDEO_API_BASE")
+# 异步生成任务按 (类型, 缓存 key, 输出路径) 去重 (single-flight): script_node 拿到流式分镜后预取的 TTS/生图,
+# 和同时进行的镜头节点正式调用共享同一次执行。任务结束 (无论成败) 即移除, 表只包含在途任务, 长期运行不会累积;
+# 结束之后的调用由 MediaCache 命中已生成的文件
+_inflight: Dict[Tuple[str, str, str], asyncio.Task] = {}
+
+
+def _forget(key: Tuple[str, str, str], task: asyncio.Task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+
+
+class MediaGenerationError(RuntimeError):
+    """生成接口返回后没有得到素材文件; 这时不写缓存、不登记产物"""
 
 
 class MediaGenService:
@@ -50,23 +74,35 @@ class MediaGenService:
 
     def generate_reference_image(self, prompt: str) -> str:
         """生成锚点图 (Anchor Image)"""
+        cache_key = self._reference_image_key(prompt)
+        cached_path = self._artifact_path(IMAGE, f"anchor_{cache_key[:16]}.png")
+        if self._cache_lookup(cache_key, cached_path) is not None:
+            self._publish(cached_path, IMAGE, {"kind": "anchor", "cache_key": cache_key})
+            return cached_path
         
         dashscope.base_http_api_url = os.getenv("IMAGE_API_BASE")
-        response = ImageSynthesis.call(api_key=self.img_api_key,
+        # 锚点图阻塞后续所有镜头, 排在其他生图请求前面
+        # 失败 (重试耗尽或不可重试) 时抛 ProviderError
+        response = call_provider("image", self.img_model_name, ImageSynthesis.call,
+                          api_key=self.img_api_key,
                           model=self.img_model_name,
                           prompt=prompt,
                           n=1,
                           size='1328*1328',
                           prompt_extend=True,
-                          watermark=True)
+                          watermark=True,
+                          priority=PRIORITY_HIGH)
         
-        if response.status_code == HTTPStatus.OK:
-            for result in response.output.results:
-                file_name = PurePosixPath(unquote(urlparse(result.url).path)).parts[-1]
-                save_path = rf"{IMG_DIR}/{file_name}"
-                with open(save_path, 'wb+') as f:
-                    f.write(requests.get(result.url).content)
-
+        save_path = None
+        downloads = []
+        for result in response.output.results:
+            file_name = PurePosixPath(unquote(urlparse(result.url).path)).parts[-1]
+            save_path = self._artifact_path(IMAGE, file_name)
+            downloads.append((result.url, save_path))
+        get_download_manager().download_many(downloads)
+        if save_path is not None:
+            self._cache_store(cache_key, save_path)
+            self._publish(save_path, IMAGE, {"kind": "anchor", "cache_key": cache_key})
 
         return save_path
         # 生成一个纯色图片作为 Mock
@@ -78,22 +114,38 @@ class MediaGenService:
         这里应该是: 用ComfyUI工作流; 目前尚未有合适的接口;  这里可以加入duration参数, 1s一张分镜(这里是个创新点-一键生成分镜) 需要调研下
         刚刚看到一个新开源项目: open-sora; "图生视频"和"文生视频"两类
         """
-        print(f"[MediaService] Generating Image: {prompt[:30]}... (Ref: {anchor_img_path})")
-        time.sleep(1)
-        
         filename = f"board_img_{id}.png"
-        board_img_path = rf"{BOARD_IMG_DIR}/{filename}"
+        board_img_path = self._artifact_path(STORYBOARD, filename)
+        cache_key = self._control_image_key(prompt, anchor_img_path)
+        if self._cache_lookup(cache_key, board_img_path) is not None:
+            self._publish(board_img_path, STORYBOARD, {"shot_id": id, "cache_key": cache_key})
+            return board_img_path
+
+        print(f"[MediaService] Generating Image: {prompt[:30]}... (Ref: {anchor_img_path})")
+        with get_governor().slot("image", self.img_model_name):
+            time.sleep(1)
+
+        self._require_output(board_img_path, id)
+        self._cache_store(cache_key, board_img_path)
+        self._publish(board_img_path, STORYBOARD, {"shot_id": id, "cache_key": cache_key})
         return board_img_path
         # return self._create_mock_image(filename, color="green")
 
 
     def image_to_video(self, id: str, image_path: str, motion_strength: float = 0.5) -> str:
         """图生视频 (I2V)"""
+        video_path = self._artifact_path(VIDEO, f"{id}.mp4")
+        cache_key = self._video_key(image_path, motion_strength)
+        cached = self._cache_lookup(cache_key, video_path)
+        if cached is not None:
+            self._publish(video_path, VIDEO, {"shot_id": id, "cache_key": cache_key})
+            return video_path, cached.get("actual_prompt")
+
         print(f"[MediaService] Generating Video from {image_path}...")
-        time.sleep(2) # 模拟视频生成耗时
 
         image_base = encode_image(image_path)
-        rsp = VideoSynthesis.call(
+        rsp = call_provider(
+            "video", VIDEO_MODEL, VideoSynthesis.call,
             api_key=VIDEO_API_KEY,
             prompt=video_gen_prompt,
             img_url=image_base,
@@ -102,42 +154,301 @@ class MediaGenService:
             extend_prompt=True,
             negative_prompt=video_gen_bad_prompt,
         )
-        if rsp.status_code == HTTPStatus.OK:
-            print("video_url:", rsp.output.video_url)
-            video_url = rsp.output.video_url
-            visual_extend_prompt = rsp.output.actual_prompt
-            video_path = rf"{VID_DIR}/{id}.mp4"
-            with open(video_path, 'wb') as f:
-                f.write(requests.get(video_url).content)
-            return video_path, visual_extend_prompt
-        else:
-            print('Failed, status_code: %s, code: %s, message: %s' %
-                (rsp.status_code, rsp.code, rsp.message))
-        
-        filename = f"vid_{int(time.time())}_{random.randint(0,100)}.mp4"
-        return self._create_mock_video(filename, duration=3)
+        print(f"[MediaService] Video {id} ready: {rsp.output.video_url}")
+        video_url = rsp.output.video_url
+        visual_extend_prompt = rsp.output.actual_prompt
+        self._download(video_url, video_path)
+        self._cache_store(cache_key, video_path, {"actual_prompt": visual_extend_prompt})
+        self._publish(video_path, VIDEO, {"shot_id": id, "cache_key": cache_key})
+        return video_path, visual_extend_prompt
 
 
     def text_to_speech(self, id: int, text: str, emotion: str) -> tuple[str, float]:
-        """TTS 生成，返回路径和时长"""
+        """TTS 生成，返回路径和时长 (从生成的音频文件头解析出的实际时长)"""
+        audio_path = self._audio_path(id)
+        cache_key = self._speech_key(text)
+        cached = self._tts_cached(id, audio_path, cache_key)
+        if cached is not None:
+            return cached
+
         print(f"[MediaService] TTS Generating: {text[:20]}... ({emotion})")
-        time.sleep(0.5)
-        
-        filename = f"audio_{int(time.time())}_{random.randint(0,100)}.mp3"
-        # 估算时长：假设英文单词平均 0.3秒
-        duration = max(1.5, len(text.split()) * 0.4)    # Qwen系列模型用不上(emotion和duration参数)
-        
-        dashscope.api_key = self.audio_api_key
-        synthesizer = SpeechSynthesizer(model=self.audio_model_name, voice=self.audio_voice)
-        audio = synthesizer(text)
-        audio_path = rf"{IMG_DIR}/{id}.mp3"
-        
-        with open(audio_path, 'wb') as f:
+        call_provider("tts", self.audio_model_name, self._synthesize_speech, id, text, audio_path)
+        return self._tts_finalize(id, audio_path, cache_key)
+
+    def _tts_cached(self, id: int, audio_path: str, cache_key: str) -> Optional[tuple[str, float]]:
+        cached = self._cache_lookup(cache_key, audio_path)
+        if cached is None:
+            return None
+        # 早期缓存条目里记录的是估算时长, 这里始终以文件实际时长为准
+        duration = audio_duration(audio_path)
+        self._publish(audio_path, AUDIO, {"shot_id": id, "cache_key": cache_key, "duration": duration})
+        return audio_path, duration
+
+    def _synthesize_speech(self, id: int, text: str, audio_path: str):
+        """一次合成请求 (不经过配额治理, 由调用方在 tts 配额内调用)"""
+        if TTS_STREAMING:
+            # 流式: 复用对象池中已建立的连接, 音频分片边收边写盘
+            writer = synthesize_to_file(text, audio_path, model=self.audio_model_name, voice=self.audio_voice,
+                                        api_key=self.audio_api_key)
+            print(f"[MediaService] TTS {id}: first byte {writer.ttfb * 1000:.0f}ms, "
+                  f"total {writer.total_time:.2f}s, {writer.bytes_written} bytes")
+            return writer
+
+        audio = self._synthesize_blocking(text)
+        with atomic_write(audio_path) as f:
             f.write(audio)
-        
+        return audio
+
+    def _tts_finalize(self, id: int, audio_path: str, cache_key: str) -> tuple[str, float]:
+        if TTS_TRIM_SILENCE:
+            trim_silence(audio_path, threshold_db=TTS_SILENCE_DB)
+        duration = audio_duration(audio_path)
+
+        self._cache_store(cache_key, audio_path, {"duration": duration})
+        self._publish(audio_path, AUDIO, {"shot_id": id, "cache_key": cache_key, "duration": duration})
         return audio_path, duration
 
+    def _synthesize_blocking(self, text: str) -> bytes:
+        """非流式合成; SDK 失败时返回 None, 这里转成异常交给重试层"""
+        dashscope.api_key = self.audio_api_key
+        # SpeechSynthesizer 每次 call 都需要新实例
+        synthesizer = SpeechSynthesizer(model=self.audio_model_name, voice=self.audio_voice)
+        audio = synthesizer.call(text)
+        if not audio:
+            raise TTSError(f"TTS 合成失败: no audio received (request_id={synthesizer.get_last_request_id()})")
+        return audio
+
+
+
+    # --- Async I/O ---
+    # 以下 a* 方法与同步版本一一对应, 供 async 节点在同一个事件循环上并发调用。
+    # DashScope 的生图/生视频走 "提交任务 + 轮询" 接口, 等待期间只占用 asyncio.sleep, 不占线程。
+
+    async def agenerate_reference_image(self, prompt: str) -> str:
+        """生成锚点图 (Anchor Image) - 异步版本"""
+        cache_key = self._reference_image_key(prompt)
+        cached_path = self._artifact_path(IMAGE, f"anchor_{cache_key[:16]}.png")
+        if await asyncio.to_thread(self._cache_lookup, cache_key, cached_path) is not None:
+            await asyncio.to_thread(self._publish, cached_path, IMAGE, {"kind": "anchor", "cache_key": cache_key})
+            return cached_path
+
+        dashscope.base_http_api_url = os.getenv("IMAGE_API_BASE")
+
+        async def submit_and_poll():
+            task = await asyncio.to_thread(
+                ImageSynthesis.async_call,
+                api_key=self.img_api_key,
+                model=self.img_model_name,
+                prompt=prompt,
+                n=1,
+                size='1328*1328',
+                prompt_extend=True,
+                watermark=True,
+            )
+            return await self._apoll_task(ImageSynthesis, task, self.img_api_key)
+
+        # 并发槽位覆盖提交到任务结束的整个过程 (对应 DashScope 的 "同时处理中任务数" 限制);
+        # 提交失败或任务 FAILED 时按错误类型重试, 最终失败抛 ProviderError
+        response = await acall_provider("image", self.img_model_name, submit_and_poll, priority=PRIORITY_HIGH)
+
+        save_path = None
+        for result in response.output.results:
+            file_name = PurePosixPath(unquote(urlparse(result.url).path)).parts[-1]
+            save_path = self._artifact_path(IMAGE, file_name)
+            await self._adownload(result.url, save_path)
+        if save_path is not None:
+            await asyncio.to_thread(self._cache_store, cache_key, save_path)
+            await asyncio.to_thread(self._publish, save_path, IMAGE, {"kind": "anchor", "cache_key": cache_key})
+
+        return save_path
+
+
+    async def agenerate_image_with_control(self, id: str, prompt: str, anchor_img_path: str) -> str:
+        """生成分镜图片 (带一致性控制) - 异步版本"""
+        filename = f"board_img_{id}.png"
+        board_img_path = self._artifact_path(STORYBOARD, filename)
+        cache_key = await asyncio.to_thread(self._control_image_key, prompt, anchor_img_path)
+        return await self._single_flight(
+            ("control_image", cache_key, board_img_path),
+            lambda: self._agenerate_control_image(id, prompt, anchor_img_path, cache_key, board_img_path),
+        )
+
+    async def _agenerate_control_image(self, id: str, prompt: str, anchor_img_path: str, cache_key: str, board_img_path: str) -> str:
+        meta = {"shot_id": id, "cache_key": cache_key}
+        if await asyncio.to_thread(self._cache_lookup, cache_key, board_img_path) is not None:
+            await asyncio.to_thread(self._publish, board_img_path, STORYBOARD, meta)
+            return board_img_path
+
+        print(f"[MediaService] Generating Image: {prompt[:30]}... (Ref: {anchor_img_path})")
+        async with get_governor().aslot("image", self.img_model_name):
+            await asyncio.sleep(1)
+
+        self._require_output(board_img_path, id)
+        await asyncio.to_thread(self._cache_store, cache_key, board_img_path)
+        await asyncio.to_thread(self._publish, board_img_path, STORYBOARD, meta)
+        return board_img_path
+
+
+    async def aimage_to_video(self, id: str, image_path: str, motion_strength: float = 0.5) -> tuple[str, str]:
+        """图生视频 (I2V) - 异步版本
+        通过 I2VJobManager 提交任务后立即返回, 由共享的轮询器统一 fetch 状态;
+        job_key 由镜头 id 和图片内容决定, 进程重启后同一张图会复用已提交的任务。
+        """
+        video_path = self._artifact_path(VIDEO, f"{id}.mp4")
+        cache_key = await asyncio.to_thread(self._video_key, image_path, motion_strength)
+        cached = await asyncio.to_thread(self._cache_lookup, cache_key, video_path)
+        if cached is not None:
+            await asyncio.to_thread(self._publish, video_path, VIDEO, {"shot_id": id, "cache_key": cache_key})
+            return video_path, cached.get("actual_prompt")
+
+        print(f"[MediaService] Submitting Video job for {image_path}...")
+
+        job_key = f"{id}-{(await asyncio.to_thread(file_sha256, image_path))[:16]}"
+        image_base = await asyncio.to_thread(encode_image, image_path)
+        job_manager = get_i2v_job_manager()
+        call_kwargs = dict(
+            api_key=VIDEO_API_KEY,
+            model=VIDEO_MODEL,
+            prompt=video_gen_prompt,
+            img_url=image_base,
+            duration=10,
+            audio=True, # 自动配音
+            extend_prompt=True,
+            negative_prompt=video_gen_bad_prompt,
+        )
+        # 任务失败后重试会重新提交 (I2VJobManager 不复用 FAILED 的任务)
+        result = await acall_provider("video", VIDEO_MODEL, job_manager.run, job_key, **call_kwargs)
+
+        print(f"[MediaService] Video {id} ready: {result['video_url']}")
+        try:
+            await self._adownload(result["video_url"], video_path)
+        except Exception as e:
+            # 复用的历史任务 video_url 可能已经过期: 作废记录, 重新提交一次
+            print(f"[MediaService] Download of job {job_key} failed ({e}), resubmitting...")
+            job_manager.invalidate(job_key)
+            result = await acall_provider("video", VIDEO_MODEL, job_manager.run, job_key, **call_kwargs)
+            print(f"[MediaService] Video {id} ready: {result['video_url']}")
+            await self._adownload(result["video_url"], video_path)
+        await asyncio.to_thread(self._cache_store, cache_key, video_path, {"actual_prompt": result["actual_prompt"]})
+        await asyncio.to_thread(self._publish, video_path, VIDEO, {"shot_id": id, "cache_key": cache_key, "job_key": job_key})
+        return video_path, result["actual_prompt"]
+
+
+    async def atext_to_speech(self, id: int, text: str, emotion: str) -> tuple[str, float]:
+        """TTS 生成 - 异步版本
+        tts 配额在事件循环上等待 (governor.aslot), 拿到配额后才把阻塞的合成请求放到线程池;
+        排队中的镜头不占用默认线程池的线程, 不会饿死同样依赖 to_thread 的缓存/下载/发布操作
+        """
+        audio_path = self._audio_path(id)
+        cache_key = self._speech_key(text)
+
+        async def generate():
+            cached = await asyncio.to_thread(self._tts_cached, id, audio_path, cache_key)
+            if cached is not None:
+                return cached
+
+            print(f"[MediaService] TTS Generating: {text[:20]}... ({emotion})")
+
+            async def synthesize(text: str):
+                return await asyncio.to_thread(self._synthesize_speech, id, text, audio_path)
+
+            await acall_provider("tts", self.audio_model_name, synthesize, text)
+            return await asyncio.to_thread(self._tts_finalize, id, audio_path, cache_key)
+
+        return await self._single_flight(("tts", cache_key, str(audio_path)), generate)
+
+    @staticmethod
+    async def _single_flight(key: Tuple[str, str, str], factory: Callable[[], Awaitable]):
+        """同一个 key 只执行一次 factory(); 调用方被取消不会取消共享的任务"""
+        loop = asyncio.get_running_loop()
+        task = _inflight.get(key)
+        # 换了事件循环 (例如批量任务多次 asyncio.run) 时, 上一个循环里未结束的任务不能再 await
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = loop.create_task(factory())
+            _inflight[key] = task
+            task.add_done_callback(partial(_forget, key))
+        return await asyncio.shield(task)
+
+
+    async def _apoll_task(self, api_cls, task, api_key: str):
+        """轮询 DashScope 异步任务直到结束, 返回最终的 response"""
+        if task.status_code != HTTPStatus.OK:
+            return task
+        while True:
+            rsp = await asyncio.to_thread(api_cls.fetch, task, api_key=api_key)
+            if rsp.status_code != HTTPStatus.OK:
+                return rsp
+            if rsp.output.task_status in ("SUCCEEDED", "FAILED", "CANCELED", "UNKNOWN"):
+                return rsp
+            await asyncio.sleep(TASK_POLL_INTERVAL)
+
+
+    # --- 运行产物 ---
+
+    @staticmethod
+    def _artifact_path(category: str, name: str) -> str:
+        """本次运行 (当前上下文的 run_id) 的产物路径"""
+        return get_artifact_store().path(category, name)
+
+    @staticmethod
+    def _audio_path(id: int) -> str:
+        return MediaGenService._artifact_path(AUDIO, f"{id}.mp3")
+
+    @staticmethod
+    def _publish(path: str, category: str, meta: dict = None):
+        """产物写完 (或从缓存取出) 后登记到本次运行的 manifest; 登记失败不影响生成流程"""
+        try:
+            get_artifact_store().record(path, category, meta)
+        except Exception as e:
+            print(f"[MediaService] Artifact record failed for {path}: {e}")
+
+    # --- 内容寻址缓存 ---
+    # key 只包含影响生成结果的输入 (模型、prompt、参考图内容、音色、参数), 不包含镜头 id 和输出路径,
+    # 因此改一个镜头的 prompt 只会让这一个镜头重新生成。
+
+    def _reference_image_key(self, prompt: str) -> str:
+        return MediaCache.make_key("reference_image", model=self.img_model_name, prompt=prompt,
+                                   size='1328*1328', prompt_extend=True, watermark=True)
+
+    def _control_image_key(self, prompt: str, anchor_img_path: str) -> str:
+        return MediaCache.make_key("control_image", ref_files=[anchor_img_path],
+                                   model=self.img_model_name, prompt=prompt, size=STORYBOARD_IMAGE_SIZE)
+
+    @staticmethod
+    def _require_output(path: str, id) -> None:
+        # 分镜生图接口尚未接入 (目前只占用配额并等待), 没有产出文件时不能当作成功写入缓存/manifest
+        if not os.path.exists(path):
+            raise MediaGenerationError(f"Shot {id}: 生图没有产出文件 {path}")
+
+    def _video_key(self, image_path: str, motion_strength: float) -> str:
+        return MediaCache.make_key("image_to_video", ref_files=[image_path], model=VIDEO_MODEL,
+                                   prompt=video_gen_prompt, negative_prompt=video_gen_bad_prompt,
+                                   duration=10, audio=True, extend_prompt=True, motion_strength=motion_strength)
+
+    def _speech_key(self, text: str) -> str:
+        # emotion 目前不会传给 Qwen 系列 TTS 模型, 不参与 key
+        return MediaCache.make_key("text_to_speech", model=self.audio_model_name, voice=self.audio_voice, text=text,
+                                   trim_silence=TTS_SILENCE_DB if TTS_TRIM_SILENCE else None)
+
+    @staticmethod
+    def _cache_lookup(cache_key: str, dest_path: str):
+        cache = get_media_cache()
+        return cache.get(cache_key, dest_path) if cache else None
+
+    @staticmethod
+    def _cache_store(cache_key: str, src_path: str, meta: dict = None):
+        cache = get_media_cache()
+        if cache:
+            cache.put(cache_key, src_path, meta)
+
+
+    def _download(self, url: str, save_path: str) -> str:
+        """下载生成结果到本地 (共享连接池, 流式写盘)"""
+        return get_download_manager().download(url, save_path)
+
 
+    async def _adownload(self, url: str, save_path: str) -> str:
+        return await get_download_manager().adownload(url, save_path)
 
     # --- Helper Methods for Mocking ---
     
@@ -0,0 +1,119 @@
+# VLM 校验前的本地预筛 (纯 CPU): 明显不合格的图片直接打回, 不花一次 VLM 调用
+import os
+from functools import lru_cache
+from typing import Dict, Any, Iterable, Optional
+
+# 阈值均可通过环境变量调整
+PREFILTER_ENABLED = os.getenv("PREFILTER", "1") != "0"
+PREFILTER_MIN_SIZE = int(os.getenv("PREFILTER_MIN_SIZE", "256"))             # 短边最小像素
+PREFILTER_MIN_STDDEV = float(os.getenv("PREFILTER_MIN_STDDEV", "6"))         # 亮度标准差低于此值视为纯色/空白
+PREFILTER_DARK = float(os.getenv("PREFILTER_DARK", "12"))                    # 平均亮度低于此值视为欠曝
+PREFILTER_BRIGHT = float(os.getenv("PREFILTER_BRIGHT", "243"))               # 平均亮度高于此值视为过曝
+PREFILTER_MIN_SHARPNESS = float(os.getenv("PREFILTER_MIN_SHARPNESS", "15"))  # 拉普拉斯方差低于此值视为模糊
+PREFILTER_DUP_DISTANCE = int(os.getenv("PREFILTER_DUP_DISTANCE", "4"))       # 与之前尝试的 dHash 距离 <= 此值视为重复
+PREFILTER_ANCHOR_DISTANCE = int(os.getenv("PREFILTER_ANCHOR_DISTANCE", "44"))  # 与锚点图的 dHash 距离 > 此值视为偏离 (64 位)
+
+# 分析前统一缩小到这个尺寸, 控制 CPU 开销
+_ANALYSIS_EDGE = 512
+
+
+def dhash(image, hash_size: int = 8) -> int:
+    """差值感知哈希 (dHash), 返回 hash_size*hash_size 位整数"""
+    small = image.convert("L").resize((hash_size + 1, hash_size))
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@lru_cache(maxsize=32)
+def _anchor_hash(anchor_path: str, mtime: float) -> Optional[int]:
+    from PIL import Image
+    try:
+        with Image.open(anchor_path) as img:
+            return dhash(img)
+    except Exception:
+        return None
+
+
+class ImagePreFilter:
+    """
+    check() 依次做:
+    1. 解码检查: 文件存在、能完整解码、尺寸不过小
+    2. 曝光/空白: 平均亮度、亮度标准差
+    3. 模糊: 拉普拉斯算子响应的方差
+    4. 感知哈希: 与本镜头之前尝试的图片几乎相同 -> 重复; 与锚点图差异过大 -> 偏离
+    通过的图片才交给 VLM; 节省的 VLM 调用次数由 visual_node 按镜头累计到 state["vlm_calls_saved"]。
+    """
+    def check(self, image_path: str, anchor_path: Optional[str] = None,
+              previous_hashes: Iterable[int] = ()) -> Dict[str, Any]:
+        """返回 {"passed": bool, "reason": [...], "hash": int | None, "unreadable": bool}
+        unreadable 为 True 表示文件不存在或无法解码: 这是生图本身失败, 不属于预筛拦下的图片
+        """
+        result = self._check(image_path, anchor_path, previous_hashes)
+        if result["unreadable"]:
+            print(f"[PreFilter] {os.path.basename(image_path)} is missing or unreadable: {result['reason']}")
+        elif not result["passed"]:
+            print(f"[PreFilter] Rejected {os.path.basename(image_path)} locally: {result['reason']}")
+        return result
+
+    def _check(self, image_path: str, anchor_path: Optional[str], previous_hashes: Iterable[int]) -> Dict[str, Any]:
+        from PIL import Image, ImageFilter, ImageStat
+
+        # 1. 解码检查 (预筛关闭时也做: 不存在/损坏的文件不能交给 VLM)
+        if not os.path.exists(image_path):
+            return {"passed": False, "reason": ["图片文件不存在"], "hash": None, "unreadable": True}
+        if not PREFILTER_ENABLED:
+            return {"passed": True, "reason": [], "hash": None, "unreadable": False}
+        try:
+            with Image.open(image_path) as img:
+                img.verify()
+            with Image.open(image_path) as img:
+                img.load()
+                width, height = img.size
+                img.thumbnail((_ANALYSIS_EDGE, _ANALYSIS_EDGE))
+                gray = img.convert("L")
+                image_hash = dhash(img)
+        except Exception as e:
+            return {"passed": False, "reason": [f"图片无法解码: {e}"], "hash": None, "unreadable": True}
+
+        reasons = []
+        if min(width, height) < PREFILTER_MIN_SIZE:
+            reasons.append(f"分辨率过低 ({width}x{height})")
+
+        # 2. 曝光 / 空白
+        stat = ImageStat.Stat(gray)
+        mean, stddev = stat.mean[0], stat.stddev[0]
+        if stddev < PREFILTER_MIN_STDDEV:
+            reasons.append("画面几乎是纯色/空白")
+        elif mean < PREFILTER_DARK:
+            reasons.append("画面严重欠曝")
+        elif mean > PREFILTER_BRIGHT:
+            reasons.append("画面严重过曝")
+
+        # 3. 模糊 (拉普拉斯方差); 纯色图已经在上一步拒绝, 不重复报告
+        if stddev >= PREFILTER_MIN_STDDEV:
+            laplacian = gray.filter(ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128))
+            sharpness = ImageStat.Stat(laplacian).var[0]
+            if sharpness < PREFILTER_MIN_SHARPNESS:
+                reasons.append(f"画面模糊 (sharpness={sharpness:.1f})")
+
+        # 4. 感知哈希
+        for previous in previous_hashes:
+            if hamming(image_hash, previous) <= PREFILTER_DUP_DISTANCE:
+                reasons.append("与上一次尝试的图片几乎相同")
+                break
+        if anchor_path and os.path.exists(anchor_path):
+            anchor_hash = _anchor_hash(anchor_path, os.path.getmtime(anchor_path))
+            if anchor_hash is not None and hamming(image_hash, anchor_hash) > PREFILTER_ANCHOR_DISTANCE:
+                reasons.append("画面与锚点图差异过大")
+
+        return {"passed": not reasons, "reason": reasons, "hash": image_hash, "unreadable": False}
@@ -0,0 +1,362 @@
+# Provider 配额治理: 按 (类型, 模型) 维护令牌桶 (QPS) + 并发槽位, 超出配额的调用排队等待而不是直接打出去吃 429
+import os
+import re
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# 调用类型: image (生图), video (图生视频), tts, chat (文本 LLM), vlm (视觉校验)
+# 每个类型的默认配额, 可以用 RATE_LIMIT_<KIND>_QPS / _CONCURRENCY / _BURST 覆盖,
+# 某个模型单独的配额用 RATE_LIMIT_<KIND>_<MODEL>_QPS 等覆盖 (模型名大写, 非字母数字替换为 _)
+# QPS 或 CONCURRENCY 为 0 表示不限制
+DEFAULT_LIMITS = {
+    "image": {"qps": 2, "concurrency": 4},
+    "video": {"qps": 2, "concurrency": 4},
+    "tts": {"qps": 10, "concurrency": 8},
+    "chat": {"qps": 5, "concurrency": 8},
+    "vlm": {"qps": 5, "concurrency": 8},
+}
+
+# 被限流 (429 / Throttling) 后的冷却时间(秒), 连续限流时翻倍, 最长 RATE_LIMIT_MAX_COOLDOWN
+RATE_LIMIT_COOLDOWN = float(os.getenv("RATE_LIMIT_COOLDOWN", "2"))
+RATE_LIMIT_MAX_COOLDOWN = float(os.getenv("RATE_LIMIT_MAX_COOLDOWN", "60"))
+# 单次调用因限流重新排队的最大次数, 超过后把最后一次的结果/异常交给调用方
+RATE_LIMIT_MAX_THROTTLES = int(os.getenv("RATE_LIMIT_MAX_THROTTLES", "6"))
+
+# 优先级: 数值越小越先拿到配额; 锚点图和分镜脚本阻塞整条流水线, 重试请求让位给首次请求
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+_request_priority: contextvars.ContextVar[int] = contextvars.ContextVar("request_priority", default=PRIORITY_NORMAL)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """在当前上下文 (及其派生的 task / to_thread) 中发起的受控调用都使用 priority"""
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def is_throttled(outcome: Any) -> bool:
+    """DashScope 响应或 SDK/OpenAI 异常是否表示被限流"""
+    if getattr(outcome, "status_code", None) == HTTPStatus.TOO_MANY_REQUESTS:
+        return True
+    code = getattr(outcome, "code", None)
+    if isinstance(code, str) and code.startswith("Throttling"):
+        return True
+    return isinstance(outcome, Exception) and "Throttling" in str(outcome)
+
+
+def _retry_after(outcome: Any) -> Optional[float]:
+    headers = getattr(getattr(outcome, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _env_number(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else None
+
+
+def _limit_config(kind: str, model: Optional[str]) -> Dict[str, float]:
+    config = dict(DEFAULT_LIMITS.get(kind, {"qps": 0, "concurrency": 0}))
+    prefixes = [f"RATE_LIMIT_{kind.upper()}"]
+    if model:
+        prefixes.append(f"{prefixes[0]}_{re.sub(r'[^0-9A-Za-z]', '_', model).upper()}")
+    for prefix in prefixes:
+        for field in ("qps", "concurrency", "burst"):
+            value = _env_number(f"{prefix}_{field.upper()}")
+            if value is not None:
+                config[field] = value
+    return config
+
+
+def concurrency_limit(kind: str, model: Optional[str] = None) -> int:
+    """某个类型 (及模型) 生效的并发上限, 0 表示不限制; 供需要与配额保持一致的 worker 池使用"""
+    return int(_limit_config(kind, model)["concurrency"])
+
+
+class _Waiter:
+    """排队中的一次 acquire; 同步调用方用 threading.Event 等待, 异步调用方用事件循环上的 Future 等待"""
+    __slots__ = ("priority", "seq", "enqueued_at", "granted", "cancelled", "_event", "_loop", "_future")
+
+    def __init__(self, priority: int, seq: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+        self._loop = loop
+        self._event = None if loop else threading.Event()
+        self._future = loop.create_future() if loop else None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def grant(self) -> bool:
+        if self._event is not None:
+            self._event.set()
+            return True
+        try:
+            self._loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:    # 事件循环已关闭, 没有人在等了
+            return False
+        return True
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+
+class ProviderLimiter:
+    """
+    单个 (类型, 模型) 的配额: 令牌桶限制请求速率, 并发槽位限制同时在途的请求/任务数。
+    等待者按 (优先级, 到达顺序) 排队, 队首拿不到配额时后面的也不会插队。
+    同步 (线程) 和异步 (事件循环) 调用方共用同一份配额。
+    """
+    def __init__(self, key: str, qps: float = 0, concurrency: int = 0, burst: Optional[float] = None):
+        self.key = key
+        self.qps = max(0.0, qps)
+        self.concurrency = max(0, int(concurrency))
+        self.burst = max(1.0, burst or self.qps)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._cooldown = RATE_LIMIT_COOLDOWN
+        self._in_flight = 0
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        # 统计
+        self.granted = 0
+        self.throttled = 0
+        self.peak_in_flight = 0
+        self.max_waiting = 0
+        self._wait_time = 0.0
+
+    # ---------- 调度 ----------
+
+    def _dispatch_locked(self) -> Optional[float]:
+        """把空闲的并发槽位和令牌按优先级分给等待者; 返回需要多久之后再检查一次 (None 表示等 release 即可)"""
+        now = time.monotonic()
+        if self.qps:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.qps)
+        self._updated = now
+
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.cancelled:
+                heapq.heappop(self._waiters)
+                continue
+            if self.concurrency and self._in_flight >= self.concurrency:
+                return None
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.qps and self._tokens < 1:
+                return (1 - self._tokens) / self.qps
+
+            heapq.heappop(self._waiters)
+            if not waiter.grant():
+                continue
+            waiter.granted = True
+            if self.qps:
+                self._tokens -= 1
+            self._in_flight += 1
+            self.granted += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            self._wait_time += now - waiter.enqueued_at
+        return None
+
+    def _schedule_locked(self, delay: Optional[float]):
+        if delay is None or self._timer is not None:
+            return
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._schedule_locked(self._dispatch_locked())
+
+    def _enqueue(self, waiter: _Waiter):
+        with self._lock:
+            heapq.heappush(self._waiters, waiter)
+            self.max_waiting = max(self.max_waiting, len(self._waiters))
+            self._schedule_locked(self._dispatch_locked())
+
+    # ---------- 对外接口 ----------
+
+    def acquire(self, priority: int = PRIORITY_NORMAL):
+        """阻塞当前线程直到拿到配额"""
+        waiter = _Waiter(priority, next(self._seq))
+        self._enqueue(waiter)
+        waiter._event.wait()
+
+    async def aacquire(self, priority: int = PRIORITY_NORMAL):
+        """在事件循环上等待配额, 不占用线程"""
+        waiter = _Waiter(priority, next(self._seq), loop=asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            await waiter._future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                waiter.cancelled = not granted
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._schedule_locked(self._dispatch_locked())
+
+    def penalize(self, retry_after: Optional[float] = None) -> float:
+        """被服务端限流: 暂停发放令牌一段时间 (优先使用服务端给出的 Retry-After), 返回暂停时长"""
+        with self._lock:
+            delay = retry_after if retry_after is not None else self._cooldown
+            self._cooldown = min(self._cooldown * 2, RATE_LIMIT_MAX_COOLDOWN)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._tokens = min(self._tokens, 0.0)
+            self.throttled += 1
+            return delay
+
+    def recover(self):
+        """请求成功后重置冷却时间"""
+        self._cooldown = RATE_LIMIT_COOLDOWN
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "qps": self.qps,
+            "concurrency": self.concurrency,
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "in_flight": self._in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waiting": len(self._waiters),
+            "max_waiting": self.max_waiting,
+            "avg_wait": self._wait_time / self.granted if self.granted else 0.0,
+        }
+
+
+class ProviderGovernor:
+    """
+    进程内唯一的配额中心, MediaGenService / LLMService 的所有外部调用都经过这里:
+        response = get_governor().call("image", model, ImageSynthesis.call, api_key=..., ...)
+        result = await get_governor().acall("chat", model, chain.ainvoke, inputs, priority=PRIORITY_HIGH)
+    call/acall 在拿到配额后执行 fn, 返回结果或抛出的异常被判定为限流时, 暂停该配额并重新排队,
+    不会把 429 交给上层的重试循环。需要自行控制调用过程时用 slot/aslot。
+    """
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, Optional[str]], ProviderLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, kind: str, model: Optional[str] = None) -> ProviderLimiter:
+        key = (kind, model)
+        with self._lock:
+            if key not in self._limiters:
+                config = _limit_config(kind, model)
+                self._limiters[key] = ProviderLimiter(
+                    f"{kind}:{model}" if model else kind,
+                    qps=config.get("qps", 0),
+                    concurrency=int(config.get("concurrency", 0)),
+                    burst=config.get("burst"),
+                )
+            return self._limiters[key]
+
+    @contextmanager
+    def slot(self, kind: str, model: Optional[str] = None, priority: Optional[int] = None):
+        limiter = self.limiter(kind, model)
+        limiter.acquire(_request_priority.get() if priority is None else priority)
+        try:
+            yield limiter
+        finally:
+            limiter.release()
+
+    @asynccontextmanager
+    async def aslot(self, kind: str, model: Optional[str] = None, priority: Optional[int] = None):
+        limiter = self.limiter(kind, model)
+        await limiter.aacquire(_request_priority.get() if priority is None else priority)
+        try:
+            yield limiter
+        finally:
+            limiter.release()
+
+    def call(self, kind: str, model: Optional[str], fn: Callable[..., Any], /, *args,
+             priority: Optional[int] = None, **kwargs) -> Any:
+        for throttles in itertools.count():
+            with self.slot(kind, model, priority) as limiter:
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    if not self._should_requeue(limiter, e, throttles):
+                        raise
+                    continue
+            if not self._should_requeue(limiter, result, throttles):
+                return result
+
+    async def acall(self, kind: str, model: Optional[str], fn: Callable[..., Any], /, *args,
+                    priority: Optional[int] = None, **kwargs) -> Any:
+        for throttles in itertools.count():
+            async with self.aslot(kind, model, priority) as limiter:
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    if not self._should_requeue(limiter, e, throttles):
+                        raise
+                    continue
+            if not self._should_requeue(limiter, result, throttles):
+                return result
+
+    @staticmethod
+    def _should_requeue(limiter: ProviderLimiter, outcome: Any, throttles: int) -> bool:
+        if not is_throttled(outcome):
+            limiter.recover()
+            return False
+        if throttles >= RATE_LIMIT_MAX_THROTTLES:
+            print(f"[RateLimit] {limiter.key} 连续被限流 {throttles + 1} 次, 放弃排队")
+            return False
+        delay = limiter.penalize(_retry_after(outcome))
+        print(f"[RateLimit] {limiter.key} 被限流, 暂停 {delay:.1f}s 后重新排队")
+        return True
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {limiter.key: limiter.stats() for limiter in limiters}
+
+    def report(self) -> str:
+        lines = []
+        for key, s in self.stats().items():
+            lines.append(f"[RateLimit] {key} granted={s['granted']} throttled={s['throttled']} "
+                         f"peak_in_flight={s['peak_in_flight']}/{s['concurrency'] or '-'} "
+                         f"max_waiting={s['max_waiting']} avg_wait={s['avg_wait']:.1f}s")
+        return "\n".join(lines)
+
+
+_governor: Optional[ProviderGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> ProviderGovernor:
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = ProviderGovernor()
+        return _governor
@@ -0,0 +1,88 @@
+# 服务注册表: 各节点共享同一份服务实例, 第一次使用时才构造;
+# 重依赖 (langchain / dashscope / moviepy / PIL) 随服务模块一起延迟导入, import 节点模块和 build_app() 不产生任何副作用
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict
+
+if TYPE_CHECKING:
+    from src.services.llm_service import LLMService
+    from src.services.media_service import MediaGenService
+    from src.services.editor_service import VideoEditorService
+    from src.services.vlm_batcher import VLMBatcher
+    from src.services.prefilter_service import ImagePreFilter
+
+_factories: Dict[str, Callable[[], Any]] = {}
+_instances: Dict[str, Any] = {}
+# 构造 vlm_batcher 时会递归获取 llm, 需要可重入锁
+_lock = threading.RLock()
+
+
+def register(name: str, factory: Callable[[], Any]):
+    """注册 (或替换) 一个服务的构造函数; 已构造的旧实例会被丢弃"""
+    with _lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+
+
+def get_service(name: str) -> Any:
+    with _lock:
+        if name not in _instances:
+            _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+def reset_services():
+    """丢弃所有已构造的实例 (例如 worker 进程 fork 之后), 下次使用时重新构造"""
+    with _lock:
+        _instances.clear()
+
+
+def _llm_service():
+    from src.services.llm_service import LLMService
+    return LLMService()
+
+
+def _media_service():
+    from src.services.media_service import MediaGenService
+    return MediaGenService()
+
+
+def _editor_service():
+    from src.services.editor_service import VideoEditorService
+    return VideoEditorService()
+
+
+def _vlm_batcher():
+    from src.services.vlm_batcher import VLMBatcher
+    return VLMBatcher(get_llm_service())
+
+
+def _prefilter():
+    from src.services.prefilter_service import ImagePreFilter
+    return ImagePreFilter()
+
+
+register("llm", _llm_service)           # 文本 LLM 与 VLM 共用一个 chat 客户端
+register("media", _media_service)
+register("editor", _editor_service)
+register("vlm_batcher", _vlm_batcher)   # 各镜头第一次生图的校验请求合并成批量请求
+register("prefilter", _prefilter)       # VLM 校验前的本地预筛
+
+
+def get_llm_service() -> "LLMService":
+    return get_service("llm")
+
+
+def get_media_service() -> "MediaGenService":
+    return get_service("media")
+
+
+def get_editor_service() -> "VideoEditorService":
+    return get_service("editor")
+
+
+def get_vlm_batcher() -> "VLMBatcher":
+    return get_service("vlm_batcher")
+
+
+def get_prefilter() -> "ImagePreFilter":
+    return get_service("prefilter")
@@ -0,0 +1,216 @@
+# Provider 调用的重试层: 区分临时错误 (超时/限流/5xx) 与永久错误 (内容审核/参数错误), 临时错误按抖动指数退避重试
+import os
+import time
+import random
+import asyncio
+from http import HTTPStatus
+from typing import Any, Callable, Optional
+
+import requests
+
+from src.services.rate_limiter import get_governor, is_throttled
+from src.services.tracing import span, payload_size
+
+# 单次调用的最大尝试次数, 退避基数/上限(秒), 以及整个重试过程的截止时间(秒, 从第一次排队开始计算)
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+RETRY_DEADLINE = float(os.getenv("RETRY_DEADLINE", "1800"))
+
+# 单次尝试的超时(秒), 只对异步调用生效 (拿到配额之后开始计时, 排队时间不算);
+# image / video 包含提交任务到轮询结束的整个过程。可用 RETRY_TIMEOUT_<KIND> 覆盖, 0 表示不限
+DEFAULT_TIMEOUTS = {"image": 300, "video": 900, "tts": 120, "chat": 180, "vlm": 120}
+
+# 错误分类
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# DashScope 返回码中属于请求本身问题的部分, 重试不会改变结果
+PERMANENT_CODES = (
+    "DataInspectionFailed", "IPInfringementSuspect", "InvalidParameter", "InvalidApiKey",
+    "InvalidURL", "InvalidFile", "AccessDenied", "Arrearage", "BadRequest", "ModelNotFound",
+)
+
+# 按类名识别 openai / httpx 的网络类异常, 避免在这里引入它们的依赖
+TRANSIENT_EXCEPTION_NAMES = {
+    "APIConnectionError", "APITimeoutError", "InternalServerError",
+    "TransportError", "TimeoutException", "RemoteProtocolError",
+}
+
+
+class ProviderError(RuntimeError):
+    """Provider 调用最终失败; category 为 TRANSIENT (重试耗尽/超过截止时间) 或 PERMANENT (不可重试)"""
+    def __init__(self, kind: str, model: Optional[str], category: str, message: str,
+                 status_code: Optional[int] = None, code: Optional[str] = None,
+                 attempts: int = 1, elapsed: float = 0.0):
+        super().__init__(f"{kind}:{model} {category} failure after {attempts} attempt(s) ({elapsed:.1f}s): "
+                         f"status_code={status_code}, code={code}, message={message}")
+        self.kind = kind
+        self.model = model
+        self.category = category
+        self.status_code = status_code
+        self.code = code
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    @property
+    def transient(self) -> bool:
+        return self.category == TRANSIENT
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind, "model": self.model, "category": self.category,
+            "status_code": self.status_code, "code": self.code,
+            "attempts": self.attempts, "elapsed": round(self.elapsed, 2),
+        }
+
+
+def _classify_status(status_code: Optional[int], code: Optional[str]) -> str:
+    if code and any(code.startswith(prefix) for prefix in PERMANENT_CODES):
+        return PERMANENT
+    if status_code is None:
+        return TRANSIENT
+    if status_code in (HTTPStatus.REQUEST_TIMEOUT, HTTPStatus.CONFLICT, HTTPStatus.TOO_MANY_REQUESTS) or status_code >= 500:
+        return TRANSIENT
+    return PERMANENT
+
+
+def classify(outcome: Any) -> Optional[str]:
+    """
+    对调用结果分类: 成功返回 None, 否则返回 TRANSIENT / PERMANENT。
+    outcome 可以是抛出的异常, 也可以是 DashScope 的响应 (非 200, 或异步任务状态为 FAILED 等)。
+    """
+    if is_throttled(outcome):
+        return TRANSIENT
+
+    if isinstance(outcome, BaseException):
+        if isinstance(outcome, (TimeoutError, asyncio.TimeoutError, ConnectionError,
+                                requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return TRANSIENT
+        if any(cls.__name__ in TRANSIENT_EXCEPTION_NAMES for cls in type(outcome).__mro__):
+            return TRANSIENT
+        code = getattr(outcome, "code", None)
+        if hasattr(outcome, "status_code") or isinstance(code, str):
+            return _classify_status(getattr(outcome, "status_code", None), code if isinstance(code, str) else None)
+        # 没有状态码的 SDK 异常 (例如 TTSError): 消息里带永久错误码时不重试, 声明了 retryable 的按临时错误处理
+        message = str(outcome)
+        if any(prefix in message for prefix in PERMANENT_CODES):
+            return PERMANENT
+        if getattr(outcome, "retryable", False):
+            return TRANSIENT
+        # 其他异常 (解析失败、参数错误等) 重试也不会好转
+        return PERMANENT
+
+    status_code = getattr(outcome, "status_code", None)
+    if status_code is None:
+        return None
+    if status_code != HTTPStatus.OK:
+        return _classify_status(status_code, getattr(outcome, "code", None))
+    output = getattr(outcome, "output", None)
+    task_status = output.get("task_status") if isinstance(output, dict) else getattr(output, "task_status", None)
+    if task_status in ("FAILED", "CANCELED", "UNKNOWN"):
+        return _classify_status(None, output.get("code") if isinstance(output, dict) else getattr(output, "code", None))
+    return None
+
+
+def _describe(outcome: Any) -> dict:
+    if isinstance(outcome, BaseException):
+        code = getattr(outcome, "code", None)
+        return {"status_code": getattr(outcome, "status_code", None),
+                "code": code if isinstance(code, str) else type(outcome).__name__,
+                "message": str(outcome)}
+    output = getattr(outcome, "output", None)
+    if getattr(outcome, "status_code", None) == HTTPStatus.OK and isinstance(output, dict):
+        return {"status_code": HTTPStatus.OK, "code": output.get("code"),
+                "message": output.get("message") or output.get("task_status")}
+    return {"status_code": getattr(outcome, "status_code", None),
+            "code": getattr(outcome, "code", None), "message": getattr(outcome, "message", None)}
+
+
+def _timeout(kind: str) -> Optional[float]:
+    value = float(os.getenv(f"RETRY_TIMEOUT_{kind.upper()}", DEFAULT_TIMEOUTS.get(kind, 0)))
+    return value or None
+
+
+def _backoff(attempt: int) -> float:
+    """full jitter: [0, min(上限, 基数 * 2^attempt)] 内均匀分布, 避免并发镜头同时重试"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class _Retry:
+    """一次 call_provider/acall_provider 的重试状态"""
+    def __init__(self, kind: str, model: Optional[str], max_attempts: int, deadline: float):
+        self.kind = kind
+        self.model = model
+        self.max_attempts = max(1, max_attempts)
+        self.deadline = deadline
+        self.started_at = time.monotonic()
+        self.attempts = 0
+
+    def next_delay(self, outcome: Any) -> float:
+        """outcome 不可重试时抛 ProviderError, 否则返回下一次尝试前的等待时间"""
+        category = classify(outcome)
+        elapsed = time.monotonic() - self.started_at
+        delay = _backoff(self.attempts - 1)
+        if category == PERMANENT or self.attempts >= self.max_attempts or elapsed + delay > self.deadline:
+            error = ProviderError(self.kind, self.model, category, attempts=self.attempts, elapsed=elapsed,
+                                  **_describe(outcome))
+            if isinstance(outcome, BaseException):
+                raise error from outcome
+            raise error
+        info = _describe(outcome)
+        print(f"[Retry] {self.kind}:{self.model} 第 {self.attempts} 次调用失败 "
+              f"({info['message'] or info['code'] or info['status_code']}), {delay:.1f}s 后重试")
+        return delay
+
+
+def call_provider(kind: str, model: Optional[str], fn: Callable[..., Any], /, *args,
+                  priority: Optional[int] = None, max_attempts: int = RETRY_MAX_ATTEMPTS,
+                  deadline: float = RETRY_DEADLINE, **kwargs) -> Any:
+    """
+    经过配额治理 (rate_limiter) 调用 fn, 临时错误退避重试, 最终失败抛 ProviderError。
+    返回值一定是成功的结果: DashScope 的非 200 响应 / FAILED 任务也会被当作失败处理。
+    """
+    retry = _Retry(kind, model, max_attempts, deadline)
+    with span(f"{kind}:{model}", "provider", kind=kind, model=model,
+              bytes_in=payload_size((args, kwargs))) as trace:
+        try:
+            while True:
+                retry.attempts += 1
+                try:
+                    outcome = get_governor().call(kind, model, fn, *args, priority=priority, **kwargs)
+                except Exception as e:
+                    outcome = e
+                if classify(outcome) is None:
+                    trace.set(bytes_out=payload_size(outcome))
+                    return outcome
+                time.sleep(retry.next_delay(outcome))
+        finally:
+            trace.set(attempts=retry.attempts, retries=retry.attempts - 1)
+
+
+async def acall_provider(kind: str, model: Optional[str], fn: Callable[..., Any], /, *args,
+                         priority: Optional[int] = None, max_attempts: int = RETRY_MAX_ATTEMPTS,
+                         deadline: float = RETRY_DEADLINE, **kwargs) -> Any:
+    """call_provider 的异步版本, 每次尝试额外受 RETRY_TIMEOUT_<KIND> 限制"""
+    retry = _Retry(kind, model, max_attempts, deadline)
+    timeout = _timeout(kind)
+
+    async def attempt():
+        return await asyncio.wait_for(fn(*args, **kwargs), timeout)
+
+    with span(f"{kind}:{model}", "provider", kind=kind, model=model,
+              bytes_in=payload_size((args, kwargs))) as trace:
+        try:
+            while True:
+                retry.attempts += 1
+                try:
+                    outcome = await get_governor().acall(kind, model, attempt, priority=priority)
+                except Exception as e:
+                    outcome = e
+                if classify(outcome) is None:
+                    trace.set(bytes_out=payload_size(outcome))
+                    return outcome
+                await asyncio.sleep(retry.next_delay(outcome))
+        finally:
+            trace.set(attempts=retry.attempts, retries=retry.attempts - 1)
@@ -0,0 +1,392 @@
+# 分段并行渲染后端: 每个片段在进程池中单独归一化编码, 转场渲染成短的衔接段, 最后 stream copy 拼接
+import os
+import json
+import time
+import hashlib
+import subprocess
+import multiprocessing
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple, Optional, Callable
+
+from src.utils.tools import file_sha256
+from src.utils.media_probe import FFMPEG_BINARY
+from src.services.ffmpeg_renderer import FFmpegRenderer, AUDIO_SAMPLE_RATE, _fmt
+from src.services.tracing import span
+
+# 并行渲染的进程数, 默认每个 CPU 核一个
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+# 每个片段目录的 manifest 最多保留的成片记录数; 超出后最早的记录被淘汰, 只被它引用的片段随之删除
+SEGMENT_CACHE_MAX_OUTPUTS = int(os.getenv("SEGMENT_CACHE_MAX_OUTPUTS", "20"))
+# 正在渲染的成片会先登记它要用的片段, 清理时跳过; 超过该时长(秒)仍未完成的登记视为进程已崩溃
+SEGMENT_RESERVATION_TTL = float(os.getenv("SEGMENT_RESERVATION_TTL", str(6 * 3600)))
+
+try:
+    import fcntl
+except ImportError:     # Windows: 没有 flock, 退化为只在进程内互斥
+    fcntl = None
+
+# mp4 的时间基固定下来, 保证各段 stream copy 拼接时时间戳连续
+_VIDEO_TIMESCALE = "90000"
+
+
+class SegmentRenderer(FFmpegRenderer):
+    """
+    时间轴被切成交替的两类片段:
+      body_i  : 第 i 个镜头去掉首尾转场部分后的主体
+      joint_i : 第 i 个镜头的最后 transition 秒与第 i+1 个镜头的前 transition 秒做 xfade/acrossfade
+    body_0, joint_0, body_1, joint_1, ... 各自独立编码 (编码参数完全一致), 可以按 CPU 核数并行,
+    最终用 concat demuxer + -c copy 拼接, 拼接步骤不再重新编码。
+    片段文件以输入内容 hash 命名, 配合 SegmentManifest 可以只重渲染发生变化的镜头及其相邻转场。
+    """
+    def __init__(self, width: int = 1280, height: int = 720, fps: int = 24, transition: float = 0.5,
+                 workers: int = RENDER_WORKERS):
+        super().__init__(width=width, height=height, fps=fps, transition=transition)
+        self.workers = max(1, workers)
+
+    def render(self, clips: List[Dict[str, Any]], subtitles: List[Dict], output_path: str,
+               codec: str = "libx264", preset: str = "medium", crf: int = 20, threads: int = 0,
+               audio_bitrate: str = "192k", segment_dir: Optional[str] = None,
+               manifest_key: Optional[str] = None) -> str:
+        """
+        segment_dir 为空时在临时目录中全量渲染;
+        指定 segment_dir 时为增量渲染: 片段文件按输入内容 hash 命名并保留, 下次只重渲染输入发生变化的片段。
+        manifest_key: segment_dir 的 manifest 中记录本次成片用到哪些片段的 key (默认为 output_path);
+        同一个 key 再次记录时, 旧记录引用而新记录不再引用的片段会被清理, 其他 key 的片段不受影响。
+        """
+        output_path = os.path.abspath(output_path)
+        encode_args = self._encode_args(codec, preset, crf, audio_bitrate)
+        if segment_dir is None:
+            with tempfile.TemporaryDirectory(prefix="ttv_segments_") as work_dir:
+                self._render_pieces(clips, subtitles, output_path, encode_args, work_dir, manifest=None)
+        else:
+            segment_dir = os.path.abspath(segment_dir)
+            os.makedirs(segment_dir, exist_ok=True)
+            self._render_pieces(clips, subtitles, output_path, encode_args, segment_dir,
+                                manifest=SegmentManifest(segment_dir), manifest_key=manifest_key)
+        return output_path
+
+    def _render_pieces(self, clips: List[Dict[str, Any]], subtitles: List[Dict], output_path: str,
+                       encode_args: List[str], work_dir: str, manifest: Optional["SegmentManifest"],
+                       manifest_key: Optional[str] = None):
+        pieces = self.plan_pieces(clips, subtitles, work_dir)
+        fonts_dir = self.subtitle_engine.prepare_fonts_dir(work_dir) if subtitles else None
+        hash_file = manifest.hash_file if manifest else file_sha256
+        for piece in pieces:
+            piece["key"] = self.piece_key(piece, encode_args, hash_file)
+            piece["output"] = os.path.join(work_dir, f"{piece['key'][:32]}.mp4")
+            piece["fonts_dir"] = fonts_dir
+
+        output_key = manifest_key or output_path
+        if manifest:
+            # 先登记本次要用的片段, 其他进程同时记录成片时不会把它们当作过期片段删掉
+            manifest.reserve(output_key, pieces)
+        try:
+            todo = [piece for piece in pieces if not os.path.exists(piece["output"])]
+            print(f"[Segments] {len(pieces)} segments, {len(pieces) - len(todo)} reused, "
+                  f"rendering {len(todo)} with {self.workers} workers")
+            if todo:
+                # 渲染在 to_thread 里调用, 此时进程中还有事件循环、线程池、RSS 采样等线程;
+                # fork 会把它们持有的锁原样复制进子进程, 可能直接死锁, 因此用 spawn 启动全新的解释器
+                with span("render.segments", "render", segments=len(pieces), rendered=len(todo),
+                          workers=self.workers), \
+                        ProcessPoolExecutor(max_workers=min(self.workers, len(todo)),
+                                            mp_context=multiprocessing.get_context("spawn")) as pool:
+                    list(pool.map(_render_piece, [(self._params(), piece, encode_args) for piece in todo]))
+
+            with span("render.concat", "render", segments=len(pieces)):
+                self.concat([piece["output"] for piece in pieces], output_path, work_dir)
+        except BaseException:
+            if manifest:
+                manifest.release(output_key)
+            raise
+        if manifest:
+            manifest.record(output_key, pieces)
+
+    def plan_pieces(self, clips: List[Dict[str, Any]], subtitles: List[Dict], work_dir: str) -> List[Dict[str, Any]]:
+        """把时间轴切成 body/joint 片段, 返回每段的渲染参数 (按播放顺序)"""
+        durations = [float(c["target_duration"]) for c in clips]
+        transition = min(self.transition, min(durations) / 2) if len(clips) > 1 else 0.0
+        pieces = []
+        timeline = 0.0
+        for i, clip_data in enumerate(clips):
+            head = transition if i > 0 else 0.0
+            tail = transition if i < len(clips) - 1 else 0.0
+            body_length = durations[i] - head - tail
+            if body_length > 1e-3:
+                pieces.append({
+                    "name": f"body_{i:04d}",
+                    "clips": [clip_data],
+                    "durations": [durations[i]],
+                    "ranges": [(head, durations[i] - tail)],
+                    "offset": timeline,
+                    "length": body_length,
+                    "transition": 0.0,
+                })
+                timeline += body_length
+            if tail:
+                pieces.append({
+                    "name": f"joint_{i:04d}",
+                    "clips": [clip_data, clips[i + 1]],
+                    "durations": [durations[i], durations[i + 1]],
+                    "ranges": [(durations[i] - tail, durations[i]), (0.0, transition)],
+                    "offset": timeline,
+                    "length": transition,
+                    "transition": transition,
+                })
+                timeline += transition
+
+        for piece in pieces:
+            piece["work_dir"] = work_dir
+            piece["subtitles"] = self._local_subtitles(subtitles, piece["offset"], piece["length"])
+        return pieces
+
+    def piece_key(self, piece: Dict[str, Any], encode_args: List[str], hash_file: Callable[[str], str]) -> str:
+        """片段的内容 key: 素材文件内容、目标时长、截取区间、转场、片段内字幕、渲染/编码参数
+        片段在时间轴上的绝对位置不参与计算 (字幕已换算为片段内的相对时间), 前面镜头变长不会让后面的片段失效。
+        """
+        def file_key(path):
+            return hash_file(path) if path and os.path.exists(path) else None
+
+        payload = {
+            "renderer": self._params(),
+            "encode": encode_args,
+            "subtitle_style": self.subtitle_engine.style_key(),
+            "transition": round(piece["transition"], 3),
+            "subtitles": piece["subtitles"],
+            "clips": [
+                {
+                    "video": file_key(clip_data.get("video_path")),
+                    "image": file_key(clip_data.get("image_path")),
+                    "audio": file_key(clip_data.get("audio_path")),
+                    "duration": round(duration, 3),
+                    "range": [round(start, 3), round(end, 3)],
+                }
+                for clip_data, duration, (start, end) in zip(piece["clips"], piece["durations"], piece["ranges"])
+            ],
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _local_subtitles(subtitles: List[Dict], offset: float, length: float) -> List[Dict]:
+        """截取落在 [offset, offset + length) 内的字幕, 换算为片段内的相对时间"""
+        local = []
+        for item in subtitles or []:
+            start = max(item["start"] - offset, 0.0)
+            end = min(item["end"] - offset, length)
+            if end - start > 1e-3:
+                local.append({"text": item["text"], "start": round(start, 3), "end": round(end, 3)})
+        return local
+
+    def build_piece_graph(self, piece: Dict[str, Any]) -> Tuple[List[str], str]:
+        """单个片段的 filter graph: 各镜头归一化 -> 截取区间 -> (xfade) -> 烧录片段内字幕"""
+        inputs: List[List[str]] = []
+        filters: List[str] = []
+        for k, (clip_data, duration, (start, end)) in enumerate(zip(piece["clips"], piece["durations"], piece["ranges"])):
+            v_chain, a_chain = self._clip_chains(clip_data, duration, inputs)
+            # trim 之后帧率信息会丢失, 需要再次声明恒定帧率 (xfade 要求)
+            filters.append(f"{v_chain},trim=start={_fmt(start)}:end={_fmt(end)},setpts=PTS-STARTPTS,fps={self.fps}[v{k}]")
+            filters.append(f"{a_chain},atrim=start={_fmt(start)}:end={_fmt(end)},asetpts=PTS-STARTPTS[a{k}]")
+
+        if len(piece["clips"]) == 2:
+            d = _fmt(piece["transition"])
+            filters.append(f"[v0][v1]xfade=transition=fade:duration={d}:offset=0[vj]")
+            # 两路音频都恰好是 transition 长度, 用淡出/淡入后混音实现交叉淡化 (acrossfade 要求第一路比淡化时长更长)
+            filters.append(f"[a0]afade=t=out:st=0:d={d}[af0]")
+            filters.append(f"[a1]afade=t=in:st=0:d={d}[af1]")
+            filters.append(f"[af0][af1]amix=inputs=2:duration=longest:normalize=0[aj]")
+            v_last, a_last = "vj", "aj"
+        else:
+            v_last, a_last = "v0", "a0"
+
+        if piece["subtitles"]:
+            ass_name = f"{piece['key'][:32]}.ass"
+            self.subtitle_engine.write_ass(piece["subtitles"], os.path.join(piece["work_dir"], ass_name))
+            filters.append(f"[{v_last}]{self._subtitle_filter(ass_name, piece['fonts_dir'])}[vout]")
+        else:
+            filters.append(f"[{v_last}]null[vout]")
+        filters.append(f"[{a_last}]anull[aout]")
+        return [arg for group in inputs for arg in group], ";\n".join(filters)
+
+    def concat(self, segment_paths: List[str], output_path: str, work_dir: str):
+        """concat demuxer + stream copy, 不重新编码"""
+        # 片段目录可能被多个渲染共享, 列表文件名不能冲突
+        fd, list_path = tempfile.mkstemp(prefix="segments.", suffix=".tmp.txt", dir=work_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for path in segment_paths:
+                f.write(f"file '{path}'\n")
+        cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+               "-f", "concat", "-safe", "0", "-i", list_path,
+               "-c", "copy", "-movflags", "+faststart", output_path]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+        finally:
+            os.remove(list_path)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg 拼接失败: {result.stderr.strip()[-2000:]}")
+
+    def _params(self) -> Dict[str, Any]:
+        return {"width": self.width, "height": self.height, "fps": self.fps, "transition": self.transition}
+
+    def _encode_args(self, codec: str, preset: str, crf: int, audio_bitrate: str) -> List[str]:
+        # 所有片段必须使用完全相同的编码参数, 才能 stream copy 拼接;
+        # 每个进程只用一个编码线程, 并行度由进程数决定
+        return ["-c:v", codec, "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p",
+                "-r", str(self.fps), "-threads", "1", "-video_track_timescale", _VIDEO_TIMESCALE,
+                "-c:a", "aac", "-b:a", audio_bitrate, "-ar", str(AUDIO_SAMPLE_RATE), "-ac", "2"]
+
+
+def _render_piece(args: Tuple[Dict[str, Any], Dict[str, Any], List[str]]) -> str:
+    """进程池 worker: 渲染单个 body/joint 片段 (模块级函数, 便于 pickle)"""
+    params, piece, encode_args = args
+    renderer = SegmentRenderer(workers=1, **params)
+    inputs, graph = renderer.build_piece_graph(piece)
+    # 两个渲染可能同时编码同一个片段 (输入完全相同), 中间文件按进程区分
+    tmp_suffix = f".{os.getpid()}.tmp"
+    script_path = os.path.join(piece["work_dir"], f"{piece['key'][:32]}.graph{tmp_suffix}.txt")
+    with open(script_path, "w", encoding="utf-8") as f:
+        f.write(graph)
+
+    # 先写临时文件, 成功后再 rename: 中途被杀掉的片段不会被下次增量渲染误用
+    tmp_output = piece["output"] + f"{tmp_suffix}.mp4"
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", *inputs,
+           "-filter_complex_script", script_path, "-map", "[vout]", "-map", "[aout]",
+           *encode_args, tmp_output]
+    result = subprocess.run(cmd, cwd=piece["work_dir"], capture_output=True, text=True)
+    os.remove(script_path)
+    if result.returncode != 0:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        raise RuntimeError(f"ffmpeg 片段 {piece['name']} 渲染失败: {result.stderr.strip()[-2000:]}")
+    os.replace(tmp_output, piece["output"])
+    return piece["output"]
+
+
+_manifest_locks: Dict[str, threading.Lock] = {}
+_manifest_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _locked(lock_path: str):
+    """进程内用 threading.Lock, 进程间用 flock 串行化对同一个 manifest 的读-改-写"""
+    with _manifest_locks_guard:
+        thread_lock = _manifest_locks.setdefault(lock_path, threading.Lock())
+    with thread_lock, open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SegmentManifest:
+    """
+    增量渲染的清单 (segment_dir/manifest.json), 同一个 segment_dir 可以被多个进程/运行共享:
+    - outputs:      每个成片 key 由哪些片段 (key + 名称) 组成, 最多保留 SEGMENT_CACHE_MAX_OUTPUTS 条
+    - reservations: 正在渲染、尚未记录的成片要用到的片段
+    - orphans:      清理时因为仍被登记占用而暂缓删除的片段, 之后的记录再次检查
+    - file_hashes:  素材文件 hash 的缓存, 以 (mtime, size) 判断是否需要重新计算
+    写入时在文件锁内重新读取磁盘上的 manifest 再合并, 不会用过期的副本覆盖其他渲染的记录。
+    清理只针对被替换/淘汰的记录引用过、且不再被任何记录或登记引用的片段, 从不删除 *.tmp* 中间文件。
+    """
+    def __init__(self, segment_dir: str):
+        self.segment_dir = segment_dir
+        self.path = os.path.join(segment_dir, "manifest.json")
+        self.lock_path = os.path.join(segment_dir, "manifest.lock")
+        self.data = self._read()
+
+    def _read(self) -> Dict[str, Any]:
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"[Segments] manifest 读取失败, 按全量渲染处理: {e}")
+        for field in ("outputs", "reservations", "file_hashes"):
+            data.setdefault(field, {})
+        data.setdefault("orphans", [])
+        return data
+
+    def _write(self, data: Dict[str, Any]):
+        # 多个进程可能同时渲染到同一个 segment_dir, 临时文件名不能冲突
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def hash_file(self, path: str) -> str:
+        stat = os.stat(path)
+        entry = self.data["file_hashes"].get(os.path.abspath(path))
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return entry["sha256"]
+        digest = file_sha256(path)
+        self.data["file_hashes"][os.path.abspath(path)] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest}
+        return digest
+
+    def reserve(self, output_key: str, pieces: List[Dict[str, Any]]):
+        """渲染开始前登记要用到的片段 (包括直接复用的已有片段)"""
+        with _locked(self.lock_path):
+            data = self._read()
+            data["reservations"][output_key] = {
+                "reserved_at": time.time(),
+                "stems": [piece["key"][:32] for piece in pieces],
+            }
+            self._write(data)
+
+    def release(self, output_key: str):
+        """渲染失败: 撤销登记, 已渲染的片段留给之后的渲染复用 (或随后续记录一起清理)"""
+        with _locked(self.lock_path):
+            data = self._read()
+            if data["reservations"].pop(output_key, None) is not None:
+                self._write(data)
+
+    def record(self, output_key: str, pieces: List[Dict[str, Any]]):
+        with _locked(self.lock_path):
+            data = self._read()
+            outputs = data["outputs"]
+            stale = [outputs.pop(output_key)] if output_key in outputs else []
+            outputs[output_key] = {
+                "rendered_at": time.time(),
+                "pieces": [{"name": piece["name"], "key": piece["key"]} for piece in pieces],
+            }
+            # 超出上限时淘汰最早的成片记录
+            overflow = len(outputs) - SEGMENT_CACHE_MAX_OUTPUTS
+            if overflow > 0:
+                oldest = sorted((key for key in outputs if key != output_key), key=lambda k: outputs[k]["rendered_at"])
+                stale.extend(outputs.pop(key) for key in oldest[:overflow])
+
+            now = time.time()
+            data["reservations"].pop(output_key, None)
+            data["reservations"] = {key: entry for key, entry in data["reservations"].items()
+                                    if now - entry["reserved_at"] < SEGMENT_RESERVATION_TTL}
+
+            # 候选: 被替换/淘汰的记录引用过的片段, 加上之前因为被登记占用而暂缓删除的片段
+            candidates = {piece["key"][:32] for entry in stale for piece in entry["pieces"]}
+            candidates.update(data["orphans"])
+            referenced = {piece["key"][:32] for entry in outputs.values() for piece in entry["pieces"]}
+            reserved = {stem for entry in data["reservations"].values() for stem in entry["stems"]}
+            self._prune(candidates - referenced - reserved)
+            data["orphans"] = sorted((candidates & reserved) - referenced)
+
+            # 合并本进程计算过的素材 hash; 输入素材在各次运行的产物目录下, 已删除的路径不再保留
+            data["file_hashes"].update(self.data["file_hashes"])
+            data["file_hashes"] = {path: entry for path, entry in data["file_hashes"].items()
+                                   if os.path.exists(path)}
+            self._write(data)
+            self.data = data
+
+    def _prune(self, stems):
+        if not stems:
+            return
+        for file_name in os.listdir(self.segment_dir):
+            # 中间文件属于正在进行的渲染 (可能是别的进程), 由渲染方自己清理
+            if ".tmp" in file_name or os.path.isdir(os.path.join(self.segment_dir, file_name)):
+                continue
+            if file_name.split(".", 1)[0] in stems:
+                os.remove(os.path.join(self.segment_dir, file_name))
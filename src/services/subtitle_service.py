@@ -0,0 +1,290 @@
+# 字幕引擎: FFmpeg 后端输出 ASS 字幕轨交给 libass 烧录; MoviePy 后端用 Pillow 预先光栅化每一行 (字体/字形缓存), 只在该行的时间范围内叠加
+import os
+import bisect
+import shutil
+import threading
+import subprocess
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# 字体文件路径; 不设置时自动查找系统中的中文字体
+SUBTITLE_FONT = os.getenv("SUBTITLE_FONT")
+# 720p 下的字号 (像素), 其他分辨率按画面高度等比缩放
+SUBTITLE_FONT_SIZE = int(os.getenv("SUBTITLE_FONT_SIZE", "40"))
+
+# 常见发行版/系统的中文字体位置, 按优先级排列
+_CJK_FONT_CANDIDATES = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/wqy-zenhei/wqy-zenhei.ttc",
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/STHeiti Medium.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+]
+# 找不到中文字体时的兜底 (中文会显示为方块, 但不会中断渲染)
+_FALLBACK_FONTS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/System/Library/Fonts/Helvetica.ttc",
+    "C:/Windows/Fonts/arialbd.ttf",
+]
+
+
+@lru_cache(maxsize=1)
+def resolve_font() -> Optional[str]:
+    """查找字幕字体: SUBTITLE_FONT -> 常见中文字体 -> fc-match 中文字体 -> 西文兜底字体"""
+    if SUBTITLE_FONT:
+        if os.path.exists(SUBTITLE_FONT):
+            return SUBTITLE_FONT
+        print(f"[Subtitle] SUBTITLE_FONT 不存在: {SUBTITLE_FONT}, 改为自动查找")
+
+    for path in _CJK_FONT_CANDIDATES:
+        if os.path.exists(path):
+            return path
+
+    if shutil.which("fc-match"):
+        out = subprocess.run(["fc-match", "-f", "%{file}", ":lang=zh"], capture_output=True, text=True)
+        if out.returncode == 0 and out.stdout and os.path.exists(out.stdout.strip()):
+            return out.stdout.strip()
+
+    for path in _FALLBACK_FONTS:
+        if os.path.exists(path):
+            print(f"[Subtitle] 未找到中文字体, 使用 {path} (中文可能无法显示, 可通过 SUBTITLE_FONT 指定)")
+            return path
+    print("[Subtitle] 未找到可用字体, 使用 Pillow 内置字体")
+    return None
+
+
+@lru_cache(maxsize=16)
+def load_font(path: Optional[str], size: int):
+    """字体对象按 (路径, 字号) 缓存, 大号 CJK 字体文件只解析一次"""
+    from PIL import ImageFont
+    if path:
+        return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size)
+
+
+def _ass_time(seconds: float) -> str:
+    centis = int(round(max(seconds, 0.0) * 100))
+    hours, centis = divmod(centis, 360_000)
+    minutes, centis = divmod(centis, 6000)
+    secs, centis = divmod(centis, 100)
+    return f"{hours:d}:{minutes:02d}:{secs:02d}.{centis:02d}"
+
+
+def _ass_text(text: str) -> str:
+    # 花括号在 ASS 中是样式标签, 换行用 \N
+    return text.replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}").replace("\r", "").replace("\n", "\\N")
+
+
+class GlyphAtlas:
+    """
+    字形缓存: 每个字符 (含描边) 只光栅化一次, 之后按字宽拼接成整行。
+    字幕文本字符集很小 (一条旁白的常用字反复出现), 缓存命中率很高。
+    """
+    def __init__(self, font, stroke_width: int):
+        self.font = font
+        self.stroke_width = stroke_width
+        ascent, descent = font.getmetrics()
+        self.line_height = ascent + descent + 2 * stroke_width
+        self._glyphs: Dict[str, Tuple[Any, Any, int]] = {}
+        self._lock = threading.Lock()
+
+    def advance(self, char: str) -> int:
+        return self.glyph(char)[2]
+
+    def glyph(self, char: str):
+        """返回 (填充 mask, 描边 mask, 字宽), mask 为 L 模式图片"""
+        with self._lock:
+            cached = self._glyphs.get(char)
+        if cached:
+            return cached
+
+        from PIL import Image, ImageDraw
+        advance = int(round(self.font.getlength(char)))
+        size = (advance + 2 * self.stroke_width, self.line_height)
+        fill = Image.new("L", size, 0)
+        ImageDraw.Draw(fill).text((self.stroke_width, self.stroke_width), char, font=self.font, fill=255)
+        stroke = Image.new("L", size, 0)
+        ImageDraw.Draw(stroke).text((self.stroke_width, self.stroke_width), char, font=self.font, fill=255,
+                                    stroke_width=self.stroke_width, stroke_fill=255)
+        cached = (fill, stroke, advance)
+        with self._lock:
+            self._glyphs[char] = cached
+        return cached
+
+
+class SubtitleEngine:
+    """
+    白字黑描边、底部居中, 超出 max_width 自动换行 (中文按字断行, 西文优先在空格处断行)。
+    - write_ass(): 生成 ASS 字幕轨, PlayRes 与画面尺寸一致, 字号即像素
+    - overlay(): MoviePy 片段上叠加预光栅化的字幕, 每帧只混合当前字幕所在的矩形区域
+    """
+    def __init__(self, width: int, height: int, font_path: Optional[str] = None, font_size: Optional[int] = None):
+        self.width = width
+        self.height = height
+        self.font_path = font_path or resolve_font()
+        self.font_size = font_size or max(12, round(SUBTITLE_FONT_SIZE * height / 720))
+        self.stroke_width = max(1, round(2 * height / 720))
+        self.margin_v = round(36 * height / 720)
+        self.max_width = width - 100
+        self._atlas: Optional[GlyphAtlas] = None
+        self._lines: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def atlas(self) -> GlyphAtlas:
+        if self._atlas is None:
+            self._atlas = GlyphAtlas(load_font(self.font_path, self.font_size), self.stroke_width)
+        return self._atlas
+
+    @property
+    def font_family(self) -> str:
+        return load_font(self.font_path, self.font_size).getname()[0]
+
+    def style_key(self) -> Dict[str, Any]:
+        """影响字幕像素结果的全部参数 (用于分段渲染的片段 key)"""
+        return {"font": self.font_path, "size": self.font_size, "stroke": self.stroke_width,
+                "margin_v": self.margin_v, "max_width": self.max_width}
+
+    # ---------- ASS 字幕轨 ----------
+    def write_ass(self, subtitles: List[Dict], path: str):
+        header = (
+            "[Script Info]\n"
+            "ScriptType: v4.00+\n"
+            f"PlayResX: {self.width}\n"
+            f"PlayResY: {self.height}\n"
+            "WrapStyle: 0\n"
+            "ScaledBorderAndShadow: yes\n\n"
+            "[V4+ Styles]\n"
+            "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, "
+            "Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, "
+            "MarginL, MarginR, MarginV, Encoding\n"
+            f"Style: Default,{self.font_family},{self.font_size},&H00FFFFFF,&H000000FF,&H00000000,&H00000000,"
+            f"-1,0,0,0,100,100,0,0,1,{self.stroke_width},0,2,50,50,{self.margin_v},1\n\n"
+            "[Events]\n"
+            "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(header)
+            for item in subtitles:
+                f.write(f"Dialogue: 0,{_ass_time(item['start'])},{_ass_time(item['end'])},Default,,0,0,0,,"
+                        f"{_ass_text(item['text'])}\n")
+
+    def prepare_fonts_dir(self, work_dir: str) -> Optional[str]:
+        """在 work_dir 下建立 fonts/ 并链接字体文件, 返回相对路径供 subtitles 滤镜的 fontsdir 使用
+        (ffmpeg 以 work_dir 为 cwd 运行, 相对路径不需要做 filter 语法转义)"""
+        if not self.font_path:
+            return None
+        fonts_dir = os.path.join(work_dir, "fonts")
+        os.makedirs(fonts_dir, exist_ok=True)
+        link_path = os.path.join(fonts_dir, os.path.basename(self.font_path))
+        if not os.path.exists(link_path):
+            try:
+                os.symlink(os.path.abspath(self.font_path), link_path)
+            except OSError:
+                shutil.copyfile(self.font_path, link_path)
+        return "fonts"
+
+    # ---------- Pillow 光栅化 ----------
+    def text_width(self, text: str) -> int:
+        return sum(self.atlas.advance(char) for char in text)
+
+    def wrap(self, text: str) -> List[str]:
+        lines = []
+        for paragraph in text.splitlines() or [""]:
+            line = ""
+            for char in paragraph:
+                if line and self.text_width(line + char) > self.max_width:
+                    space = line.rfind(" ")
+                    if char != " " and space > 0:
+                        # 西文: 回退到最近的空格处断行
+                        lines.append(line[:space])
+                        line = line[space + 1:] + char
+                    else:
+                        lines.append(line.rstrip())
+                        line = char.lstrip()
+                else:
+                    line += char
+            lines.append(line.rstrip())
+        return lines
+
+    def rasterize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (rgb uint8 [h, w, 3], alpha float32 [h, w, 1]), 按文本缓存"""
+        with self._lock:
+            cached = self._lines.get(text)
+        if cached:
+            return cached
+
+        from PIL import Image, ImageChops
+        atlas = self.atlas
+        lines = self.wrap(text)
+        line_widths = [self.text_width(line) + 2 * atlas.stroke_width for line in lines]
+        canvas_size = (max(max(line_widths), 1), atlas.line_height * len(lines))
+        fill = Image.new("L", canvas_size, 0)
+        stroke = Image.new("L", canvas_size, 0)
+        for row, (line, line_width) in enumerate(zip(lines, line_widths)):
+            x, y = (canvas_size[0] - line_width) // 2, row * atlas.line_height
+            for char in line:
+                glyph_fill, glyph_stroke, advance = atlas.glyph(char)
+                box = (x, y, x + glyph_fill.width, y + glyph_fill.height)
+                fill.paste(ImageChops.lighter(fill.crop(box), glyph_fill), box)
+                stroke.paste(ImageChops.lighter(stroke.crop(box), glyph_stroke), box)
+                x += advance
+
+        # 描边区域为黑色, 填充区域为白色, alpha 取描边 mask (已包含填充)
+        rgb = np.repeat(np.asarray(fill, dtype=np.uint8)[:, :, None], 3, axis=2)
+        alpha = np.asarray(stroke, dtype=np.float32)[:, :, None] / 255.0
+        cached = (rgb, alpha)
+        with self._lock:
+            self._lines[text] = cached
+        return cached
+
+    def overlay(self, clip, subtitles: List[Dict]):
+        """在 MoviePy 片段上烧录字幕; 不在任何字幕时间范围内的帧原样返回"""
+        events = []
+        for item in sorted(subtitles, key=lambda s: s["start"]):
+            if item["end"] <= item["start"] or not item["text"].strip():
+                continue
+            rgb, alpha = self.rasterize(item["text"])
+            h, w = alpha.shape[:2]
+            x = max((self.width - w) // 2, 0)
+            y = max(self.height - self.margin_v - h, 0)
+            events.append((item["start"], item["end"], x, y, rgb, alpha))
+        if not events:
+            return clip
+
+        starts = [event[0] for event in events]
+        longest = max(end - start for start, end, *_ in events)
+
+        def burn(get_frame, t):
+            frame = get_frame(t)
+            index = bisect.bisect_right(starts, t) - 1
+            active = []
+            while index >= 0 and starts[index] > t - longest:
+                if events[index][1] > t:
+                    active.append(events[index])
+                index -= 1
+            if not active:
+                return frame
+            frame = np.array(frame, copy=True)
+            for _, _, x, y, rgb, alpha in reversed(active):
+                region = frame[y:y + rgb.shape[0], x:x + rgb.shape[1]]
+                h, w = region.shape[:2]
+                a = alpha[:h, :w]
+                region[:] = (region * (1.0 - a) + rgb[:h, :w] * a).astype(np.uint8)
+            return frame
+
+        return clip.fl(burn)
+
+
+@lru_cache(maxsize=8)
+def get_subtitle_engine(width: int, height: int) -> SubtitleEngine:
+    """同一分辨率共享一个引擎, 字体与字形缓存跨多次渲染复用"""
+    return SubtitleEngine(width, height)
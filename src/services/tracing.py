@@ -0,0 +1,291 @@
+# 耗时追踪: 节点 / 单镜头 / Provider 调用 / 下载 / 流水线阶段 / 渲染阶段各记录一个 span,
+# 运行结束后导出 Chrome trace (chrome://tracing 或 ui.perfetto.dev 打开) 并打印汇总表; 可选同时上报 OpenTelemetry
+import os
+import json
+import time
+import asyncio
+import threading
+import contextvars
+import functools
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from src.services.artifact_store import atomic_write, current_run_id, get_artifact_store
+
+# TRACE_ENABLED=0 关闭 (span 变为空操作); 进程内最多保留 TRACE_MAX_SPANS 个 span, 超出的丢弃并计数
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") != "0"
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "200000"))
+# TRACE_OTEL=1 时同时创建 OpenTelemetry span (需要 opentelemetry-api; 设置了 OTEL_EXPORTER_OTLP_ENDPOINT
+# 且装了 opentelemetry-sdk / otlp exporter 时自动配置 OTLP 导出, 否则使用外部已配置好的 TracerProvider)
+TRACE_OTEL = os.getenv("TRACE_OTEL", "0") == "1"
+
+TRACE_FILE = "trace.json"
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    __slots__ = ("id", "parent_id", "name", "category", "run_id", "lane", "start", "end", "attrs", "error", "_otel")
+
+    def __init__(self, span_id: int, parent: Optional["Span"], name: str, category: str, attrs: Dict[str, Any]):
+        self.id = span_id
+        self.parent_id = parent.id if parent else None
+        self.name = name
+        self.category = category
+        self.run_id = current_run_id()
+        self.lane = _lane()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+        self._otel = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def _lane() -> str:
+    """span 所在的执行流: asyncio task 名 (同一个 task 内的 span 严格嵌套), 不在事件循环里时用线程名"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return task.get_name() if task else threading.current_thread().name
+
+
+def payload_size(value: Any, depth: int = 2) -> int:
+    """请求/响应的大致字节数: bytes/str 按长度, 容器按元素累加, SDK 响应对象按 output 的文本长度估算"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return 0
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8", errors="ignore"))
+    if depth <= 0:
+        return 0
+    if isinstance(value, dict):
+        return sum(payload_size(v, depth - 1) for v in value.values())
+    if isinstance(value, (list, tuple, set)):
+        return sum(payload_size(v, depth - 1) for v in value)
+    if hasattr(value, "bytes_written"):     # tts_service 的流式写盘结果
+        return int(value.bytes_written or 0)
+    output = getattr(value, "output", None)
+    if output is not None:
+        return len(str(output).encode("utf-8", errors="ignore"))
+    content = getattr(value, "content", None)   # langchain 消息
+    return payload_size(content, depth - 1) if content is not None else 0
+
+
+class Tracer:
+    def __init__(self, enabled: bool = TRACE_ENABLED, max_spans: int = TRACE_MAX_SPANS):
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self.epoch = time.perf_counter()
+        self.epoch_wall = time.time()
+        self.dropped = 0
+        self._spans: List[Span] = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._otel_tracer = None
+        self._otel_enabled = TRACE_OTEL
+
+    @contextmanager
+    def span(self, name: str, category: str = "app", **attrs):
+        if not self.enabled:
+            yield _NOOP
+            return
+        parent = _current_span.get()
+        with self._lock:
+            self._next_id += 1
+            span_id = self._next_id
+        span = Span(span_id, parent, name, category, attrs)
+        self._otel_start(span, parent)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            self._otel_end(span)
+            with self._lock:
+                if len(self._spans) < self.max_spans:
+                    self._spans.append(span)
+                else:
+                    self.dropped += 1
+
+    def spans(self, run_id: Optional[str] = None) -> List[Span]:
+        with self._lock:
+            return [s for s in self._spans if run_id is None or s.run_id == run_id]
+
+    def drain(self, run_id: str):
+        """丢弃某次运行的 span (已导出后调用, 批量运行时进程内只保留进行中的任务)"""
+        with self._lock:
+            self._spans = [s for s in self._spans if s.run_id != run_id]
+
+    # --- 导出 ---
+
+    def export_chrome(self, path: str, run_id: Optional[str] = None) -> str:
+        """Chrome trace event 格式: 每个 span 一个 "X" 事件, 每个 task/线程一条轨道"""
+        spans = self.spans(run_id)
+        lanes: Dict[str, int] = {}
+        events = []
+        pid = os.getpid()
+        for s in sorted(spans, key=lambda s: s.start):
+            tid = lanes.setdefault(s.lane, len(lanes) + 1)
+            args = {k: v for k, v in s.attrs.items() if v is not None}
+            args.update(span_id=s.id, parent_id=s.parent_id)
+            if s.error:
+                args["error"] = s.error
+            events.append({"name": s.name, "cat": s.category, "ph": "X", "pid": pid, "tid": tid,
+                           "ts": round((s.start - self.epoch) * 1e6, 1), "dur": round(s.duration * 1e6, 1),
+                           "args": args})
+        for lane, tid in lanes.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": lane}})
+        trace = {"traceEvents": events, "displayTimeUnit": "ms",
+                 "otherData": {"run_id": run_id, "started_at": self.epoch_wall, "dropped_spans": self.dropped}}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with atomic_write(path, "w") as f:
+            json.dump(trace, f, ensure_ascii=False, default=str)
+        return path
+
+    def summary(self, run_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按 (category, name) 聚合: 次数 / 失败数 / 总耗时 / 平均 / p95 / 最大, 以及 Provider 的字节数和重试次数"""
+        groups: Dict[tuple, List[Span]] = {}
+        for s in self.spans(run_id):
+            groups.setdefault((s.category, s.name), []).append(s)
+        rows = []
+        for (category, name), items in groups.items():
+            durations = sorted(s.duration for s in items)
+            rows.append({
+                "category": category, "name": name, "count": len(items),
+                "errors": sum(1 for s in items if s.error),
+                "total": sum(durations), "mean": sum(durations) / len(durations),
+                "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))], "max": durations[-1],
+                "bytes_in": sum(s.attrs.get("bytes_in") or 0 for s in items),
+                "bytes_out": sum(s.attrs.get("bytes_out") or 0 for s in items),
+                "retries": sum(s.attrs.get("retries") or 0 for s in items),
+            })
+        order = {"node": 0, "shot": 1, "pipeline": 2, "provider": 3, "io": 4, "render": 5}
+        rows.sort(key=lambda r: (order.get(r["category"], 9), -r["total"]))
+        return rows
+
+    def summary_table(self, run_id: Optional[str] = None) -> str:
+        rows = self.summary(run_id)
+        spans = self.spans(run_id)
+        if not rows:
+            return "[Trace] no spans recorded"
+        wall = max(s.start + s.duration for s in spans) - min(s.start for s in spans)
+        lines = [f"[Trace] {len(spans)} spans over {wall:.2f}s wall"
+                 + (f" ({self.dropped} dropped, raise TRACE_MAX_SPANS)" if self.dropped else ""),
+                 f"{'category':<9} {'name':<32} {'count':>5} {'err':>4} {'total(s)':>9} {'mean(s)':>8} "
+                 f"{'p95(s)':>8} {'max(s)':>8} {'in(KB)':>9} {'out(KB)':>9} {'retry':>5}"]
+        for r in rows:
+            lines.append(f"{r['category']:<9} {r['name'][:32]:<32} {r['count']:>5} {r['errors']:>4} "
+                         f"{r['total']:>9.2f} {r['mean']:>8.2f} {r['p95']:>8.2f} {r['max']:>8.2f} "
+                         f"{r['bytes_in'] / 1024:>9.1f} {r['bytes_out'] / 1024:>9.1f} {r['retries']:>5}")
+        return "\n".join(lines)
+
+    # --- OpenTelemetry (可选) ---
+
+    def _otel(self):
+        if self._otel_tracer is None and self._otel_enabled:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                print("[Trace] TRACE_OTEL=1 但未安装 opentelemetry-api, 只导出本地 trace")
+                self._otel_enabled = False
+                return None
+            if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+                try:
+                    from opentelemetry.sdk.trace import TracerProvider
+                    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+                    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                    provider = TracerProvider()
+                    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                    trace.set_tracer_provider(provider)
+                except ImportError:
+                    pass    # 没有 SDK / exporter 时沿用外部配置的 TracerProvider
+            self._otel_tracer = trace.get_tracer("ttv_agent")
+        return self._otel_tracer
+
+    def _otel_start(self, span: Span, parent: Optional[Span]):
+        tracer = self._otel()
+        if tracer is None:
+            return
+        from opentelemetry import trace
+        context = trace.set_span_in_context(parent._otel) if parent is not None and parent._otel else None
+        span._otel = tracer.start_span(span.name, context=context,
+                                       attributes={"category": span.category, "run_id": span.run_id})
+
+    def _otel_end(self, span: Span):
+        if span._otel is None:
+            return
+        for key, value in span.attrs.items():
+            if isinstance(value, (str, bool, int, float)):
+                span._otel.set_attribute(key, value)
+        if span.error:
+            from opentelemetry.trace import Status, StatusCode
+            span._otel.set_status(Status(StatusCode.ERROR, span.error))
+        span._otel.end()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def span(name: str, category: str = "app", **attrs):
+    """with span("download", "io", file=...) as s: ...; s.set(bytes_out=...)"""
+    return get_tracer().span(name, category, **attrs)
+
+
+def current_span():
+    """当前上下文中最内层的 span (可以补充属性), 没有时返回空操作对象"""
+    return _current_span.get() or _NOOP
+
+
+def trace_node(name: str, fn: Callable) -> Callable:
+    """包装 LangGraph 节点: 单镜头节点 (输入带 shot) 额外记录 shot_id, 归类为 shot"""
+    @functools.wraps(fn)
+    async def wrapper(state, *args, **kwargs):
+        shot = state.get("shot") if isinstance(state, dict) else None
+        if shot is not None:
+            with span(name, "shot", shot_id=shot.get("id")):
+                return await fn(state, *args, **kwargs)
+        with span(name, "node"):
+            return await fn(state, *args, **kwargs)
+    return wrapper
+
+
+def export_run(run_id: Optional[str] = None) -> Optional[str]:
+    """把一次运行的 span 导出为 <run_dir>/trace.json, 登记到产物 manifest, 然后从内存中移除"""
+    tracer = get_tracer()
+    run_id = run_id or current_run_id()
+    if not tracer.enabled or not tracer.spans(run_id):
+        return None
+    store = get_artifact_store()
+    path = tracer.export_chrome(str(store.run_dir(run_id) / TRACE_FILE), run_id)
+    store.record(path, "trace", {"spans": len(tracer.spans(run_id))}, run_id=run_id)
+    store.flush(run_id)
+    tracer.drain(run_id)
+    return path
@@ -0,0 +1,126 @@
+# 流式 TTS: 音频分片到达即写盘, 合成器 (WebSocket 连接) 通过 DashScope 的对象池在所有镜头间复用
+import os
+import time
+import threading
+from typing import Optional
+
+import dashscope
+from dashscope.audio.tts_v2 import ResultCallback, SpeechSynthesizerObjectPool
+
+TTS_STREAMING = os.getenv("TTS_STREAMING", "1") != "0"
+# 对象池预先建立的连接数; 同一时刻并发合成的镜头数超过它时, SDK 会临时新建连接
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", "4"))
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "120"))
+
+
+class TTSError(RuntimeError):
+    # 连接中断/超时等, 由 retry_policy 按临时错误重试 (消息中带永久错误码的除外)
+    retryable = True
+
+
+class StreamingAudioWriter(ResultCallback):
+    """
+    SpeechSynthesizer 的回调: on_data 收到的每个音频分片直接追加写入 <path>.part,
+    合成完成后 rename 为 path。记录首包时延 (ttfb) 和总耗时。
+    .part 文件在第一个分片到达时才打开, 借用合成器失败时不会留下空文件;
+    completed 只在 on_complete 时置位, 由它 (而不是 SDK 的内部状态) 判断合成器能否放回池中。
+    每次借用都新建一个 writer, 状态随借用重置。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.part_path = path + ".part"
+        self.bytes_written = 0
+        self.started_at = time.perf_counter()
+        self.first_byte_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.completed = False
+        self._file = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def ttfb(self) -> Optional[float]:
+        return self.first_byte_at - self.started_at if self.first_byte_at else None
+
+    @property
+    def total_time(self) -> Optional[float]:
+        return self.finished_at - self.started_at if self.finished_at else None
+
+    def on_data(self, data: bytes) -> None:
+        with self._lock:
+            if self._closed:   # 超时放弃之后迟到的分片
+                return
+            if self._file is None:
+                self.first_byte_at = time.perf_counter()
+                self._file = open(self.part_path, "wb")
+            self._file.write(data)
+            self.bytes_written += len(data)
+
+    def on_complete(self) -> None:
+        self.completed = True
+        self._finish()
+
+    def on_error(self, message) -> None:
+        self.error = str(message)
+        self._finish()
+
+    def _finish(self):
+        if not self._done.is_set():
+            self.finished_at = time.perf_counter()
+            self._done.set()
+
+    def wait(self, timeout: float = TTS_TIMEOUT) -> str:
+        """等待合成结束; 成功时返回最终文件路径, 失败/超时抛 TTSError 并删除半成品"""
+        finished = self._done.wait(timeout)
+        self.close()
+        if not finished or not self.completed or self.error or self.bytes_written == 0:
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+            reason = self.error or ("timeout" if not finished else "no audio received")
+            raise TTSError(f"TTS 合成失败: {reason}")
+        os.replace(self.part_path, self.path)
+        return self.path
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+
+
+_tts_pool: Optional[SpeechSynthesizerObjectPool] = None
+_tts_pool_lock = threading.Lock()
+
+
+def get_tts_pool(api_key: str) -> SpeechSynthesizerObjectPool:
+    """进程内唯一的合成器对象池, 第一次使用时建立 TTS_POOL_SIZE 个 WebSocket 连接"""
+    global _tts_pool
+    with _tts_pool_lock:
+        if _tts_pool is None:
+            # 对象池在构造时就会建立连接, 需要先设置 api_key
+            dashscope.api_key = api_key
+            _tts_pool = SpeechSynthesizerObjectPool(max_size=TTS_POOL_SIZE)
+        return _tts_pool
+
+
+def synthesize_to_file(text: str, path: str, model: str, voice: str, api_key: str) -> StreamingAudioWriter:
+    """借用池中的合成器流式合成 text 并写入 path, 返回带耗时统计的 writer"""
+    pool = get_tts_pool(api_key)
+    writer = StreamingAudioWriter(path)
+    synthesizer = pool.borrow_synthesizer(model=model, voice=voice, callback=writer)
+    try:
+        # 设置了 callback 时 call() 立即返回, 音频通过 on_data 陆续到达
+        synthesizer.call(text)
+    except Exception as e:
+        writer.on_error(e)
+    try:
+        writer.wait()
+    except TTSError:
+        # 任务状态未知的连接不放回池中
+        synthesizer.close()
+        raise
+    # wait() 成功意味着 writer 收到了 on_complete, 这次任务已经结束, 连接可以放回池中
+    pool.return_synthesizer(synthesizer)
+    return writer
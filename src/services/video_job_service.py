@@ -0,0 +1,268 @@
+# 图生视频 (I2V) 的异步任务层: 提交 -> 持久化 task_id -> 单一轮询器 -> 回调给等待的镜头
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from http import HTTPStatus
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from dashscope import VideoSynthesis
+
+# 任务记录持久化在 sqlite 中 (按 job_key 逐行写入, 多进程共享不会互相覆盖), 进程重启后可以继续轮询尚未完成的任务
+JOB_DIR = Path("data") / "jobs"
+JOB_DB = JOB_DIR / "i2v_jobs.sqlite"
+# 旧版本的 JSON 记录, 首次打开数据库时导入一次
+LEGACY_JOB_FILE = JOB_DIR / "i2v_jobs.json"
+# 成功任务的 video_url 有效期约 24 小时, 超过该时长(秒)的成功记录视为过期, 重新提交
+I2V_RESULT_TTL = float(os.getenv("I2V_RESULT_TTL", str(20 * 3600)))
+
+# 轮询退避参数(秒): 从 TASK_POLL_INTERVAL 开始, 每次未完成乘以 1.5, 最长 TASK_POLL_MAX_INTERVAL
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "3"))
+TASK_POLL_MAX_INTERVAL = float(os.getenv("TASK_POLL_MAX_INTERVAL", "30"))
+TASK_POLL_BACKOFF = 1.5
+
+FINAL_STATUSES = ("SUCCEEDED", "FAILED", "CANCELED", "UNKNOWN")
+
+
+class I2VJobError(RuntimeError):
+    """I2V 任务提交或执行失败"""
+    def __init__(self, job_key: str, code: Optional[str], message: Optional[str], status_code: Optional[int] = None):
+        super().__init__(f"I2V job {job_key} failed: status_code={status_code}, code={code}, message={message}")
+        self.job_key = job_key
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+
+
+class I2VJobManager:
+    """
+    I2V 任务管理器
+    - submit(): 调用 VideoSynthesis.async_call 立即返回 task_id, 并写入 JOB_DB
+    - wait():   注册一个 Future, 由唯一的后台轮询器按退避间隔 fetch 所有未完成任务
+    - 重启后同一个 job_key 再次提交时, 直接复用持久化的 task_id 继续轮询, 不重复付费;
+      已成功但超过 I2V_RESULT_TTL 的记录 (video_url 已失效) 不再复用
+    - invalidate(): 调用方下载 video_url 失败时作废该记录, 下次 submit 会重新提交
+    """
+    def __init__(self, job_db: Path = JOB_DB):
+        self.job_db = Path(job_db)
+        self.job_db.parent.mkdir(parents=True, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(self.job_db, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_key TEXT PRIMARY KEY, task_id TEXT NOT NULL, status TEXT NOT NULL, "
+            "submitted_at REAL NOT NULL, finished_at REAL, result TEXT)"
+        )
+        self._db.commit()
+        self._import_legacy()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._next_poll: Dict[str, float] = {}
+        self._intervals: Dict[str, float] = {}
+        self._api_keys: Dict[str, str] = {}     # 只保存在内存中, 不落盘
+        self._poller: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    # --- 持久化 ---
+
+    def _load(self, job_key: str) -> Optional[Dict[str, Any]]:
+        """从数据库读取最新记录 (其他进程可能已经更新过), 并刷新内存中的副本"""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT task_id, status, submitted_at, finished_at, result FROM jobs WHERE job_key = ?",
+                (job_key,),
+            ).fetchone()
+        if row is None:
+            self._jobs.pop(job_key, None)
+            return None
+        task_id, status, submitted_at, finished_at, result = row
+        job = self._jobs.setdefault(job_key, {})
+        job.update(task_id=task_id, status=status, submitted_at=submitted_at, finished_at=finished_at)
+        if result:
+            job["result"] = json.loads(result)
+        else:
+            job.pop("result", None)
+        return job
+
+    def _save(self, job_key: str):
+        """只写入这一条记录; 不会覆盖其他进程写入的任务"""
+        job = self._jobs[job_key]
+        result = job.get("result")
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (job_key, task_id, status, submitted_at, finished_at, result) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_key, job["task_id"], job["status"], job["submitted_at"], job.get("finished_at"),
+                 json.dumps(result, ensure_ascii=False) if result else None),
+            )
+            self._db.commit()
+
+    def _import_legacy(self):
+        if not LEGACY_JOB_FILE.exists():
+            return
+        try:
+            with open(LEGACY_JOB_FILE, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[I2VJobs] 旧任务记录读取失败, 忽略: {e}")
+            return
+        with self._db_lock:
+            for job_key, job in legacy.items():
+                result = job.get("result")
+                # 旧记录没有 finished_at: 不写入, 过期判断时按 submitted_at 计算
+                self._db.execute(
+                    "INSERT OR IGNORE INTO jobs (job_key, task_id, status, submitted_at, finished_at, result) "
+                    "VALUES (?, ?, ?, ?, NULL, ?)",
+                    (job_key, job["task_id"], job["status"], job.get("submitted_at", 0),
+                     json.dumps(result, ensure_ascii=False) if result else None),
+                )
+            self._db.commit()
+        os.replace(LEGACY_JOB_FILE, LEGACY_JOB_FILE.with_suffix(".json.imported"))
+        print(f"[I2VJobs] 已导入 {len(legacy)} 条旧任务记录")
+
+    @staticmethod
+    def _reusable(job: Optional[Dict[str, Any]]) -> bool:
+        if job is None or job["status"] in ("FAILED", "CANCELED", "UNKNOWN"):
+            return False
+        if job["status"] == "SUCCEEDED":
+            finished_at = job.get("finished_at") or job.get("submitted_at") or 0
+            return time.time() - finished_at < I2V_RESULT_TTL
+        return True
+
+    # --- 对外接口 ---
+
+    async def submit(self, job_key: str, api_key: str, **call_kwargs) -> str:
+        """提交 I2V 任务, 返回 task_id; 若该 job_key 已有未失败的任务则直接复用"""
+        job = self._load(job_key)
+        if self._reusable(job):
+            print(f"[I2VJobs] Resume job {job_key} (task_id={job['task_id']}, status={job['status']})")
+            return job["task_id"]
+
+        rsp = await asyncio.to_thread(VideoSynthesis.async_call, api_key=api_key, **call_kwargs)
+        if rsp.status_code != HTTPStatus.OK:
+            raise I2VJobError(job_key, rsp.code, rsp.message, rsp.status_code)
+
+        self._jobs[job_key] = {
+            "task_id": rsp.output.task_id,
+            "status": rsp.output.task_status,
+            "submitted_at": time.time(),
+        }
+        self._save(job_key)
+        print(f"[I2VJobs] Submitted job {job_key} (task_id={rsp.output.task_id})")
+        return rsp.output.task_id
+
+    async def wait(self, job_key: str, api_key: str) -> Dict[str, Any]:
+        """等待任务完成, 返回 {"video_url", "actual_prompt"}"""
+        job = self._jobs.get(job_key) or self._load(job_key)
+        if job is None:
+            raise KeyError(f"I2V job {job_key} 尚未提交")
+        if job["status"] == "SUCCEEDED":
+            return job["result"]
+
+        future = self._futures.get(job_key)
+        if future is None or future.done():
+            future = asyncio.get_running_loop().create_future()
+            self._futures[job_key] = future
+            self._intervals[job_key] = TASK_POLL_INTERVAL
+            self._next_poll[job_key] = time.monotonic()
+        self._api_keys[job_key] = api_key
+        self._ensure_poller()
+        return await asyncio.shield(future)
+
+    async def run(self, job_key: str, api_key: str, **call_kwargs) -> Dict[str, Any]:
+        """submit + wait"""
+        await self.submit(job_key, api_key, **call_kwargs)
+        return await self.wait(job_key, api_key)
+
+    def invalidate(self, job_key: str):
+        """作废一条记录 (例如 video_url 已过期导致下载失败), 下次 submit 会重新提交任务"""
+        with self._db_lock:
+            self._db.execute("DELETE FROM jobs WHERE job_key = ?", (job_key,))
+            self._db.commit()
+        self._jobs.pop(job_key, None)
+        print(f"[I2VJobs] Invalidated job {job_key}")
+
+    # --- 轮询器 ---
+
+    def _ensure_poller(self):
+        if self._poller is None or self._poller.done():
+            self._wakeup = asyncio.Event()
+            self._poller = asyncio.get_running_loop().create_task(self._poll_loop())
+        else:
+            self._wakeup.set()
+
+    async def _poll_loop(self):
+        """唯一的轮询协程: 只 fetch 到期的任务, 没有等待者时退出"""
+        while self._futures:
+            now = time.monotonic()
+            due = [k for k in self._futures if self._next_poll[k] <= now]
+            if due:
+                await asyncio.gather(*(self._poll_one(k) for k in due))
+                continue
+
+            sleep_for = min(self._next_poll[k] for k in self._futures) - now
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(sleep_for, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll_one(self, job_key: str):
+        job = self._jobs[job_key]
+        try:
+            rsp = await asyncio.to_thread(VideoSynthesis.fetch, job["task_id"], api_key=self._api_keys.get(job_key))
+        except Exception as e:
+            # 网络抖动等: 退避后重试, 不让单次 fetch 失败影响整个任务
+            print(f"[I2VJobs] fetch {job_key} error: {e}")
+            rsp = None
+
+        if rsp is not None and rsp.status_code == HTTPStatus.OK:
+            job["status"] = rsp.output.task_status
+            if job["status"] in FINAL_STATUSES:
+                job["finished_at"] = time.time()
+            if job["status"] == "SUCCEEDED":
+                job["result"] = {
+                    "video_url": rsp.output.video_url,
+                    "actual_prompt": getattr(rsp.output, "actual_prompt", None),
+                }
+            # 先落盘再唤醒等待者, 等待者随后读到的就是最新状态
+            self._save(job_key)
+            if job["status"] == "SUCCEEDED":
+                self._finish(job_key, result=job["result"])
+                return
+            if job["status"] in FINAL_STATUSES:
+                self._finish(job_key, error=I2VJobError(job_key, rsp.output.get("code"), rsp.output.get("message")))
+                return
+        elif rsp is not None:
+            self._finish(job_key, error=I2VJobError(job_key, rsp.code, rsp.message, rsp.status_code))
+            return
+
+        # 未完成: 指数退避
+        interval = min(self._intervals[job_key] * TASK_POLL_BACKOFF, TASK_POLL_MAX_INTERVAL)
+        self._intervals[job_key] = interval
+        self._next_poll[job_key] = time.monotonic() + interval
+
+    def _finish(self, job_key: str, result: Dict[str, Any] = None, error: Exception = None):
+        future = self._futures.pop(job_key)
+        self._next_poll.pop(job_key, None)
+        self._intervals.pop(job_key, None)
+        self._api_keys.pop(job_key, None)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+_job_manager: Optional[I2VJobManager] = None
+
+def get_i2v_job_manager() -> I2VJobManager:
+    """进程内共享一个 I2VJobManager, 保证只有一个轮询器"""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = I2VJobManager()
+    return _job_manager
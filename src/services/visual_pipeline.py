@@ -0,0 +1,177 @@
+# 视觉阶段的流水线: 生图 / VLM 校验 / 图生视频各自一个有界队列 + worker 池, 不同 Provider 的配额同时保持忙碌
+import os
+import time
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from src.services.tracing import span
+from src.services.artifact_store import current_run_id
+from src.services.rate_limiter import concurrency_limit
+
+# 各阶段的 worker 数 (同时在途的 Provider 请求数) 与队列深度 (排队等待的任务数上限, 满了之后提交方会等待)
+IMAGE_WORKERS = int(os.getenv("PIPELINE_IMAGE_WORKERS", "4"))
+VLM_WORKERS = int(os.getenv("PIPELINE_VLM_WORKERS", "8"))
+# I2V 的上限是有意为之: 一个 video 配额从提交任务一直占用到轮询结束 (DashScope 按账号限制同时运行的异步任务数),
+# 因此同时在途的 I2V 任务数由 rate_limiter 的 video 并发配额 (RATE_LIMIT_VIDEO_CONCURRENCY, 默认 4) 决定;
+# worker 数默认与之相同, 多出来的 worker 只会在配额上排队。配额不限 (0) 时默认 I2V_UNLIMITED_WORKERS 个 worker
+I2V_UNLIMITED_WORKERS = 32
+I2V_WORKERS = int(os.getenv("PIPELINE_I2V_WORKERS", "0")) or \
+    concurrency_limit("video", os.getenv("VIDEO_MODEL_NAME")) or I2V_UNLIMITED_WORKERS
+PIPELINE_QUEUE_DEPTH = int(os.getenv("PIPELINE_QUEUE_DEPTH", "16"))
+
+
+class PipelineStage:
+    """
+    一个流水线阶段: submit() 把协程函数放进有界队列, 由固定数量的 worker 依次执行, 返回执行结果。
+    镜头在阶段之间流动: 镜头 N 占用 I2V worker 时, 镜头 N+1 可以同时占用生图 worker。
+    队列和 worker 绑定在第一次使用时的事件循环上, 换了事件循环 (例如批量任务多次 asyncio.run) 会自动重建。
+    任务在提交方的 contextvars 上下文中执行 (例如 rate_limiter 的请求优先级)。
+    提交方被取消时, 排队中的任务不再执行, 正在执行的任务也会被取消, worker 立即空出来。
+    阶段由进程内所有运行共享, 统计按 run_id 分开记录 (批量任务中同时进行的运行互不混淆)。
+    """
+    def __init__(self, name: str, workers: int, queue_depth: int = PIPELINE_QUEUE_DEPTH):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_depth = queue_depth
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _run_stats(self, run_id: str) -> Dict[str, float]:
+        stats = self._stats.get(run_id)
+        if stats is None:
+            stats = self._stats[run_id] = {
+                "started_at": time.perf_counter(), "processed": 0, "failed": 0, "cancelled": 0,
+                "busy": 0, "max_queue": 0, "busy_time": 0.0, "wait_time": 0.0,
+            }
+        return stats
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.queue_depth)
+        self._stats.clear()
+        for index in range(self.workers):
+            loop.create_task(self._worker(), name=f"{self.name}-worker-{index}")
+
+    async def submit(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        self._ensure_started()
+        future = self._loop.create_future()
+        context = contextvars.copy_context()
+        run_id = current_run_id()
+        stats = self._run_stats(run_id)
+        await self._queue.put((fn, args, kwargs, context, future, run_id, time.perf_counter()))
+        stats["max_queue"] = max(stats["max_queue"], self._queue.qsize())
+        return await future
+
+    async def _run(self, fn: Callable[..., Awaitable[Any]], args, kwargs, queue_wait: float) -> Any:
+        with span(f"pipeline.{self.name}", "pipeline", queue_wait=round(queue_wait, 3)):
+            return await fn(*args, **kwargs)
+
+    async def _worker(self):
+        while True:
+            fn, args, kwargs, context, future, run_id, enqueued_at = await self._queue.get()
+            stats = self._run_stats(run_id)
+            # 提交方在排队期间被取消 (await future 被取消时 future 也随之取消): 直接丢弃
+            if future.cancelled():
+                stats["cancelled"] += 1
+                self._queue.task_done()
+                continue
+            started_at = time.perf_counter()
+            stats["wait_time"] += started_at - enqueued_at
+            stats["busy"] += 1
+            task = asyncio.create_task(self._run(fn, args, kwargs, started_at - enqueued_at), context=context)
+            # 提交方在执行期间被取消: 同时取消正在执行的任务, 不再占用 worker 和 Provider 配额
+            def cancel_task(f: asyncio.Future, task: asyncio.Task = task):
+                if f.cancelled():
+                    task.cancel()
+            future.add_done_callback(cancel_task)
+            try:
+                result = await task
+                if not future.done():
+                    future.set_result(result)
+                stats["processed"] += 1
+            except asyncio.CancelledError:
+                # worker 自身被取消 (事件循环关闭) 时向上传播; 只是任务被取消则继续处理下一个
+                if asyncio.current_task().cancelling():
+                    raise
+                stats["cancelled"] += 1
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                stats["failed"] += 1
+            finally:
+                future.remove_done_callback(cancel_task)
+                stats["busy"] -= 1
+                stats["busy_time"] += time.perf_counter() - started_at
+                self._queue.task_done()
+
+    def stats(self, run_id: Optional[str] = None) -> Dict[str, Any]:
+        """某次运行 (默认当前 run_id) 在本阶段的统计
+        queue: 当前排队数 (整个阶段); utilization: 该运行的 worker 忙碌时间 / (worker 数 * 该运行首次提交至今的时长)
+        """
+        stats = self._stats.get(run_id or current_run_id())
+        queue = self._queue.qsize() if self._queue else 0
+        if stats is None:
+            return {"workers": self.workers, "queue": queue, "max_queue": 0, "busy": 0, "processed": 0,
+                    "failed": 0, "cancelled": 0, "utilization": 0.0, "avg_wait": 0.0}
+        elapsed = time.perf_counter() - stats["started_at"]
+        done = stats["processed"] + stats["failed"]
+        return {
+            "workers": self.workers,
+            "queue": queue,
+            "max_queue": stats["max_queue"],
+            "busy": stats["busy"],
+            "processed": stats["processed"],
+            "failed": stats["failed"],
+            "cancelled": stats["cancelled"],
+            "utilization": stats["busy_time"] / (self.workers * elapsed) if elapsed > 0 else 0.0,
+            "avg_wait": stats["wait_time"] / done if done else 0.0,
+        }
+
+    def forget(self, run_id: Optional[str] = None):
+        """运行结束后丢弃它的统计 (仍有任务在途时保留)"""
+        run_id = run_id or current_run_id()
+        stats = self._stats.get(run_id)
+        if stats is not None and not stats["busy"]:
+            del self._stats[run_id]
+
+
+class VisualPipeline:
+    """visual_node 使用的三个阶段; 每个镜头的生成-校验-重试逻辑不变, 只是每一步都在对应阶段的 worker 上执行"""
+    def __init__(self):
+        self.image = PipelineStage("image", IMAGE_WORKERS)
+        self.vlm = PipelineStage("vlm", VLM_WORKERS)
+        self.i2v = PipelineStage("i2v", I2V_WORKERS)
+
+    @property
+    def stages(self):
+        return [self.image, self.vlm, self.i2v]
+
+    def stats(self, run_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        return {stage.name: stage.stats(run_id) for stage in self.stages}
+
+    def report(self, run_id: Optional[str] = None) -> str:
+        lines = []
+        for name, s in self.stats(run_id).items():
+            lines.append(f"[Pipeline] {name:<5} workers={s['workers']} processed={s['processed']} failed={s['failed']} "
+                         f"cancelled={s['cancelled']} queue={s['queue']} (max {s['max_queue']}) "
+                         f"util={s['utilization']:.0%} avg_wait={s['avg_wait']:.1f}s")
+        return "\n".join(lines)
+
+    def forget(self, run_id: Optional[str] = None):
+        for stage in self.stages:
+            stage.forget(run_id)
+
+
+_visual_pipeline: Optional[VisualPipeline] = None
+
+
+def get_visual_pipeline() -> VisualPipeline:
+    global _visual_pipeline
+    if _visual_pipeline is None:
+        _visual_pipeline = VisualPipeline()
+    return _visual_pipeline
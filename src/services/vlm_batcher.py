@@ -0,0 +1,84 @@
+# VLM 校验请求的微批处理: 把并发镜头在一个短时间窗口内提交的校验请求合并为一次批量调用
+import os
+import asyncio
+from typing import TYPE_CHECKING, List, Tuple, Dict, Any, Optional, Set
+
+if TYPE_CHECKING:
+    from src.services.llm_service import LLMService
+
+# 单个批次最多包含的图片数, 以及等待凑批的时间窗口(秒)
+VLM_BATCH_SIZE = int(os.getenv("VLM_BATCH_SIZE", "8"))
+VLM_BATCH_WINDOW = float(os.getenv("VLM_BATCH_WINDOW", "2.0"))
+
+
+class VLMBatcher:
+    """
+    visual_node 按镜头并发执行, 各镜头第一次生图的完成时间很接近;
+    validate() 把请求放进队列, 凑满 max_batch 或等满 window 秒后统一调用 avalidate_images_batch。
+    待发送的请求和计时器绑定在当前事件循环上, 换了事件循环 (例如批量任务多次 asyncio.run) 会自动重建。
+    """
+    def __init__(self, llm_service: "LLMService", max_batch: int = VLM_BATCH_SIZE, window: float = VLM_BATCH_WINDOW):
+        self.llm_service = llm_service
+        self.max_batch = max_batch
+        self.window = window
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: List[Tuple[str, str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 事件循环只弱引用 task, 批量请求在这里保持引用直到结束
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 上一个事件循环留下的请求/计时器/任务已经无法继续 (循环已结束), 直接丢弃
+            if self._timer is not None:
+                self._timer.cancel()
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+            self._tasks = set()
+        return loop
+
+    async def validate(self, image_path: str, prompt: str) -> Dict[str, Any]:
+        loop = self._ensure_loop()
+        future = loop.create_future()
+        self._pending.append((image_path, prompt, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = self._loop.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, str, asyncio.Future]]):
+        items = [(image_path, prompt) for image_path, prompt, _ in batch]
+        print(f"[VLM Batch] Validating {len(items)} images in one request")
+        try:
+            if len(items) == 1:
+                results = [await self.llm_service.avalidate_image_quality(*items[0])]
+            else:
+                results = await self.llm_service.avalidate_images_batch(items)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # 每个镜头只拿自己的结果: 单图回退失败的镜头收到自己的异常, 其他镜头照常拿到校验结果
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,24 @@
+# 音频后处理
+import os
+import subprocess
+
+from src.utils.media_probe import FFMPEG_BINARY
+
+
+def trim_silence(path: str, threshold_db: float = -45.0, keep: float = 0.05) -> str:
+    """原地裁掉首尾静音 (低于 threshold_db 的部分), 两端各保留 keep 秒, 避免字音被切掉
+    尾部用 areverse 翻转后再做一次开头裁剪; 失败时保留原文件。
+    """
+    trim = f"silenceremove=start_periods=1:start_threshold={threshold_db}dB:start_silence={keep}"
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.trim{ext}"
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", "-i", path,
+           "-af", f"{trim},areverse,{trim},areverse", tmp_path]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0 or not os.path.exists(tmp_path) or os.path.getsize(tmp_path) == 0:
+        print(f"[Audio] 静音裁剪失败, 保留原音频 {path}: {result.stderr.strip()[-500:]}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return path
+    os.replace(tmp_path, path)
+    return path
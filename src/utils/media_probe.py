@@ -0,0 +1,159 @@
+# 媒体文件信息探测 (时长、是否含音轨)
+import os
+import re
+import json
+import struct
+import shutil
+import subprocess
+from typing import Optional, Dict, Any
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def probe(path: str) -> Dict[str, Any]:
+    """返回 {"duration": float | None, "has_audio": bool, "has_video": bool}
+    优先用 ffprobe; 环境中只有 ffmpeg (例如 imageio-ffmpeg 自带的二进制) 时解析 `ffmpeg -i` 的输出。
+    """
+    if shutil.which(FFPROBE_BINARY):
+        out = subprocess.run(
+            [FFPROBE_BINARY, "-v", "error", "-show_entries", "format=duration:stream=codec_type",
+             "-of", "json", path],
+            capture_output=True, text=True,
+        )
+        if out.returncode == 0:
+            info = json.loads(out.stdout or "{}")
+            types = {s.get("codec_type") for s in info.get("streams", [])}
+            duration = info.get("format", {}).get("duration")
+            return {
+                "duration": float(duration) if duration not in (None, "N/A") else None,
+                "has_audio": "audio" in types,
+                "has_video": "video" in types,
+            }
+
+    # ffmpeg -i 没有输出文件时返回码非 0, 信息在 stderr 中
+    out = subprocess.run([FFMPEG_BINARY, "-hide_banner", "-i", path], capture_output=True, text=True)
+    match = _DURATION_RE.search(out.stderr)
+    duration = None
+    if match:
+        hours, minutes, seconds = match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    return {
+        "duration": duration,
+        "has_audio": "Audio:" in out.stderr,
+        "has_video": "Video:" in out.stderr,
+    }
+
+
+def probe_duration(path: str) -> Optional[float]:
+    return probe(path)["duration"]
+
+
+# ---------- 音频时长: 直接解析文件头, 不启动子进程 ----------
+
+# MPEG 音频帧头的码率表 (kbps), 下标为 bitrate_index
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],   # MPEG1 Layer I
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],      # MPEG1 Layer II
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],       # MPEG1 Layer III
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],      # MPEG2/2.5 Layer I
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],           # MPEG2/2.5 Layer II/III
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _mp3_duration(data: bytes) -> Optional[float]:
+    """逐帧累加采样数, CBR/VBR 都准确"""
+    pos = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+
+    seconds, frames, gapless_samples, sample_rate = 0.0, 0, 0, None
+    first_frame = True
+    while pos + 4 <= len(data):
+        b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+        if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+            pos += 1    # 丢失同步 (例如中间夹着标签), 向后重新寻找帧头
+            continue
+        version, layer = (b1 >> 3) & 0x03, 4 - ((b1 >> 1) & 0x03)
+        bitrate_index, rate_index, padding = b2 >> 4, (b2 >> 2) & 0x03, (b2 >> 1) & 0x01
+        if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+            pos += 1
+            continue
+
+        mpeg1 = version == 3
+        table = _MP3_BITRATES[(1, layer)] if mpeg1 else _MP3_BITRATES[(2, 1 if layer == 1 else 2)]
+        bitrate = table[bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        if layer == 1:
+            samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 1152 if (mpeg1 or layer == 2) else 576
+            length = samples // 8 * bitrate // sample_rate + padding
+        if first_frame:
+            # 第一帧可能是 Xing/Info 头 (不含音频), 其中的 LAME 扩展记录了编码器填充的静音采样数
+            first_frame = False
+            tag = _xing_gapless(data[pos:pos + length], mpeg1, b3 >> 6 == 3)
+            if tag is not None:
+                gapless_samples = tag
+                pos += length
+                continue
+        seconds += samples / sample_rate
+        frames += 1
+        pos += length
+    if not frames:
+        return None
+    return max(seconds - gapless_samples / sample_rate, 0.0)
+
+
+def _xing_gapless(frame: bytes, mpeg1: bool, mono: bool) -> Optional[int]:
+    """frame 是 Xing/Info 头时返回编码器首尾填充的采样数 (没有 LAME 扩展时为 0), 否则返回 None"""
+    offset = 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))
+    if frame[offset:offset + 4] not in (b"Xing", b"Info"):
+        return None
+    flags = struct.unpack(">I", frame[offset + 4:offset + 8])[0]
+    lame = offset + 8 + (4 if flags & 0x1 else 0) + (4 if flags & 0x2 else 0) + \
+        (100 if flags & 0x4 else 0) + (4 if flags & 0x8 else 0)
+    if len(frame) < lame + 24 or not frame[lame:lame + 4].isalpha():
+        return 0
+    delay = (frame[lame + 21] << 4) | (frame[lame + 22] >> 4)
+    padding = ((frame[lame + 22] & 0x0F) << 8) | frame[lame + 23]
+    return delay + padding
+
+
+def _wav_duration(data: bytes) -> Optional[float]:
+    """解析 RIFF 块: data 块字节数 / fmt 块中的 byte_rate"""
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    pos, byte_rate = 12, None
+    while pos + 8 <= len(data):
+        chunk_id, chunk_size = data[pos:pos + 4], struct.unpack("<I", data[pos + 4:pos + 8])[0]
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack("<I", data[pos + 16:pos + 20])[0]
+        elif chunk_id == b"data" and byte_rate:
+            # 流式写出的 wav 可能把 data 大小写成 0 或 0xFFFFFFFF, 以实际剩余字节为准
+            available = len(data) - pos - 8
+            if chunk_size == 0 or chunk_size > available:
+                chunk_size = available
+            return chunk_size / byte_rate
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def audio_duration(path: str) -> Optional[float]:
+    """音频实际时长 (秒): MP3/WAV 直接解析文件头, 其他格式或解析失败时用 ffprobe"""
+    ext = os.path.splitext(path)[1].lower()
+    duration = None
+    if ext in (".mp3", ".wav"):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            duration = _mp3_duration(data) if ext == ".mp3" else _wav_duration(data)
+        except (OSError, struct.error, IndexError) as e:
+            print(f"[MediaProbe] 解析音频头失败 {path}: {e}")
+    if not duration:
+        duration = probe_duration(path)
+    return duration
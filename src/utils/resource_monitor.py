@@ -0,0 +1,92 @@
+# 渲染期间的内存监控: 后台线程采样本进程及其子进程 (ffmpeg reader/encoder、分段渲染的 worker) 的 RSS, 记录峰值
+import os
+import threading
+from typing import Optional
+
+RSS_SAMPLE_INTERVAL = float(os.getenv("RSS_SAMPLE_INTERVAL", "0.2"))
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _read_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _children(pid: int):
+    task_dir = f"/proc/{pid}/task"
+    try:
+        tids = os.listdir(task_dir)
+    except OSError:
+        return []
+    children = []
+    for tid in tids:
+        try:
+            with open(f"{task_dir}/{tid}/children", "r") as f:
+                children.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return children
+
+
+def process_tree_rss(pid: Optional[int] = None) -> int:
+    """pid 及其所有后代进程的 RSS 之和 (字节); 依赖 /proc, 其他平台返回 0"""
+    pid = pid or os.getpid()
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += _read_rss(current)
+        stack.extend(_children(current))
+    return total
+
+
+def _max_rss_fallback() -> int:
+    """没有 /proc 时退化为 getrusage 的进程生命周期峰值 (只含本进程)"""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位是 KB, macOS 是字节
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class PeakRSSMonitor:
+    """
+    with PeakRSSMonitor() as monitor:
+        ...  # 渲染
+    print(monitor.peak_mb)
+    """
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._use_proc = os.path.exists(f"/proc/{os.getpid()}/statm")
+
+    @property
+    def peak_mb(self) -> float:
+        return self.peak_bytes / (1024 * 1024)
+
+    def sample(self):
+        rss = process_tree_rss() if self._use_proc else _max_rss_fallback()
+        self.peak_bytes = max(self.peak_bytes, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> "PeakRSSMonitor":
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="rss-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        return False
@@ -1,14 +1,87 @@
+import io
+import os
 import mimetypes
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+# VLM 校验前的图片预处理: 长边缩放到 VLM_IMAGE_MAX_EDGE, 以 JPEG(VLM_IMAGE_QUALITY) 重新编码
+VLM_IMAGE_MAX_EDGE = int(os.getenv("VLM_IMAGE_MAX_EDGE", "768"))
+VLM_IMAGE_QUALITY = int(os.getenv("VLM_IMAGE_QUALITY", "85"))
+
+# 每次读 3 的整数倍字节, 分块 base64 编码后拼接的结果与一次性编码完全一致
+_B64_CHUNK_SIZE = 3 * 64 * 1024
+
+# 已编码的 payload: (文件 sha256, max_edge, quality) -> data url
+_ENCODED_CACHE_SIZE = 64
+_encoded_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_encoded_cache_lock = threading.Lock()
 
 
 def encode_image(img_path: str):
-    mime_type = mimetypes.guess_type(img_path)  # 判断文件类型
+    mime_type, _ = mimetypes.guess_type(img_path)  # 判断文件类型
     if not mime_type:  # 如果img_path没有后缀，则默认为jpeg类型
         mime_type = "image/jpeg"
 
     with open(img_path, 'rb') as image_file:
-        base64_data = base64.b64encode(image_file.read()).decode('utf-8')
+        # 返回 OpenAI 格式要求的 Data URL
+        return _stream_data_url(image_file, mime_type, os.fstat(image_file.fileno()).st_size)
+
+
+def prepare_image_for_upload(img_path: str, max_edge: int = VLM_IMAGE_MAX_EDGE, quality: int = VLM_IMAGE_QUALITY) -> str:
+    """为 VLM 上传准备图片: 缩放 + JPEG 重编码 + base64, 按文件内容 hash 缓存结果
+    同一张图被多次校验(重试、批量校验回退到单图)时只编码一次。
+    """
+    key = (file_sha256(img_path), max_edge, quality)
+    with _encoded_cache_lock:
+        if key in _encoded_cache:
+            _encoded_cache.move_to_end(key)
+            return _encoded_cache[key]
+
+    from PIL import Image
+
+    with Image.open(img_path) as img:
+        # JPEG 源文件可以直接以缩小的尺寸解码, 省掉全尺寸解码
+        img.draft("RGB", (max_edge, max_edge))
+        img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    # 缩放后的 JPEG 只有几百 KB, 编码期间与 data url 同时存在
+    size = buffer.tell()
+    buffer.seek(0)
+    data_url = _stream_data_url(buffer, "image/jpeg", size)
+
+    with _encoded_cache_lock:
+        _encoded_cache[key] = data_url
+        if len(_encoded_cache) > _ENCODED_CACHE_SIZE:
+            _encoded_cache.popitem(last=False)
+    return data_url
+
+
+def _stream_data_url(fileobj, mime_type: str, size: int) -> str:
+    """分块读取并 base64 编码, 返回 data url; size 为 fileobj 剩余的字节数
+    编码结果按最终长度预先分配 bytearray, 逐块写入原位, 不会因为拼接反复复制;
+    最后 decode 成 str 时编码结果会短暂存在两份 (bytearray 与返回的 str), 原始字节只按块读取。
+    """
+    prefix = f"data:{mime_type};base64,".encode('ascii')
+    out = bytearray(len(prefix) + 4 * ((size + 2) // 3))
+    out[:len(prefix)] = prefix
+    pos = len(prefix)
+    for chunk in iter(lambda: fileobj.read(_B64_CHUNK_SIZE), b''):
+        encoded = base64.b64encode(chunk)
+        out[pos:pos + len(encoded)] = encoded
+        pos += len(encoded)
+    # 读取期间文件变短时截掉多余的预分配部分
+    del out[pos:]
+    return out.decode('ascii')
+
 
-    # 返回 OpenAI 格式要求的 Data URL
-    return f"data:{mime_type};base64,{base64_data}"
\ No newline at end of file
+def file_sha256(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """计算文件内容的 sha256 (分块读取, 不把整个文件读入内存)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -28,6 +28,30 @@ vlm_system_message = """你是一名图像质量与文本一致性评估专家
 }
 """
 
+# VLM批量校验的System_Message: 一次请求包含多组 (prompt, 图像), 逐张输出与 vlm_system_message 相同的字段
+vlm_batch_system_message = """你是一名图像质量与文本一致性评估专家。
+
+你将接收到多组待评估内容, 每组以 "[编号] Prompt: ..." 开头, 后面紧跟该 prompt 生成的图像。
+请对每一组独立评估, 不要让不同组之间互相影响：
+- 判断图像与文本 prompt 的匹配程度（语义一致性、物体、属性、数量、关系、风格等）
+- 评估图像的视觉质量（清晰度、瑕疵、构图、逼真度或风格一致性）
+- 识别明显错误（缺失元素、错误属性、数量不符、内容畸变、失真、文字错误等）
+
+请严格按照以下 JSON 数组格式输出, 数组中每个元素对应一组, 按编号顺序排列, 不要添加多余内容：
+
+[
+  {
+    "index": <组的编号>,
+    "prompt_image_alignment_score": <1-10 的整数>,
+    "visual_quality_score": <1-10 的整数>,
+    "is_prompt_satisfied": <true 或 false>,
+    "problems": ["问题1的简短描述"],
+    "positive_aspects": ["优点1的简短描述"],
+    "overall_comment": "一到两句简洁的总结性评价"
+  }
+]
+"""
+
 # 文+图 生成 视频的prompt
 ## 正面提示词
 video_gen_prompt = """
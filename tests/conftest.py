@@ -0,0 +1,7 @@
+# 直接运行 pytest (而不是 python -m pytest) 时仓库根目录不在 sys.path 上, 这里补上以便 import src / batch
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
@@ -0,0 +1,75 @@
+# batch.py 的任务解析与 thread 选择; 用假的 app 代替 LangGraph, 不执行工作流
+import json
+import asyncio
+from types import SimpleNamespace
+
+from batch import BatchRunner, load_jobs, validate_user_params, job_id_of
+
+
+class FakeApp:
+    """按 thread_id 返回预设的检查点快照; 没有预设的 thread 视为全新 (空快照)"""
+    def __init__(self, snapshots):
+        self.snapshots = snapshots
+        self.queried = []
+
+    async def aget_state(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        self.queried.append(thread_id)
+        values, next_nodes = self.snapshots.get(thread_id, ({}, ()))
+        return SimpleNamespace(values=values, next=next_nodes)
+
+
+def _resolve(snapshots, job, run_id="batch-j", attempt=0):
+    app = FakeApp(snapshots)
+    runner = BatchRunner(app, writer=None)
+    return asyncio.run(runner._resolve_thread(job, run_id, attempt)), app.queried
+
+
+def test_unfinished_checkpoint_keeps_thread():
+    resolved, _ = _resolve({"batch-j": ({"topic": "t"}, ("visual_node",))}, {"id": "j"})
+    assert resolved == ("batch-j", 0)
+
+
+def test_finished_checkpoint_with_video_is_reused():
+    resolved, _ = _resolve({"batch-j": ({"final_video_path": "out.mp4"}, ())}, {"id": "j"})
+    assert resolved == ("batch-j", 0)
+
+
+def test_finished_checkpoint_without_video_starts_fresh_thread():
+    snapshots = {"batch-j": ({"final_video_path": ""}, ()),
+                 "batch-j-1": ({"final_video_path": ""}, ())}
+    resolved, queried = _resolve(snapshots, {"id": "j"})
+    assert resolved == ("batch-j-2", 2)
+    assert queried == ["batch-j", "batch-j-1", "batch-j-2"]
+
+
+def test_rerun_replaces_finished_checkpoint():
+    resolved, _ = _resolve({"batch-j": ({"final_video_path": "out.mp4"}, ())}, {"id": "j", "rerun": True})
+    assert resolved == ("batch-j-1", 1)
+
+
+def test_validate_user_params():
+    assert validate_user_params(None) is None
+    assert validate_user_params({"export_profile": "draft", "ratio": "9:16"}) is None
+    assert validate_user_params(["16:9"]) == "user_params must be a JSON object"
+    assert "no-such-profile" in validate_user_params({"export_profile": "no-such-profile"})
+
+
+def test_load_jobs_flags_invalid_lines_and_skips_duplicates(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    lines = [
+        json.dumps({"topic": "a", "user_params": {"ratio": "16:9"}}),
+        "# comment",
+        "{not json",
+        json.dumps(["a list"]),
+        json.dumps({"id": "bad-profile", "topic": "b", "user_params": {"export_profile": "huge"}}),
+        json.dumps({"topic": "a", "user_params": {"ratio": "16:9"}}),
+    ]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    jobs = load_jobs(str(path))
+    assert [job["id"] for job in jobs] == [job_id_of({"topic": "a", "user_params": {"ratio": "16:9"}}),
+                                           "line-3", "line-4", "bad-profile"]
+    assert jobs[0]["error"] is None
+    assert jobs[1]["error"].startswith("invalid JSON")
+    assert jobs[2]["error"] == "job must be a JSON object"
+    assert "huge" in jobs[3]["error"]
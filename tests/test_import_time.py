@@ -0,0 +1,45 @@
+# 启动耗时预算: 批量任务的短命 worker 进程每次都要 import main 并构建图, 这一步必须快且没有副作用
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+# 在干净的子进程里测量 (不受本进程已经 import 过的模块影响), 共享 CI 机器上较慢, 可用环境变量放宽
+IMPORT_TIME_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", "3"))
+# 这些模块只应在真正调用 Provider / 渲染时才加载
+HEAVY_MODULES = ("dashscope", "moviepy", "langchain_openai", "PIL")
+
+PROBE = """
+import sys, json, time
+started = time.perf_counter()
+import main
+main.build_app()
+elapsed = time.perf_counter() - started
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def _probe(cwd: Path) -> dict:
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT))
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=cwd, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_build_app_within_budget(tmp_path):
+    report = _probe(tmp_path)
+    assert report["elapsed"] < IMPORT_TIME_BUDGET, f"import main + build_app() took {report['elapsed']:.2f}s"
+
+
+def test_build_app_defers_heavy_imports(tmp_path):
+    modules = set(_probe(tmp_path)["modules"])
+    loaded = [name for name in HEAVY_MODULES if name in modules]
+    assert not loaded, f"loaded at import time: {loaded}"
+
+
+def test_build_app_has_no_filesystem_side_effects(tmp_path):
+    _probe(tmp_path)
+    assert list(tmp_path.iterdir()) == []
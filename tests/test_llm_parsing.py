@@ -0,0 +1,65 @@
+# LLMService 的输出解析: 分镜条目修复、VLM 单图/批量校验结果解析 (不调用模型)
+import json
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+pytest.importorskip("langchain")
+
+from src.services.llm_service import LLMService, SPEECH_CHARS_PER_SECOND
+
+PASSING = {"prompt_image_alignment_score": 8, "visual_quality_score": 7, "is_prompt_satisfied": True,
+           "positive_aspects": ["sharp"]}
+FAILING = {"prompt_image_alignment_score": 3, "visual_quality_score": 4, "is_prompt_satisfied": False,
+           "problems": ["blurry"], "overall_comment": "regenerate"}
+
+
+def test_repair_item_accepts_valid_item():
+    raw = {"text_content": "你好", "emotion": "calm", "visual_prompt": "a cat",
+           "visual_tags": ["close-up"], "estimated_duration": 2.5}
+    assert LLMService._repair_item(raw) == raw
+
+
+def test_repair_item_fixes_recoverable_fields():
+    item = LLMService._repair_item({"text_content": " 一二三四五六七八 ", "visual_prompt": "a cat",
+                                    "visual_tags": "close-up，blue; warm", "estimated_duration": "3.5s"})
+    assert item["text_content"] == "一二三四五六七八"
+    assert item["emotion"] == "neutral"
+    assert item["visual_tags"] == ["close-up", "blue", "warm"]
+    assert item["estimated_duration"] == 3.5
+
+
+def test_repair_item_estimates_missing_duration():
+    item = LLMService._repair_item({"text_content": "一二三四五六七八", "visual_prompt": "a cat"})
+    assert item["estimated_duration"] == round(8 / SPEECH_CHARS_PER_SECOND, 1)
+
+
+@pytest.mark.parametrize("raw", [
+    {"text_content": "", "visual_prompt": "a cat"},
+    {"text_content": "你好"},
+    "not a dict",
+])
+def test_repair_item_rejects_unusable_items(raw):
+    assert LLMService._repair_item(raw) is None
+
+
+def test_parse_validation():
+    assert LLMService._parse_validation(json.dumps(PASSING)) == {"passed": True, "reason": ["sharp"]}
+    assert LLMService._parse_validation(json.dumps(FAILING)) == {
+        "passed": False, "reason": ["blurry"], "suggestion": "regenerate"}
+    assert LLMService._parse_validation("no json here")["passed"] is False
+
+
+def test_parse_batch_validation_places_verdicts_by_index():
+    content = "```json\n" + json.dumps([dict(FAILING, index=1), dict(PASSING, index=0)]) + "\n```"
+    verdicts = LLMService._parse_batch_validation(content, 2)
+    assert verdicts[0]["passed"] is True
+    assert verdicts[1]["passed"] is False
+
+
+def test_parse_batch_validation_leaves_bad_entries_for_fallback():
+    content = json.dumps([PASSING, {"index": 1, "visual_quality_score": 9}, dict(PASSING, index=7), "junk"])
+    verdicts = LLMService._parse_batch_validation(content, 3)
+    assert verdicts[0]["passed"] is True
+    assert verdicts[1:] == [None, None]
+    assert LLMService._parse_batch_validation(json.dumps({"index": 0}), 2) == [None, None]
@@ -0,0 +1,59 @@
+# MediaCache: 内容寻址 key 与按最近访问时间的 LRU 淘汰
+import itertools
+
+import pytest
+
+from src.services import media_cache
+from src.services.media_cache import MediaCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """每次取时间都前进 1 秒, 避免同一毫秒内的访问时间相同导致淘汰顺序不确定"""
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(media_cache.time, "time", lambda: float(next(ticks)))
+
+
+def _write(path, size):
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_make_key_uses_reference_content_not_path(tmp_path):
+    a = tmp_path / "a.png"
+    b = tmp_path / "b.png"
+    a.write_bytes(b"same")
+    b.write_bytes(b"same")
+    assert MediaCache.make_key("image", [str(a)], prompt="p") == MediaCache.make_key("image", [str(b)], prompt="p")
+    b.write_bytes(b"changed")
+    assert MediaCache.make_key("image", [str(a)], prompt="p") != MediaCache.make_key("image", [str(b)], prompt="p")
+    assert MediaCache.make_key("image", prompt="p") != MediaCache.make_key("image", prompt="q")
+
+
+def test_hit_materializes_file_with_meta(tmp_path):
+    cache = MediaCache(tmp_path / "cache", max_bytes=100)
+    cache.put("k1", _write(tmp_path / "src.mp3", 10), {"duration": 1.5})
+    dest = tmp_path / "out" / "shot.mp3"
+    assert cache.get("k1", str(dest)) == {"duration": 1.5}
+    assert dest.read_bytes() == b"x" * 10
+    assert cache.get("missing", str(tmp_path / "none.mp3")) is None
+
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    cache = MediaCache(tmp_path / "cache", max_bytes=25)
+    cache.put("a", _write(tmp_path / "a.bin", 10))
+    cache.put("b", _write(tmp_path / "b.bin", 10))
+    assert cache.get("a", str(tmp_path / "a_out.bin")) is not None     # a 比 b 更近被访问
+    cache.put("c", _write(tmp_path / "c.bin", 10))
+    assert cache.get("b", str(tmp_path / "b_out.bin")) is None
+    assert cache.get("a", str(tmp_path / "a_out2.bin")) is not None
+    assert cache.get("c", str(tmp_path / "c_out.bin")) is not None
+
+
+def test_externally_deleted_object_is_a_miss(tmp_path):
+    cache = MediaCache(tmp_path / "cache", max_bytes=100)
+    cache.put("k1", _write(tmp_path / "src.png", 5))
+    for path in (tmp_path / "cache" / "objects").rglob("*.png"):
+        path.unlink()
+    assert cache.get("k1", str(tmp_path / "out.png")) is None
+    assert cache._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0
@@ -0,0 +1,79 @@
+# 音频时长直接解析文件头: MP3 逐帧累加 (扣除 LAME 记录的编码器填充), WAV 读 RIFF 块
+import wave
+import struct
+
+import pytest
+
+from src.utils.media_probe import _mp3_duration, _wav_duration, audio_duration
+
+# MPEG1 Layer III, 128kbps, 44100Hz, 无 padding, 立体声: 每帧 1152 个采样, 417 字节
+_FRAME_HEADER = b"\xff\xfb\x90\x00"
+_FRAME_LENGTH = 1152 // 8 * 128000 // 44100
+_FRAME_SECONDS = 1152 / 44100
+
+
+def _audio_frame() -> bytes:
+    return _FRAME_HEADER + b"\x00" * (_FRAME_LENGTH - 4)
+
+
+def _info_frame(delay: int, padding: int) -> bytes:
+    """Xing/Info 头 (flags=0) 加 LAME 扩展, 立体声 MPEG1 的标签位于帧头后 32 字节"""
+    frame = bytearray(_audio_frame())
+    offset = 4 + 32
+    frame[offset:offset + 8] = b"Info" + struct.pack(">I", 0)
+    lame = offset + 8
+    frame[lame:lame + 4] = b"LAME"
+    frame[lame + 21] = delay >> 4
+    frame[lame + 22] = ((delay & 0x0F) << 4) | (padding >> 8)
+    frame[lame + 23] = padding & 0xFF
+    return bytes(frame)
+
+
+def _id3_tag(payload_size: int) -> bytes:
+    size = bytes([(payload_size >> shift) & 0x7F for shift in (21, 14, 7, 0)])
+    return b"ID3\x04\x00\x00" + size + b"\x00" * payload_size
+
+
+def test_mp3_cbr_duration():
+    assert _mp3_duration(_audio_frame() * 10) == pytest.approx(10 * _FRAME_SECONDS)
+
+
+def test_mp3_skips_id3_tag():
+    assert _mp3_duration(_id3_tag(300) + _audio_frame() * 4) == pytest.approx(4 * _FRAME_SECONDS)
+
+
+def test_mp3_info_frame_is_not_audio_and_gapless_is_removed():
+    data = _info_frame(delay=576, padding=1152) + _audio_frame() * 10
+    assert _mp3_duration(data) == pytest.approx(10 * _FRAME_SECONDS - (576 + 1152) / 44100)
+
+
+def test_mp3_without_frames():
+    assert _mp3_duration(b"not an mp3 file") is None
+
+
+def _write_wav(path, seconds: float, rate: int = 16000, channels: int = 1):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"\x00\x00" * channels * int(rate * seconds))
+
+
+def test_wav_duration(tmp_path):
+    path = tmp_path / "a.wav"
+    _write_wav(path, 1.5, channels=2)
+    assert _wav_duration(path.read_bytes()) == pytest.approx(1.5)
+    assert audio_duration(str(path)) == pytest.approx(1.5)
+
+
+def test_streamed_wav_with_unknown_data_size(tmp_path):
+    path = tmp_path / "a.wav"
+    _write_wav(path, 2.0)
+    data = bytearray(path.read_bytes())
+    data_chunk = data.index(b"data")
+    data[data_chunk + 4:data_chunk + 8] = struct.pack("<I", 0xFFFFFFFF)
+    assert _wav_duration(bytes(data)) == pytest.approx(2.0)
+
+
+def test_wav_rejects_other_formats():
+    assert _wav_duration(b"OggS" + b"\x00" * 40) is None
@@ -0,0 +1,97 @@
+# ProviderGovernor / ProviderLimiter: 按优先级发放并发槽位, 被限流的调用暂停后重新排队
+import asyncio
+
+import pytest
+
+from src.services import rate_limiter
+from src.services.rate_limiter import (
+    ProviderGovernor, ProviderLimiter, concurrency_limit, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW,
+)
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def test_waiters_are_granted_by_priority_then_arrival():
+    async def scenario():
+        limiter = ProviderLimiter("t", concurrency=1)
+        await limiter.aacquire()
+        order = []
+
+        async def worker(name, priority):
+            await limiter.aacquire(priority)
+            order.append(name)
+            limiter.release()
+
+        tasks = [asyncio.create_task(worker(name, priority)) for name, priority in
+                 [("low", PRIORITY_LOW), ("normal-1", PRIORITY_NORMAL), ("high", PRIORITY_HIGH),
+                  ("normal-2", PRIORITY_NORMAL)]]
+        await asyncio.sleep(0.01)
+        assert order == []          # 槽位被占用时谁也拿不到
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return order, limiter.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["high", "normal-1", "normal-2", "low"]
+    assert stats["peak_in_flight"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def scenario():
+        limiter = ProviderLimiter("t", concurrency=1)
+        await limiter.aacquire()
+        waiter = asyncio.create_task(limiter.aacquire())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.release()
+        await asyncio.wait_for(limiter.aacquire(), 1)
+        return limiter.stats()
+
+    assert asyncio.run(scenario())["in_flight"] == 1
+
+
+def test_throttled_call_is_requeued(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_COOLDOWN", 0.01)
+    governor = ProviderGovernor()
+    outcomes = [Throttled("Throttling.RateQuota"), "ok"]
+
+    async def fn():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert asyncio.run(governor.acall("requeue-test", None, fn)) == "ok"
+    stats = governor.stats()["requeue-test"]
+    assert stats["throttled"] == 1
+    assert stats["granted"] == 2
+
+
+def test_requeue_gives_up_after_max_throttles(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_COOLDOWN", 0.01)
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_MAX_THROTTLES", 1)
+    governor = ProviderGovernor()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise Throttled("Throttling")
+
+    with pytest.raises(Throttled):
+        governor.call("requeue-test", None, fn)
+    assert len(calls) == 2
+
+
+def test_concurrency_limit_env_overrides(monkeypatch):
+    monkeypatch.delenv("RATE_LIMIT_VIDEO_CONCURRENCY", raising=False)
+    assert concurrency_limit("video") == rate_limiter.DEFAULT_LIMITS["video"]["concurrency"]
+    monkeypatch.setenv("RATE_LIMIT_VIDEO_CONCURRENCY", "6")
+    assert concurrency_limit("video") == 6
+    monkeypatch.setenv("RATE_LIMIT_VIDEO_WAN2_1_I2V_CONCURRENCY", "2")
+    assert concurrency_limit("video", "wan2.1-i2v") == 2
+    assert concurrency_limit("unknown-kind") == 0
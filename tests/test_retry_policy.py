@@ -0,0 +1,105 @@
+# retry_policy 的错误分类与退避: 临时错误重试, 永久错误 / 超过截止时间立刻放弃
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.services import retry_policy
+from src.services.retry_policy import classify, call_provider, ProviderError, TRANSIENT, PERMANENT, _Retry
+
+
+class SDKError(Exception):
+    def __init__(self, message, status_code=None, code=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(retry_policy, "RETRY_BASE_DELAY", 0.0)
+
+
+@pytest.mark.parametrize("outcome, expected", [
+    (TimeoutError(), TRANSIENT),
+    (asyncio.TimeoutError(), TRANSIENT),
+    (ConnectionError(), TRANSIENT),
+    (SDKError("busy", status_code=503), TRANSIENT),
+    (SDKError("slow down", status_code=429), TRANSIENT),
+    (SDKError("rate", code="Throttling.RateQuota"), TRANSIENT),
+    (SDKError("bad", status_code=400, code="InvalidParameter"), PERMANENT),
+    (SDKError("blocked", status_code=500, code="DataInspectionFailed"), PERMANENT),
+    (SDKError("not found", status_code=404), PERMANENT),
+    (ValueError("cannot parse"), PERMANENT),
+])
+def test_classify_exceptions(outcome, expected):
+    assert classify(outcome) == expected
+
+
+def test_classify_retryable_sdk_error_without_status():
+    error = RuntimeError("websocket closed")
+    error.retryable = True
+    assert classify(error) == TRANSIENT
+
+
+def test_classify_dashscope_responses():
+    assert classify(SimpleNamespace(status_code=200, output={"task_status": "SUCCEEDED"})) is None
+    assert classify(SimpleNamespace(status_code=500, code="InternalError")) == TRANSIENT
+    assert classify(SimpleNamespace(status_code=200, output={"task_status": "FAILED", "code": "InternalError"})) == TRANSIENT
+    assert classify(SimpleNamespace(status_code=200, output={"task_status": "FAILED",
+                                                             "code": "DataInspectionFailed"})) == PERMANENT
+    assert classify("plain result") is None
+
+
+def test_retry_gives_up_past_deadline(monkeypatch):
+    monkeypatch.setattr(retry_policy, "RETRY_BASE_DELAY", 10.0)
+    retry = _Retry("image", "m", max_attempts=5, deadline=1.0)
+    retry.attempts = 2      # 第 2 次失败后的退避区间是 [0, 20], 固定取上限
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: high)
+    with pytest.raises(ProviderError) as info:
+        retry.next_delay(TimeoutError())
+    assert info.value.transient
+    assert info.value.attempts == 2
+
+
+def test_retry_delay_is_capped(monkeypatch):
+    monkeypatch.setattr(retry_policy, "RETRY_BASE_DELAY", 10.0)
+    monkeypatch.setattr(retry_policy, "RETRY_MAX_DELAY", 15.0)
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: high)
+    retry = _Retry("image", "m", max_attempts=5, deadline=100.0)
+    retry.attempts = 3
+    assert retry.next_delay(TimeoutError()) == 15.0
+
+
+def test_call_provider_retries_transient_errors():
+    outcomes = [SDKError("busy", status_code=503), TimeoutError(), "ok"]
+
+    def fn():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert call_provider("retry-test", None, fn, max_attempts=3) == "ok"
+    assert outcomes == []
+
+
+def test_call_provider_stops_on_permanent_error():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise SDKError("bad", status_code=400, code="InvalidParameter")
+
+    with pytest.raises(ProviderError) as info:
+        call_provider("retry-test", None, fn, max_attempts=3)
+    assert info.value.category == PERMANENT
+    assert info.value.code == "InvalidParameter"
+    assert len(calls) == 1
+
+
+def test_call_provider_reports_exhausted_attempts():
+    with pytest.raises(ProviderError) as info:
+        call_provider("retry-test", None, lambda: SimpleNamespace(status_code=502, code="BadGateway"), max_attempts=2)
+    assert info.value.transient
+    assert info.value.attempts == 2
@@ -0,0 +1,116 @@
+# 分段渲染的纯逻辑: 时间轴切分 (body/joint)、片段内容 key、manifest 的记录与清理; 不调用 ffmpeg
+import pytest
+
+from src.services import segment_renderer
+from src.services.segment_renderer import SegmentRenderer, SegmentManifest
+from src.utils.tools import file_sha256
+
+
+@pytest.fixture
+def renderer():
+    return SegmentRenderer(width=640, height=360, fps=24, transition=0.5, workers=1)
+
+
+def _clips(tmp_path, durations):
+    clips = []
+    for i, duration in enumerate(durations):
+        video = tmp_path / f"shot_{i}.mp4"
+        video.write_bytes(f"video-{i}".encode())
+        clips.append({"video_path": str(video), "target_duration": duration})
+    return clips
+
+
+def test_plan_pieces_alternates_body_and_joint(renderer, tmp_path):
+    pieces = renderer.plan_pieces(_clips(tmp_path, [2.0, 3.0, 1.0]), [], str(tmp_path))
+    assert [p["name"] for p in pieces] == ["body_0000", "joint_0000", "body_0001", "joint_0001", "body_0002"]
+    assert [p["offset"] for p in pieces] == pytest.approx([0.0, 1.5, 2.0, 4.0, 4.5])
+    assert [p["length"] for p in pieces] == pytest.approx([1.5, 0.5, 2.0, 0.5, 0.5])
+    # 转场重叠: 总长 = 各镜头时长之和 - 转场数 * 转场时长
+    assert sum(p["length"] for p in pieces) == pytest.approx(6.0 - 2 * 0.5)
+    joint = pieces[1]
+    assert joint["ranges"] == [(1.5, 2.0), (0.0, 0.5)]
+    assert joint["transition"] == 0.5
+
+
+def test_plan_pieces_shrinks_transition_for_short_shots(renderer, tmp_path):
+    pieces = renderer.plan_pieces(_clips(tmp_path, [0.6, 0.6]), [], str(tmp_path))
+    # 转场最长为最短镜头的一半, 每个镜头至少保留一半作为主体
+    assert [p["name"] for p in pieces] == ["body_0000", "joint_0000", "body_0001"]
+    assert pieces[1]["transition"] == pytest.approx(0.3)
+    assert [p["length"] for p in pieces] == pytest.approx([0.3, 0.3, 0.3])
+
+
+def test_plan_pieces_localizes_subtitles(renderer, tmp_path):
+    subtitles = [{"text": "hello", "start": 1.0, "end": 2.5}]
+    pieces = renderer.plan_pieces(_clips(tmp_path, [2.0, 3.0]), subtitles, str(tmp_path))
+    assert [p["subtitles"] for p in pieces] == [
+        [{"text": "hello", "start": 1.0, "end": 1.5}],
+        [{"text": "hello", "start": 0.0, "end": 0.5}],
+        [{"text": "hello", "start": 0.0, "end": 0.5}],
+    ]
+
+
+def test_piece_key_ignores_timeline_position(renderer, tmp_path):
+    clips = _clips(tmp_path, [2.0, 3.0, 1.0])
+    longer = [dict(clips[0], target_duration=4.0)] + clips[1:]
+    before = renderer.plan_pieces(clips, [], str(tmp_path))
+    after = renderer.plan_pieces(longer, [], str(tmp_path))
+    keys_before = [renderer.piece_key(p, ["-crf", "20"], file_sha256) for p in before]
+    keys_after = [renderer.piece_key(p, ["-crf", "20"], file_sha256) for p in after]
+    # 第一个镜头变长只影响 body_0 和 joint_0, 后面的片段照常复用
+    assert keys_before[0] != keys_after[0]
+    assert keys_before[1] != keys_after[1]
+    assert keys_before[2:] == keys_after[2:]
+
+
+def test_piece_key_tracks_content_and_encoding(renderer, tmp_path):
+    clips = _clips(tmp_path, [2.0])
+    piece = renderer.plan_pieces(clips, [], str(tmp_path))[0]
+    key = renderer.piece_key(piece, ["-crf", "20"], file_sha256)
+    assert renderer.piece_key(piece, ["-crf", "20"], file_sha256) == key
+    assert renderer.piece_key(piece, ["-crf", "28"], file_sha256) != key
+    (tmp_path / "shot_0.mp4").write_bytes(b"regenerated")
+    assert renderer.piece_key(piece, ["-crf", "20"], file_sha256) != key
+
+
+def _pieces(*stems):
+    return [{"name": stem, "key": stem * 8} for stem in stems]
+
+
+def _segment(segment_dir, stem):
+    path = segment_dir / f"{(stem * 8)[:32]}.mp4"
+    path.write_bytes(b"segment")
+    return path
+
+
+def test_manifest_record_prunes_only_replaced_pieces(tmp_path):
+    kept, replaced, shared = _segment(tmp_path, "aaaa"), _segment(tmp_path, "bbbb"), _segment(tmp_path, "cccc")
+    SegmentManifest(str(tmp_path)).record("run-1/a.mp4", _pieces("aaaa", "cccc"))
+    SegmentManifest(str(tmp_path)).record("run-2/b.mp4", _pieces("bbbb", "cccc"))
+    SegmentManifest(str(tmp_path)).record("run-2/b.mp4", _pieces("dddd", "cccc"))
+    assert kept.exists() and shared.exists()
+    assert not replaced.exists()
+    assert set(SegmentManifest(str(tmp_path)).data["outputs"]) == {"run-1/a.mp4", "run-2/b.mp4"}
+
+
+def test_manifest_keeps_reserved_pieces_until_released(tmp_path):
+    piece = _segment(tmp_path, "aaaa")
+    SegmentManifest(str(tmp_path)).record("run-1/a.mp4", _pieces("aaaa"))
+    SegmentManifest(str(tmp_path)).reserve("run-2/a.mp4", _pieces("aaaa"))
+    SegmentManifest(str(tmp_path)).record("run-1/a.mp4", _pieces("bbbb"))
+    assert piece.exists()
+    assert SegmentManifest(str(tmp_path)).data["orphans"] == [("aaaa" * 8)[:32]]
+    # 登记的渲染失败撤销后, 下一次记录把暂缓的片段清理掉
+    SegmentManifest(str(tmp_path)).release("run-2/a.mp4")
+    SegmentManifest(str(tmp_path)).record("run-3/c.mp4", _pieces("cccc"))
+    assert not piece.exists()
+
+
+def test_manifest_evicts_oldest_outputs(tmp_path, monkeypatch):
+    monkeypatch.setattr(segment_renderer, "SEGMENT_CACHE_MAX_OUTPUTS", 2)
+    oldest = _segment(tmp_path, "aaaa")
+    for key, stem in [("run-1", "aaaa"), ("run-2", "bbbb"), ("run-3", "cccc")]:
+        _segment(tmp_path, stem)
+        SegmentManifest(str(tmp_path)).record(key, _pieces(stem))
+    assert not oldest.exists()
+    assert set(SegmentManifest(str(tmp_path)).data["outputs"]) == {"run-2", "run-3"}
@@ -0,0 +1,34 @@
+# GraphState 的 Reducer: 并行镜头各自返回一条分镜 / 若干日志, 合并结果必须与完成顺序无关
+from src.core import state
+from src.core.state import merge_storyboard, append_logs
+
+
+def test_merge_storyboard_merges_fields_by_id():
+    left = [{"id": 0, "text_content": "a"}, {"id": 1, "text_content": "b"}]
+    right = [{"id": 1, "audio_path": "1.mp3"}]
+    merged = merge_storyboard(left, right)
+    assert merged == [{"id": 0, "text_content": "a"}, {"id": 1, "text_content": "b", "audio_path": "1.mp3"}]
+
+
+def test_merge_storyboard_orders_by_id_and_keeps_inputs_untouched():
+    left = [{"id": 2, "text_content": "c"}]
+    right = [{"id": 0, "image_path": "0.png"}, {"id": 2, "video_path": "2.mp4"}]
+    merged = merge_storyboard(left, right)
+    assert [item["id"] for item in merged] == [0, 2]
+    assert merged[1] == {"id": 2, "text_content": "c", "video_path": "2.mp4"}
+    assert left == [{"id": 2, "text_content": "c"}]
+
+
+def test_merge_storyboard_accepts_missing_sides():
+    assert merge_storyboard(None, None) == []
+    assert merge_storyboard(None, [{"id": 0}]) == [{"id": 0}]
+
+
+def test_append_logs_treats_string_as_one_entry():
+    assert append_logs(["a"], "bc") == ["a", "bc"]
+    assert append_logs(None, None) == []
+
+
+def test_append_logs_keeps_newest_entries(monkeypatch):
+    monkeypatch.setattr(state, "MAX_LOG_ENTRIES", 3)
+    assert append_logs(["1", "2"], ["3", "4"]) == ["2", "3", "4"]